@@ -13,8 +13,11 @@ Inputs are '.s' files. output is '.o4' for 'ld.py'
 
 import re
 import sys
+import time
 import codecs
+import collections
 from msp430.asm.infix2postfix import infix2postfix
+from msp430.asm import object_file
 
 
 # regular expressions used to parse the asm source
@@ -31,6 +34,8 @@ re_asmstatement = re.compile(r'''^
 
 re_expression = re.compile(r'(?P<NAME>\w+?)=(?P<EXPR>.+)', re.UNICODE)
 
+re_mnemonic = re.compile(r'(?P<INSN>\.?\w+)(?P<MODE>\.\w)?$', re.UNICODE)
+
 re_operand = re.compile(r'''
         (?P<STRING>         "(?P<STR>[^"\\]*?(\\.[^"\\]*?)*?)"     ) |
         (?P<SPACE>          \s+                         ) |
@@ -71,16 +76,55 @@ class AssemblerError(Exception):
     """Exception class for errors that occur during assembling."""
 
 
+class LRUCache(object):
+    """\
+    A size limited mapping. When it is full, the least recently used entry is
+    dropped.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+
+    def __getitem__(self, key):
+        """Get an entry and mark it as recently used. KeyError if missing."""
+        value = self._entries.pop(key)
+        self._entries[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._entries[key] = value
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)  # the oldest entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+
 class MSP430Assembler(object):
     """MSP430/MSP430X assembler. It outputs instructions for ld.py"""
 
-    def __init__(self, msp430x=False, debug=False):
+    def __init__(self, msp430x=False, debug=False, cache_size=4096):
         """\
         When msp430x is set to True: enable extended instruction set, otherwise
         only the core 16 bit instructions are available.
+
+        cache_size limits the number of entries in each of the caches for
+        mnemonics, statements, operand strings, addressing modes and
+        expressions. Generated code (e.g. from the Forth cross compiler)
+        repeats the same instructions and operands very often, so that most of
+        the parsing is skipped.
         """
         self.debug = debug
 
+        self.mnemonic_cache = LRUCache(cache_size)
+        self.statement_cache = LRUCache(cache_size)
+        self.operand_cache = LRUCache(cache_size)
+        self.address_mode_cache = LRUCache(cache_size)
+        self.argument_cache = LRUCache(cache_size)
+
         # string-function mapping. all assembler instructions are registered in
         # this dictionary
         self.instructions = {}
@@ -158,9 +202,15 @@ class MSP430Assembler(object):
         Prepare a parameter for the linker. Expressions are evaluated.
         """
         try:
-            return infix2postfix(value, variable_prefix=u'GET-SYMBOL ')
+            return self.argument_cache[value]
+        except KeyError:
+            pass
+        try:
+            result = infix2postfix(value, variable_prefix=u'GET-SYMBOL ')
         except ValueError:
             raise AssemblerError('invalid expression: {!r}'.format(value))
+        self.argument_cache[value] = result
+        return result
 
     def expand_label(self, label):
         """\
@@ -194,7 +244,22 @@ class MSP430Assembler(object):
         """\
         Return a tuple:
         (address mode, register number, memory value or None, 0=abs 1=relative to pc)
+
+        The result only depends on the operand text, so it is cached.
         """
+        # the instruction name only matters for the PUSH exception of the
+        # constant generator optimization
+        key = (xxx[0], xxx[1], constreg, insn == 'PUSH')
+        try:
+            return self.address_mode_cache[key]
+        except KeyError:
+            pass
+        result = self._encodeArg(insn, xxx, constreg)
+        self.address_mode_cache[key] = result
+        return result
+
+    def _encodeArg(self, insn, xxx, constreg):
+        """Uncached implementation of _buildArg."""
         (mode, value, match_obj) = xxx
         value = value.strip()
         if mode == 'IMMEDIATE':
@@ -736,6 +801,11 @@ class MSP430Assembler(object):
 
     def insn_BR_1(self, insn, mode, arg):
         """Unconditionally jump to given target"""
+        asrc, src, op, rel = self._buildArg('MOV', arg)
+        if (asrc, src) == (3, 0):
+            # immediate target (MOV #x, PC), the linker may replace it with
+            # a JMP when the target is near
+            return u'0x4030 {} BRANCH'.format(self.argument(op))
         return self._emulation('MOV', '', u'{}, PC'.format(arg[1]))
 
     def insn_DINT_0(self, insn, mode):
@@ -931,6 +1001,16 @@ class MSP430Assembler(object):
         Split a comma separated argument string into a list of argument
         tuples (address_mode, value, match_obj).
         """
+        try:
+            return list(self.operand_cache[arg_str])
+        except KeyError:
+            pass
+        args = self._tokenize_operands(arg_str)
+        self.operand_cache[arg_str] = tuple(args)
+        return args
+
+    def _tokenize_operands(self, arg_str):
+        """Uncached implementation of tokenize_operands."""
         args = []
         if arg_str:
             pos = 0
@@ -954,8 +1034,61 @@ class MSP430Assembler(object):
 
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
+    def split_plain_statement(self, line):
+        """\
+        Fast path for the most common form of lines: "<whitespace>INSN[.MODE]
+        [OPERANDS]", without label, expression or comment. Return a tuple
+        (insn, mode, operands) or None if the line needs the full parser.
+        """
+        if line[:1] not in (' ', '\t') or ';' in line or '//' in line:
+            return None
+        parts = line.split(None, 1)
+        if not parts:
+            return None
+        try:
+            mnemonic = self.mnemonic_cache[parts[0]]
+        except KeyError:
+            m = re_mnemonic.match(parts[0])
+            if m:
+                mnemonic = (m.group('INSN').upper(), (m.group('MODE') or '').upper())
+            else:
+                mnemonic = None
+            self.mnemonic_cache[parts[0]] = mnemonic
+        if mnemonic is None:
+            return None
+        insn, mode = mnemonic
+        if len(parts) > 1:
+            return insn, mode, parts[1].rstrip()
+        return insn, mode, None
+
+    def encode_statement(self, insn, mode, arg_str):
+        """\
+        Return the object code for one instruction with its operands. The
+        result only depends on the parameters, so it is cached.
+        """
+        key = (insn, mode, arg_str)
+        try:
+            return self.statement_cache[key]
+        except KeyError:
+            pass
+        if insn not in self.instructions:
+            raise AssemblerError(u'Syntax Error: unknown instruction {!r}'.format(insn))
+        n_args, function, doc = self.instructions[insn]
+        args = self.tokenize_operands(arg_str)
+        if n_args is not None and len(args) != n_args:
+            raise AssemblerError(
+                    u'Bad number of arguments for {} (found {}, required {})'.format(
+                            insn, len(args), n_args))
+        iop = function(insn, mode, *args)
+        self.statement_cache[key] = iop
+        return iop
+
     def assemble(self, f, filename=None, output=sys.stdout):
-        """Build a list of pseudo instructions from the source."""
+        """\
+        Build a list of pseudo instructions from the source. Returns the
+        number of lines read.
+        """
+        lines_read = 0
         lineno = 0
         if filename:
             output.write(u'FILENAME {}\n'.format(filename))   # XXX escape string (whitespace, encoding)
@@ -968,88 +1101,85 @@ class MSP430Assembler(object):
                 lineno += 1
                 if not line:
                     break              # if end of file
+                lines_read += 1
 
-                # catch line/filename hints from the preprocessor
-                m = re_line_hint.match(line)
-                if m:
-                    # get line number minus one because we are pre-incrementing
-                    # lineno above and the hint is for the following line
-                    lineno = int(m.group(1)) - 1
-                    if filename != m.group(2):
-                        filename = m.group(2)
-                        output.write(u'FILENAME {}\n'.format(filename))   # XXX escape string (whitespace, encoding)
-                    continue
-
-                # remove line comments
-                line = re_comment.sub('', line)  # cut out single line comments
-                line = line.rstrip()            # strip whitespace/EOL
-                if not line:
-                    continue           # skip empty lines
-
-                # test for expression like lines: "SYMBOL=VALUE"
-                g = re_expression.match(line)
-                if g:
-                    name = self.expand_label(g.group('NAME').strip())
-                    if self.debug:
-                        sys.stderr.write('{}:{}: {} = {}\n'.format(
-                            filename,
-                            lineno,
-                            name,
-                            g.group('EXPR').strip()))
-                    output.write('{} LINE    {} CONSTANT-SYMBOL {}\n'.format(
-                            lineno,
-                            self.argument(g.group('EXPR').strip()),
-                            name))
-                    continue
-
-                # test for assembler statements: "[LABEL:] INSN [SRC] [DST] [...]
-                g = re_asmstatement.match(line)
-                if g:
+                statement = self.split_plain_statement(line)
+                if statement is not None:
+                    label = None
+                    insn, mode, arg_str = statement
+                else:
+                    # catch line/filename hints from the preprocessor
+                    m = re_line_hint.match(line)
+                    if m:
+                        # get line number minus one because we are pre-incrementing
+                        # lineno above and the hint is for the following line
+                        lineno = int(m.group(1)) - 1
+                        if filename != m.group(2):
+                            filename = m.group(2)
+                            output.write(u'FILENAME {}\n'.format(filename))   # XXX escape string (whitespace, encoding)
+                        continue
+
+                    # remove line comments
+                    line = re_comment.sub('', line)  # cut out single line comments
+                    line = line.rstrip()            # strip whitespace/EOL
+                    if not line:
+                        continue           # skip empty lines
+
+                    # test for expression like lines: "SYMBOL=VALUE"
+                    g = re_expression.match(line)
+                    if g:
+                        name = self.expand_label(g.group('NAME').strip())
+                        if self.debug:
+                            sys.stderr.write('{}:{}: {} = {}\n'.format(
+                                filename,
+                                lineno,
+                                name,
+                                g.group('EXPR').strip()))
+                        output.write('{} LINE    {} CONSTANT-SYMBOL {}\n'.format(
+                                lineno,
+                                self.argument(g.group('EXPR').strip()),
+                                name))
+                        continue
+
+                    # test for assembler statements: "[LABEL:] INSN [SRC] [DST] [...]
+                    # (the expression always matches, all parts are optional)
+                    g = re_asmstatement.match(line)
                     #~ print g.groups()
                     label = self.expand_label(g.group(u'LABEL'))
                     insn = (g.group(u'INSN') or '').upper()
                     mode = (g.group(u'MODE') or '').upper()
                     arg_str = g.group(u'OPERANDS')
+                if self.debug:
                     args = self.tokenize_operands(arg_str)
-                    if self.debug:
-                        sys.stderr.write(u'{}:{}: {:<16} {:<8} {}\n'.format(
-                            filename,
-                            lineno,
-                            label is not None and label + u':' or u'',
-                            u'{}{}'.format(insn, mode),
-                            u', '.join(x[1] for x in args)))
-                    if label:
-                        output.write(u'{} LINE    CREATE-SYMBOL {}\n'.format(lineno, label))
-                    if insn:
-                        if insn in self.instructions:
-                            n_args, function, doc = self.instructions[insn]
-
-                            if n_args is not None and len(args) != n_args:
-                                raise AssemblerError(
-                                        u'Bad number of arguments for {} (found {}, required {})'.format(
-                                                insn, len(args), n_args))
-                            else:
-                                iop = function(insn, mode, *args)
-                                if iop:
-                                    output.write(u'{} LINE    '.format(lineno))
-                                    output.write(iop)
-                                    if self.debug:
-                                        # in debug mode add source line as comment
-                                        output.write(u' ' * max(0, (60 - len(iop))))
-                                        output.write(u' # {}{} {}\n'.format(
-                                                insn,
-                                                mode,
-                                                u', '.join(x[1] for x in args)))
-                                    else:
-                                        output.write('\n')
+                    sys.stderr.write(u'{}:{}: {:<16} {:<8} {}\n'.format(
+                        filename,
+                        lineno,
+                        label is not None and label + u':' or u'',
+                        u'{}{}'.format(insn, mode),
+                        u', '.join(x[1] for x in args)))
+                if label:
+                    output.write(u'{} LINE    CREATE-SYMBOL {}\n'.format(lineno, label))
+                if insn:
+                    iop = self.encode_statement(insn, mode, arg_str)
+                    if iop:
+                        output.write(u'{} LINE    '.format(lineno))
+                        output.write(iop)
+                        if self.debug:
+                            # in debug mode add source line as comment
+                            output.write(u' ' * max(0, (60 - len(iop))))
+                            output.write(u' # {}{} {}\n'.format(
+                                    insn,
+                                    mode,
+                                    u', '.join(x[1] for x in args)))
                         else:
-                            raise AssemblerError(u'Syntax Error: unknown instruction {!r}'.format(insn))
+                            output.write('\n')
         except AssemblerError as e:
             # annotate exception with location in source file
             e.line = lineno
             e.filename = filename
             e.text = line
             raise e
+        return lines_read
 
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
@@ -1081,6 +1211,12 @@ def main():
         default='-',
         metavar='FILE')
 
+    group.add_argument(
+        '-b', '--binary',
+        action='store_true',
+        default=False,
+        help='write a binary object file (faster to load for the linker)')
+
     parser.add_argument(
         '-i', '--instructions',
         action='store_true',
@@ -1134,7 +1270,15 @@ def main():
         sys.stderr.write('{:-^70}\n'.format((' BEGIN {} '.format(filename))))
 
     try:
-        assembler.assemble(args.SOURCE, args.input_filename, output=args.outfile)
+        t_start = time.time()
+        if args.binary:
+            output = object_file.BinaryObjectWriter()
+        else:
+            output = args.outfile
+        lines_read = assembler.assemble(args.SOURCE, args.input_filename, output=output)
+        if args.binary:
+            output.save(getattr(args.outfile, 'buffer', args.outfile))
+        t_used = time.time() - t_start
     except AssemblerError as e:
         sys.stderr.write(u'{e.filename}:{e.line}: {e}\n'.format(e=e))
         if args.debug:
@@ -1145,6 +1289,10 @@ def main():
     if args.debug:
         sys.stderr.write('{:-^70}\n'.format((' END {} '.format(filename))))
 
+    if args.verbose:
+        sys.stderr.write('{}: {} lines in {:.3f} s ({:.0f} lines/s)\n'.format(
+            filename, lines_read, t_used, lines_read / max(t_used, 1e-6)))
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of https://github.com/zsquareplusc/python-msp430-tools
+# (C) 2026 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Build driver for the forth -> cpp -> as -> ld pipeline.
+
+The tools are run in-process, the stage for a source is selected by its file
+name extension:
+
+- ``.forth``: msp430.asm.forth, the result is preprocessed
+- ``.S``: msp430.asm.cpp, the result is assembled
+- ``.s``, ``.s-cpp``: msp430.asm.as
+- ``.o4``: object file, passed to the linker as it is
+
+``lib:NAME`` can be used to take a source from the library of msp430.asm.lib
+(e.g. ``lib:asm/startup.S``).
+
+The result of each stage is saved in the disk cache (see msp430.asm.cache),
+together with the list of files that were read while it was running
+(``INCLUDE`` of the Forth files, ``#include`` of the preprocessor). The key
+of an entry is made from the input data (the contents of the source or the
+output of the previous stage), the options and the version of the tool. A
+stage is only executed again when its input changed or one of the recorded
+files was modified.
+"""
+
+import sys
+import os
+import glob
+import codecs
+import hashlib
+import logging
+import pkgutil
+from io import BytesIO, StringIO
+from msp430.asm import cache
+
+# files of the package (relative to msp430/asm) that are part of the key of a
+# stage, so that a new version of a tool invalidates its cache entries
+TOOL_FILES = {
+    'forth': ['forth.py', 'rpn.py', 'forth_optimizer.py', 'forth/*.forth'],
+    'cpp': ['cpp.py'],
+    'as': ['as.py', 'object_file.py'],
+    'ld': ['ld.py', 'object_file.py', 'rpn.py', 'mcu_definition_parser.py', 'definitions/*.txt'],
+}
+
+# name of the result of a stage, makefile conventions of the examples
+OUTPUT_EXTENSION = {
+    'forth': '.S',
+    'cpp': '.s-cpp',
+    'as': '.o4',
+}
+
+
+class BuildError(Exception):
+    """Build failed, the tool has already printed details"""
+
+
+def file_digest(path):
+    """Return the SHA1 of the file contents or None if it can not be read"""
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except (IOError, OSError):
+        return None
+
+
+class Builder(object):
+    """\
+    Run the stages for a list of sources and cache the results. The files
+    each source depends on are available in the dictionary ``dependencies``
+    after a build.
+    """
+
+    def __init__(self, mcu='MSP430F1121', include_path=(), defines=(), forth_defines=(),
+                 optimize=0, force=False, save_temps=False):
+        self.mcu = mcu
+        self.include_path = list(include_path)
+        self.defines = list(defines)
+        self.forth_defines = list(forth_defines)
+        self.optimize = optimize
+        self.force = force
+        self.save_temps = save_temps
+        self.logger = logging.getLogger('build')
+        self.dependencies = {}
+        self.executed = []
+        self.reused = []
+        self._tool_keys = {}
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def tool_key(self, stage):
+        """Fingerprint of the package files implementing a stage"""
+        if stage not in self._tool_keys:
+            base = os.path.dirname(os.path.abspath(__file__))
+            items = []
+            for pattern in TOOL_FILES[stage]:
+                for path in sorted(glob.glob(os.path.join(base, pattern))):
+                    items.extend([os.path.relpath(path, base), ('file', path)])
+            self._tool_keys[stage] = cache.fingerprint(*items)
+        return self._tool_keys[stage]
+
+    def options(self, stage):
+        """The options that influence the result of a stage"""
+        if stage == 'forth':
+            return [self.include_path, self.forth_defines, self.optimize]
+        elif stage == 'cpp':
+            return [self.include_path, self.defines]
+        elif stage == 'ld':
+            return [self.mcu.upper()]
+        return []
+
+    def run(self, stage, name, data, function):
+        """\
+        Run function(name, data) for a stage or get the result from the cache.
+        The function returns a tuple (output, list of files that were read),
+        which is also the return value.
+        """
+        key = cache.fingerprint(stage, self.tool_key(stage), self.options(stage), name, data)
+        entry_name = 'build-{}-{}.pickle'.format(stage, key)
+        if not self.force:
+            entry = cache.load(entry_name, key)
+            if entry is not None:
+                dependencies, output = entry
+                if all(file_digest(path) == digest for path, digest in dependencies):
+                    self.logger.info('{} {}: up to date'.format(stage, name))
+                    self.reused.append((stage, name))
+                    return output, [path for path, digest in dependencies]
+        self.logger.info('{} {}: running'.format(stage, name))
+        output, paths = function(name, data)
+        dependencies = [(path, file_digest(path)) for path in paths]
+        cache.save(entry_name, key, (dependencies, output))
+        self.executed.append((stage, name))
+        return output, paths
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def stage_forth(self, name, data):
+        """Cross compile a Forth source, return the assembler source"""
+        from msp430.asm import forth, rpn
+        instance = forth.Forth()
+        instance.init()
+        if self.optimize:
+            from msp430.asm import forth_optimizer
+            instance.optimizer = forth_optimizer.ThreadOptimizer(instance, self.optimize)
+        instance.include_path = [os.path.dirname(os.path.abspath(name))] + self.include_path
+        for definition in self.forth_defines:
+            symbol, _, value = definition.partition('=')
+            instance.namespace[symbol.lower()] = value or '1'
+        try:
+            instance.interpret_sequence(rpn.tokens_in_string(data.decode('utf-8'), name=name, include_newline=True))
+        except rpn.RPNError as e:
+            sys.stderr.write(u'{e.filename}:{e.lineno}: {e}\n'.format(e=e))
+            raise BuildError('forth failed for {}'.format(name))
+        output = StringIO()
+        instance.doctree.render(output)
+        # the names of the included files are recorded, find the files as the
+        # include did (the internal library is covered by the tool key)
+        paths = []
+        for included in instance.included_files:
+            for prefix in instance.include_path:
+                path = os.path.join(prefix, included)
+                if os.path.exists(path):
+                    paths.append(os.path.abspath(path))
+                    break
+        return output.getvalue().encode('utf-8'), paths
+
+    def stage_cpp(self, name, data):
+        """Run the preprocessor, return the output"""
+        from msp430.asm import cpp
+        preprocessor = cpp.Preprocessor()
+        preprocessor.precompiled_headers = True
+        d = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'include')
+        preprocessor.include_path.append(d)
+        preprocessor.include_path.append(os.path.join(d, 'upstream'))
+        preprocessor.include_path.extend(self.include_path)
+        for definition in self.defines:
+            symbol, _, value = definition.partition('=')
+            preprocessor.namespace.defines[symbol] = value or '1'
+        paths = []
+        output = StringIO()
+        try:
+            error_found = preprocessor.preprocess(
+                StringIO(data.decode('utf-8')), output, name,
+                lambda path: paths.append(os.path.abspath(path)))
+        except cpp.PreprocessorError as e:
+            sys.stderr.write(u'{e.filename}:{e.line}: {e}\n'.format(e=e))
+            error_found = True
+        if error_found:
+            raise BuildError('cpp failed for {}'.format(name))
+        return output.getvalue().encode('utf-8'), paths
+
+    def stage_as(self, name, data):
+        """Assemble, return a binary object file"""
+        import importlib
+        from msp430.asm import object_file
+        assembler_module = importlib.import_module('msp430.asm.as')
+        assembler = assembler_module.MSP430Assembler()
+        output = object_file.BinaryObjectWriter()
+        try:
+            assembler.assemble(StringIO(data.decode('utf-8')), name, output=output)
+        except assembler_module.AssemblerError as e:
+            sys.stderr.write(u'{e.filename}:{e.line}: {e}\n'.format(e=e))
+            raise BuildError('as failed for {}'.format(name))
+        return output.object_code().to_bytes(), []
+
+    def stage_ld(self, name, data):
+        """Link the object files (data is a list of (name, object) tuples)"""
+        from msp430.asm import ld, object_file, mcu_definition_parser
+        instructions = object_file.ObjectCode()
+        for object_name, object_data in data:
+            instructions.add_location(object_name, None)
+            instructions.extend(['reset', 'filename', object_name])
+            try:
+                instructions.append_object(object_file.load(BytesIO(object_data), object_name))
+            except object_file.ObjectFileError as e:
+                sys.stderr.write('ld: {}: {}\n'.format(object_name, e))
+                raise BuildError('ld failed')
+        linker = ld.Linker(instructions)
+        try:
+            linker.segments_from_definition(mcu_definition_parser.load_internal_expanded(self.mcu.upper()))
+        except KeyError:
+            raise BuildError('unknown MCU: {}'.format(self.mcu))
+        try:
+            linker.pass_one()
+            linker.pass_two()
+            linker.pass_three()
+        except ld.LinkError as e:
+            sys.stderr.write(u'{e.filename}:{e.lineno}: {e}\n'.format(e=e))
+            raise BuildError('ld failed')
+        return ld.to_TI_Text(linker.segments).encode('utf-8'), []
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def read_source(self, source):
+        """Return the name and contents of a source file or library entry"""
+        if source.startswith('lib:'):
+            name = source[4:]
+            try:
+                return os.path.basename(name), pkgutil.get_data('msp430.asm', 'librarian/{}'.format(name))
+            except IOError:
+                raise BuildError('lib: {}: File not found'.format(name))
+        try:
+            with open(source, 'rb') as f:
+                return source, f.read()
+        except IOError:
+            raise BuildError('{}: File not found'.format(source))
+
+    def _save_temp(self, name, data):
+        if self.save_temps:
+            with open(os.path.basename(name), 'wb') as f:
+                f.write(data)
+
+    def build_object(self, source):
+        """Run the stages for one source, return (name, binary object)"""
+        name, data = self.read_source(source)
+        base, extension = os.path.splitext(name)
+        stages = {
+            '.forth': ['forth', 'cpp', 'as'],
+            '.S': ['cpp', 'as'],
+            '.s': ['as'],
+            '.s-cpp': ['as'],
+            '.o4': [],
+        }
+        if extension not in stages:
+            raise BuildError('{}: unknown file type'.format(source))
+        dependencies = self.dependencies.setdefault(source, [])
+        if not source.startswith('lib:'):
+            dependencies.append(os.path.abspath(source))
+        for stage in stages[extension]:
+            data, paths = self.run(stage, name, data, getattr(self, 'stage_{}'.format(stage)))
+            dependencies.extend(paths)
+            name = base + OUTPUT_EXTENSION[stage]
+            self._save_temp(name, data)
+        return name, data
+
+    def build(self, sources):
+        """Build and link the sources, return the TI-Text output"""
+        objects = [self.build_object(source) for source in sources]
+        return self.run('ld', '<link>', objects, self.stage_ld)[0]
+
+
+def main():
+    import argparse
+    logging.basicConfig(format='%(name)s: %(message)s')
+
+    parser = argparse.ArgumentParser(description="""\
+Build a program from Forth, assembler and object files. The results of the
+stages are cached, only stages with changed inputs are executed.""")
+
+    group = parser.add_argument_group('Input')
+
+    group.add_argument(
+        'SOURCE',
+        nargs='+',
+        help='.forth, .S, .s, .s-cpp or .o4 files or lib:NAME for a library file')
+
+    group.add_argument(
+        '-I', '--include-path',
+        action='append',
+        metavar='PATH',
+        default=[],
+        help='Add directory to the search path list for includes (forth and cpp)')
+
+    group.add_argument(
+        '-D', '--define',
+        action='append',
+        dest='defines',
+        metavar='SYM[=VALUE]',
+        default=[],
+        help='define symbol for the preprocessor')
+
+    group.add_argument(
+        '--forth-define',
+        action='append',
+        dest='forth_defines',
+        metavar='SYM[=VALUE]',
+        default=[],
+        help='define symbol for Forth sources (MCU is predefined)')
+
+    group.add_argument(
+        '-m', '--mcu',
+        help='name of the MCU (symbolic) (default: %(default)s)',
+        metavar='MCU',
+        default='MSP430F1121')
+
+    group = parser.add_argument_group('Output')
+
+    group.add_argument(
+        '-o', '--outfile',
+        type=argparse.FileType('w'),
+        default='-',
+        help='name of the TI-Text file (default: %(default)s)',
+        metavar='FILE')
+
+    group.add_argument(
+        '-O', '--optimize',
+        type=int,
+        choices=(0, 1, 2),
+        default=0,
+        metavar='LEVEL',
+        help='optimization level for Forth sources (default: %(default)s)')
+
+    group.add_argument(
+        '--save-temps',
+        action='store_true',
+        default=False,
+        help='write the intermediate files to the current directory')
+
+    group.add_argument(
+        '--dependencies',
+        action='store_true',
+        default=False,
+        help='print the files each source depends on (to stderr)')
+
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        default=False,
+        help='do not use cached results')
+
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        default=False,
+        help='print status messages')
+
+    args = parser.parse_args()
+
+    logging.getLogger('build').setLevel(logging.INFO if args.verbose else logging.WARN)
+
+    if sys.version_info < (3, 0):
+        # XXX make stderr unicode capable
+        sys.stderr = codecs.getwriter("utf-8")(sys.stderr)
+
+    forth_defines = args.forth_defines
+    if not any(d.partition('=')[0].lower() == 'mcu' for d in forth_defines):
+        forth_defines = ['MCU={}'.format(args.mcu)] + forth_defines
+
+    builder = Builder(
+        mcu=args.mcu,
+        include_path=[os.path.abspath(path) for path in args.include_path],
+        defines=args.defines,
+        forth_defines=forth_defines,
+        optimize=args.optimize,
+        force=args.force,
+        save_temps=args.save_temps)
+    try:
+        titext = builder.build(args.SOURCE)
+    except BuildError as e:
+        sys.stderr.write('build: {}\n'.format(e))
+        sys.exit(1)
+    args.outfile.write(titext.decode('utf-8'))
+
+    if args.dependencies:
+        for name, paths in sorted(builder.dependencies.items()):
+            sys.stderr.write(u'{}: {}\n'.format(name, u' '.join(sorted(set(paths)))))
+    if args.verbose:
+        sys.stderr.write('build: {} stage(s) executed, {} up to date\n'.format(
+            len(builder.executed), len(builder.reused)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of https://github.com/zsquareplusc/python-msp430-tools
+# (C) 2026 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Disk cache for data that is expensive to calculate, but only depends on
+the sources of this package (e.g. parsed definition files, interpreter
+snapshots).
+
+Entries are stored in the user's cache directory, along with a key. An entry
+is only used when the key matches, so it is usually made from a fingerprint
+of the files the data was derived from.
+
+The location can be changed with the environment variable
+``MSP430_TOOLS_CACHE``, setting it to an empty string disables the cache.
+"""
+
+import os
+import sys
+import hashlib
+import pickle
+
+
+def cache_directory():
+    """Return the path of the cache directory or None if caching is disabled."""
+    path = os.environ.get('MSP430_TOOLS_CACHE')
+    if path is None:
+        if sys.platform == 'win32':
+            base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+        elif sys.platform == 'darwin':
+            base = os.path.expanduser('~/Library/Caches')
+        else:
+            base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+        path = os.path.join(base, 'python-msp430-tools')
+    return path or None
+
+
+def fingerprint(*items):
+    """\
+    Return a hex digest over the given items. Strings are hashed as they are,
+    file names given as ('file', path) by their contents. None is returned if
+    a file can not be read (e.g. only .pyc files are installed or the package
+    is in a zip file), load() and save() ignore entries without a key.
+    """
+    digest = hashlib.sha1()
+    digest.update('{}.{}'.format(*sys.version_info[:2]).encode('ascii'))
+    for item in items:
+        if isinstance(item, tuple) and item[0] == 'file':
+            try:
+                with open(item[1], 'rb') as f:
+                    digest.update(f.read())
+            except (IOError, OSError):
+                return None
+        else:
+            digest.update(repr(item).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def load(name, key):
+    """Return the cached object with given name, None if missing or outdated."""
+    directory = cache_directory()
+    if not directory or key is None:
+        return None
+    try:
+        with open(os.path.join(directory, name), 'rb') as f:
+            stored_key, obj = pickle.load(f)
+    except Exception:   # missing, corrupt or written by an incompatible version
+        return None
+    if stored_key != key:
+        return None
+    return obj
+
+
+def save(name, key, obj):
+    """Store an object in the cache. Errors are ignored, the cache is optional."""
+    directory = cache_directory()
+    if not directory or key is None:
+        return
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # write to a temporary file and rename, so that concurrent readers
+        # never see a partial file
+        import tempfile
+        fd, temp_name = tempfile.mkstemp(dir=directory, prefix=name, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((key, obj), f, 2)
+        try:
+            os.replace(temp_name, os.path.join(directory, name))
+        except AttributeError:  # Python 2
+            if os.path.exists(os.path.join(directory, name)):
+                os.remove(os.path.join(directory, name))
+            os.rename(temp_name, os.path.join(directory, name))
+    except (IOError, OSError):
+        pass
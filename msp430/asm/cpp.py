@@ -20,8 +20,10 @@ import re
 import logging
 import binascii
 import codecs
+import operator
 from msp430.asm import infix2postfix
 from msp430.asm import rpn
+from msp430.asm import cache
 
 
 def hexlify(text):
@@ -105,12 +107,58 @@ class Evaluator(rpn.RPN):
     """\
     An RPN calculator with infix to postfix converter, so that expressions for
     #if can be evaluated.
+
+    Expressions are converted once and translated to a Python function that is
+    cached per expression string (headers test the same conditions over and
+    over again). The cache is shared by all instances. Expressions that can
+    not be translated and the error cases are handled by the RPN interpreter.
     """
     re_defined_translation = re.compile(r'LOOKUP (\w+?) defined')
 
+    # templates for the translation of the postfix words to Python
+    unary_operators = {
+        'neg': u'(-{})',
+        '~': u'(~{})',
+        'not': u'(not {})',
+        '!': u'(not {})',
+    }
+    binary_operators = {
+        '+': u'({} + {})',
+        '-': u'({} - {})',
+        '*': u'({} * {})',
+        '/': u'truediv({}, {})',
+        '|': u'({} | {})',
+        '&': u'({} & {})',
+        '^': u'({} ^ {})',
+        '<<': u'({} << {})',
+        '>>': u'({} >> {})',
+        '<': u'bool({} < {})',
+        '<=': u'bool({} <= {})',
+        '>': u'bool({} > {})',
+        '>=': u'bool({} >= {})',
+        '==': u'bool({} == {})',
+        '!=': u'bool({} != {})',
+        # no short circuit, the RPN words evaluate both operands too
+        'and': u'logical_and({}, {})',
+        '&&': u'logical_and({}, {})',
+        'or': u'logical_or({}, {})',
+        '||': u'logical_or({}, {})',
+    }
+    # globals of the translated functions
+    translation_namespace = {
+        '__builtins__': {},
+        'bool': bool,
+        'truediv': operator.truediv,
+        'logical_and': lambda y, x: bool(y and x),
+        'logical_or': lambda y, x: bool(y or x),
+    }
+    # expression -> (RPN words, function)
+    compiled = {}
+
     def __init__(self):
         rpn.RPN.__init__(self)
         self.defines = {}
+        self.compile_expressions = True
         # add some aliases for logic operators
         self.builtins['!'] = self.builtins['not']
         self.builtins['&&'] = self.builtins['and']
@@ -122,18 +170,10 @@ class Evaluator(rpn.RPN):
     @rpn.word('LOOKUP')
     def word_LOOKUP(self, stack):
         key = self.next_word()
-        #~ print "LOOKUP", key
-        if key in self.defines:
-            try:
-                backup = self[:]
-                value = self.eval(self.defines[key])
-                self[:] = backup  # XXX better way to do this
-                self.push(value)
-            except Exception:
-                #~ print "RPN eval failed using directly: %r %r %s" % (key, self.defines[key], e) # XXX debug
-                self.push(self.defines[key])
-        else:
-            self.push(undefined)
+        backup = self[:]
+        value = self.lookup(key)
+        self[:] = backup
+        self.push(value)
         #~ print "LOOKUP %r %r" % (key, self[-1])
 
     @rpn.word('DEFINED')
@@ -141,8 +181,23 @@ class Evaluator(rpn.RPN):
         key = self.next_word()
         self.push(key in self.defines)
 
-    def eval(self, expression):
-        self.clear()
+    def lookup(self, key):
+        """\
+        Return the value of a define. The definition is evaluated if possible,
+        otherwise the text is returned.
+        """
+        try:
+            definition = self.defines[key]
+        except KeyError:
+            return undefined
+        try:
+            return self.eval(definition)
+        except Exception:
+            #~ print "RPN eval failed using directly: %r %r" % (key, definition) # XXX debug
+            return definition
+
+    def postfix(self, expression):
+        """Convert an expression to a list of RPN words"""
         try:
             rpn_expr = infix2postfix.infix2postfix(
                     expression,
@@ -152,13 +207,79 @@ class Evaluator(rpn.RPN):
         except ValueError:
             raise PreprocessorError('error in expression: {!r}'.format(expression))
         #~ print "RPN: %r" % (rpn_expr,) # XXX debug
-        # hack: replace "LOOKUP <word> DEFINED" with "DEFINED <word>"
+        # hack: replace "LOOKUP <word> defined" with "DEFINED <word>"
         rpn_expr = self.re_defined_translation.sub(self._translate_defined, rpn_expr)
-        self.interpret_sequence(rpn_expr.split(' '))
+        return rpn_expr.split(' ')
+
+    def translate(self, words):
+        """\
+        Translate RPN words to a Python function that calculates the value,
+        it takes the evaluator as argument. Return None if the words contain anything other
+        than numbers, defines and the known operators.
+        """
+        operands = []
+        words = iter(words)
+        for word in words:
+            name = word.lower()
+            if name in ('lookup', 'defined'):
+                key = next(words, None)
+                if key is None:
+                    return None
+                if name == 'lookup':
+                    operands.append(u'evaluator.lookup({!r})'.format(key))
+                else:
+                    operands.append(u'({!r} in evaluator.defines)'.format(key))
+            elif name in self.unary_operators:
+                if not operands:
+                    return None
+                operands.append(self.unary_operators[name].format(operands.pop()))
+            elif name in self.binary_operators:
+                if len(operands) < 2:
+                    return None
+                x = operands.pop()
+                y = operands.pop()
+                operands.append(self.binary_operators[name].format(y, x))
+            else:
+                try:
+                    operands.append(u'{!r}'.format(int(word, 0)))
+                except ValueError:
+                    return None
+        if len(operands) != 1:
+            return None
+        return eval(u'lambda evaluator: {}'.format(operands[0]), self.translation_namespace)
+
+    def interpret_words(self, expression, words):
+        """Calculate the value of the RPN words with the interpreter"""
+        self.clear()
+        self.interpret_sequence(words)
         if len(self) != 1:
             raise PreprocessorError('error in expression: {!r} stack: {}'.format(expression, self))
         return self.pop()
 
+    def eval(self, expression):
+        if not self.compile_expressions:
+            return self.interpret_words(expression, self.postfix(expression))
+        try:
+            words, function = self.compiled[expression]
+        except KeyError:
+            try:
+                words = self.postfix(expression)
+            except PreprocessorError:
+                # remember syntax errors too, definitions that are not
+                # expressions are looked up again and again
+                self.compiled[expression] = None, None
+                raise
+            function = self.translate(words)
+            self.compiled[expression] = words, function
+        if words is None:
+            raise PreprocessorError('error in expression: {!r}'.format(expression))
+        if function is not None:
+            try:
+                return function(self)
+            except Exception:
+                pass    # let the interpreter report the error
+        return self.interpret_words(expression, words)
+
 
 class AnnoatatedLineWriter(object):
     """\
@@ -185,10 +306,33 @@ class AnnoatatedLineWriter(object):
             raise EOFError()
 
 
+class Recorder(object):
+    """File like object that forwards the data and keeps a copy"""
+    def __init__(self, output):
+        self.output = output
+        self.data = []
+
+    def write(self, text):
+        self.data.append(text)
+        self.output.write(text)
+
+
+def file_digest(path):
+    """Fingerprint of a file, None if it can not be read"""
+    try:
+        return cache.fingerprint(('file', path))
+    except (IOError, OSError):
+        return None
+
+
 class Preprocessor(object):
     """\
     A text processing tool like a C Preprocessor. However it is not 100%
     compatible to a C Preprocessor.
+
+    When ``precompiled_headers`` is true, the result of each ``#include``
+    (output, defines and macros) is saved in the disk cache and reused when
+    the same header is included again in the same state.
     """
 
     re_scanner = re.compile(r'''
@@ -211,69 +355,124 @@ class Preprocessor(object):
 
     re_silinecomment = re.compile(r'(//).*')
     re_inlinecomment = re.compile(r'/\*.*?\*/')
-    re_macro_usage = re.compile(r'(?P<MACRO>\w+)[\t ]*\((?P<ARGS>.*?)\)', re.UNICODE)
-    re_splitter = re.compile(r'''
-            (?P<STRING>     "([^"\\]*?(\\.[^"\\]*?)*?)"     ) |
-            (?P<WORD>       \w+         ) |
-            (?P<NONWORD>    [^"\w]+       )
-            ''', re.VERBOSE | re.UNICODE)
+    re_tokenizer = re.compile(r'''
+            "(?:[^"\\]|\\.)*"     |   # string
+            \w+                 |   # word
+            [\t ]+              |   # space
+            .                       # any other character
+            ''', re.VERBOSE | re.UNICODE | re.DOTALL)
+    re_word = re.compile(r'\w+', re.UNICODE)
+    # arguments used with # or ## in a macro template
+    re_raw_argument = re.compile(r'"%\((\w+)\)s"|#[\t ]*%\((\w+)\)s|%\((\w+)\)s[\t ]*#')
 
     def __init__(self):
         self.macros = {}
         self.log = logging.getLogger('cpp')
         self.namespace = Evaluator()
         self.include_path = ['.']
-
-    def _apply_macro(self, match_obj):
-        name = match_obj.group('MACRO')
-        if name in self.macros:
-            values = [x.strip() for x in match_obj.group('ARGS').split(',')]
-            args, expansion = self.macros[name]
-            if len(args) != len(values):
-                raise PreprocessorError('Macro invocation with wrong number of parameters. Expected {} got {}: {!r}'.format(
-                        len(args), len(values), values))
-            self.expansion_done = True
-            return expansion % dict(zip(args, values))
-        else:
-            return match_obj.group(0)   # nothing of ours, return original
+        self.precompiled_headers = False
+        # warnings and messages, they are repeated for precompiled headers
+        self.diagnostics = []
+        self._raw_arguments = {}
+
+    def _warn(self, text):
+        self.diagnostics.append(('log', text))
+        self.log.warn(text)
+
+    def _message(self, text):
+        self.diagnostics.append(('stderr', text))
+        sys.stderr.write(text)
+
+    def _tokens(self, text, hide_set):
+        """Tokenize text, return it as reversed list of (token, hide_set) tuples"""
+        return [(token, hide_set) for token in reversed(self.re_tokenizer.findall(text))]
+
+    def _macro_arguments(self, pending):
+        """\
+        Check if the next tokens are the arguments of a function like macro.
+        Return a tuple (list of arguments, number of tokens used) or None.
+        Each argument is a list of (token, hide_set) tuples in reverse order,
+        like pending.
+        """
+        position = len(pending) - 1
+        while position >= 0 and not pending[position][0].strip(' \t'):
+            position -= 1
+        if position < 0 or pending[position][0] != '(':
+            return None
+        arguments = []
+        start = position
+        depth = 0
+        for end in range(position - 1, -1, -1):
+            token = pending[end][0]
+            if token == '(':
+                depth += 1
+            elif token == ')' and depth:
+                depth -= 1
+            elif token == ')' or (token == ',' and not depth):
+                arguments.append(pending[end + 1:start])
+                start = end
+                if token == ')':
+                    return arguments, len(pending) - end
+        return None
+
+    def _expand_tokens(self, pending):
+        """Expand the list of (token, hide_set) tuples (reversed), return the text"""
+        defines = self.namespace.defines
+        macros = self.macros
+        output = []
+        while pending:
+            token, hide_set = pending.pop()
+            if token not in hide_set:
+                if token in macros:
+                    call = self._macro_arguments(pending)
+                    if call is not None:
+                        arguments, count = call
+                        args, expansion = macros[token]
+                        if len(args) != len(arguments):
+                            values = [''.join(t for t, h in reversed(argument)).strip() for argument in arguments]
+                            raise PreprocessorError(
+                                'Macro invocation with wrong number of parameters. Expected {} got {}: {!r}'.format(
+                                    len(args), len(values), values))
+                        del pending[-count:]
+                        # arguments are expanded completely before they are
+                        # substituted (except when used with # or ##), the
+                        # macro itself is only hidden when the result is
+                        # scanned again
+                        try:
+                            raw = self._raw_arguments[expansion]
+                        except KeyError:
+                            raw = self._raw_arguments[expansion] = set(
+                                ''.join(names) for names in self.re_raw_argument.findall(expansion))
+                        values = [''.join(t for t, h in reversed(argument)).strip() if arg in raw
+                                  else self._expand_tokens(argument).strip()
+                                  for arg, argument in zip(args, arguments)]
+                        pending.extend(self._tokens(expansion % dict(zip(args, values)), hide_set | set([token])))
+                        continue
+                if token in defines:
+                    pending.extend(self._tokens(defines[token], hide_set | set([token])))
+                    continue
+            output.append(token)
+        #~ print "expand -> %r" % (output)          #DEBUG
+        return ''.join(output)
 
     def expand(self, line):
-        """Expand object and function like macros in given line."""
-        recusion_limit = 10
-        self.expansion_done = True
-        while self.expansion_done and recusion_limit:
-            # replace function like macros
-            self.expansion_done = False
-            line = self.re_macro_usage.sub(self._apply_macro, line)
-            # replace object like macros
-            pos = 0
-            res = []
-            while pos < len(line):
-                m = self.re_splitter.match(line, pos)
-                if m is None:
-                    raise PreprocessorError(u'No match in macro replacement code: {!r}...'.format(
-                        line[pos:pos + 10],))
-                pos = m.end()
-                token_type = m.lastgroup
-                if token_type in ('STRING', 'NONWORD', 'OTHER'):
-                    word = m.group(token_type)
-                    res.append(word)
-                elif token_type == 'WORD':
-                    word = m.group(token_type)
-                    if word in self.namespace.defines:
-                        res.append(self.namespace.defines[word])
-                        self.expansion_done = True
-                    else:
-                        res.append(word)
-                else:
-                    raise PreprocessorError(u'No match in macro replacement code: {!r}...'.format(
-                        line[pos:pos + 10],))
-            line = ''.join(res)
-            recusion_limit -= 1
-        if recusion_limit == 0:
-            self.log.error('recursive define, stopped expansion: {!r} '.format(line))
-        #~ print "expand -> %r" % (res)          #DEBUG
-        return line.replace('##', '')
+        """\
+        Expand object and function like macros in given line.
+
+        The line is split into tokens once. The expansion of a macro is put in
+        front of the remaining tokens and scanned again. Each token carries
+        the names of the macros it resulted from (hide set), these are not
+        expanded again, so that recursive definitions terminate. Macros are
+        not expanded within string literals.
+        """
+        defines = self.namespace.defines
+        macros = self.macros
+        for word in self.re_word.findall(line):
+            if word in defines or word in macros:
+                break
+        else:
+            return line.replace('##', '')
+        return self._expand_tokens(self._tokens(line, frozenset())).replace('##', '')
 
     def preprocess(self, infile, outfile, filename, include_callback=None):
         """Scan lines and process preprocessor directives"""
@@ -314,10 +513,14 @@ class Preprocessor(object):
                             continue
                 #~ if not line.strip(): continue
 
-                m = self.re_scanner.match(line)
-                if m is None:
-                    raise PreprocessorError("error: invalid preprocessing directive: {!r}".format(line))
-                elif m.lastgroup == 'IF':
+                if line and line.lstrip(' \t')[:1] != '#':
+                    kind = 'NONPREPROC'     # not a directive, skip the scanner
+                else:
+                    m = self.re_scanner.match(line)
+                    if m is None:
+                        raise PreprocessorError("error: invalid preprocessing directive: {!r}".format(line))
+                    kind = m.lastgroup
+                if kind == 'IF':
                     expression = m.group('IF_EXPR')
                     value = self.namespace.eval(expression)
                     self.log.debug("#if {!r} -> {!r}".format(expression, value))
@@ -329,7 +532,7 @@ class Preprocessor(object):
                     else:
                         my_if_was_not_hidden = False
                     continue
-                elif m.lastgroup == 'ELIF':
+                elif kind == 'ELIF':
                     # do what #else would do
                     if my_if_was_not_hidden:
                         process = not process
@@ -346,7 +549,7 @@ class Preprocessor(object):
                     else:
                         my_if_was_not_hidden = False
                     continue
-                elif m.lastgroup == 'IFDEF':
+                elif kind == 'IFDEF':
                     symbol = m.group('IFDEF_NAME').strip()
                     value = symbol in self.namespace.defines
                     self.log.debug("#ifdef {!r} -> {!r}".format(symbol, value))
@@ -358,7 +561,7 @@ class Preprocessor(object):
                     else:
                         my_if_was_not_hidden = False
                     continue
-                elif m.lastgroup == 'IFNDEF':
+                elif kind == 'IFNDEF':
                     symbol = m.group('IFNDEF_NAME').strip()
                     value = symbol not in self.namespace.defines
                     self.log.debug("#ifndef {!r} -> {!r}".format(symbol, value))
@@ -370,12 +573,12 @@ class Preprocessor(object):
                     else:
                         my_if_was_not_hidden = False
                     continue
-                elif m.lastgroup == 'ELSE':
+                elif kind == 'ELSE':
                     self.log.debug("#else {!r}".format(if_name))
                     if my_if_was_not_hidden:
                         process = not process
                     continue
-                elif m.lastgroup == 'ENDIF':
+                elif kind == 'ENDIF':
                     self.log.debug("#endif {!r}".format(if_name))
                     while True:
                         (process, my_if_was_not_hidden, if_name, implicit_endif) = hiddenstack.pop()
@@ -384,7 +587,7 @@ class Preprocessor(object):
                     continue
                 elif not process:
                     continue
-                elif m.lastgroup == 'INCLUDE':
+                elif kind == 'INCLUDE':
                     include_name = m.group('INC_NAME')
                     self.log.debug('including "{}"'.format(include_name))
                     for location in self.include_path:
@@ -392,13 +595,16 @@ class Preprocessor(object):
                         if os.path.exists(path):
                             if include_callback is not None:
                                 include_callback(path)
-                            self.preprocess(codecs.open(path, 'r', 'utf-8'), outfile, path, include_callback)
+                            if self.precompiled_headers:
+                                self.include_precompiled(path, outfile, include_callback)
+                            else:
+                                self.preprocess(codecs.open(path, 'r', 'utf-8'), outfile, path, include_callback)
                             writer.marker = None  # force marker output
                             break
                     else:
                         raise PreprocessorError('include file {!r} not found'.format(include_name))
                     continue
-                elif m.lastgroup == 'MACRO':
+                elif kind == 'MACRO':
                     name = m.group('MACRO_NAME')
                     args = [x.strip() for x in m.group('MACRO_ARGS').split(',')]
                     if m.group('MACRO_DEF'):
@@ -406,7 +612,7 @@ class Preprocessor(object):
                     else:
                         definition = ''
                     if name in self.macros:
-                        self.log.warn("{!r} redefinition ignored".format(name))
+                        self._warn("{!r} redefinition ignored".format(name))
                     else:
                         # prepare the macro value to be used as format string
                         # (python's % operator)
@@ -423,45 +629,45 @@ class Preprocessor(object):
                         self.macros[name] = ([hexlify(x) for x in args], definition)
                         self.log.debug("defined macro {!r} => {!r}".format(name, self.macros[name]))
                     continue
-                elif m.lastgroup == 'DEFINE':
+                elif kind == 'DEFINE':
                     symbol = m.group('DEF_NAME')
                     if m.group('DEF_VALUE'):
                         definition = m.group('DEF_VALUE').strip()
                     else:
                         definition = ''
                     if symbol in self.namespace.defines:
-                        self.log.warn("{!r} redefinition ignored".format(symbol))
+                        self._warn("{!r} redefinition ignored".format(symbol))
                     else:
                         self.namespace.defines[symbol] = definition
                         self.log.debug("defined {!r} => {!r}".format(symbol, self.namespace.defines[symbol]))
                     continue
-                elif m.lastgroup == 'UNDEF':
+                elif kind == 'UNDEF':
                     symbol = m.group('UNDEF_NAME').strip()
                     self.log.debug("undefined {}".format(symbol))
                     del self.namespace.defines[symbol]
                     continue
-                elif m.lastgroup == 'MESSAGE':
-                    sys.stderr.write(u'{}:{}: message: {}\n'.format(
+                elif kind == 'MESSAGE':
+                    self._message(u'{}:{}: message: {}\n'.format(
                             filename,
                             lineno,
                             line.strip(),))
                     continue
-                elif m.lastgroup == 'WARNING':
-                    sys.stderr.write(u'{}:{}: warning: {}\n'.format(
+                elif kind == 'WARNING':
+                    self._message(u'{}:{}: warning: {}\n'.format(
                             filename,
                             lineno,
                             line.strip(),))
                     continue
-                elif m.lastgroup == 'ERROR':
-                    sys.stderr.write(u'{}:{}: error: {}\n'.format(
+                elif kind == 'ERROR':
+                    self._message(u'{}:{}: error: {}\n'.format(
                             filename,
                             lineno,
                             line.strip(),))
                     error_found = True
                     continue
-                elif m.lastgroup == 'PRAGMA':
+                elif kind == 'PRAGMA':
                     pass  # => line will be output below
-                elif m.lastgroup == 'NONPREPROC':
+                elif kind == 'NONPREPROC':
                     line = self.expand(line)
                 else:
                     raise PreprocessorError('Invalid input: {!r}'.format(line))
@@ -491,6 +697,53 @@ class Preprocessor(object):
             self.log.info('done "{}"'.format(filename))
         return error_found
 
+    def include_precompiled(self, path, outfile, include_callback=None):
+        """\
+        Process an include file, using the result from the cache if the
+        header, the files it includes and the state of the preprocessor
+        (defines, macros, include path) are the same as when it was saved.
+        """
+        defines = self.namespace.defines
+        key = cache.fingerprint(
+            ('file', __file__), ('file', path), path, self.include_path,
+            sorted(defines.items()), sorted(self.macros.items()))
+        name = 'cpp-pch-{}.pickle'.format(key)
+        entry = cache.load(name, key)
+        if entry is not None:
+            includes, text, new_defines, new_macros, diagnostics = entry
+            if all(file_digest(include) == digest for include, digest in includes):
+                self.log.debug('using precompiled header for "{}"'.format(path))
+                if include_callback is not None:
+                    for include, digest in includes:
+                        include_callback(include)
+                for kind, message in diagnostics:
+                    if kind == 'log':
+                        self._warn(message)
+                    else:
+                        self._message(message)
+                outfile.write(text)
+                defines.clear()
+                defines.update(new_defines)
+                self.macros.clear()
+                self.macros.update(new_macros)
+                return
+        # process the file, record the output and the nested includes
+        includes = []
+
+        def record_include(include):
+            includes.append(include)
+            if include_callback is not None:
+                include_callback(include)
+        recorder = Recorder(outfile)
+        start = len(self.diagnostics)
+        self.preprocess(codecs.open(path, 'r', 'utf-8'), recorder, path, record_include)
+        cache.save(name, key, (
+            [(include, file_digest(include)) for include in includes],
+            u''.join(recorder.data),
+            dict(defines),
+            dict(self.macros),
+            self.diagnostics[start:]))
+
 
 class Discard(object):
     """File like target object that consumes and discards all data"""
@@ -542,6 +795,12 @@ def main():
         default='-',
         metavar='FILE')
 
+    parser.add_argument(
+        '--precompiled-headers',
+        action='store_true',
+        default=False,
+        help='save the result of includes in the disk cache and reuse it')
+
     parser.add_argument(
         '--dependency-scan',
         action='store_true',
@@ -570,6 +829,7 @@ def main():
         logging.getLogger('cpp').setLevel(logging.WARN)
 
     cpp = Preprocessor()
+    cpp.precompiled_headers = args.precompiled_headers
     # extend include search path
     # built in places for msp430.asm
     d = os.path.join(os.path.dirname(sys.modules['msp430.asm'].__file__), 'include')
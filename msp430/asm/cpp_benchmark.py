@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of https://github.com/zsquareplusc/python-msp430-tools
+# (C) 2026 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Benchmark the preprocessor (msp430.asm.cpp) with device headers.
+
+Each header is included by a fresh preprocessor in three modes: with the
+#if/#elif expressions evaluated by the RPN interpreter, with compiled
+expressions starting with an empty cache (like a new process) and with the
+cache filled by the previous run. The time for the whole run and the time spent
+in the evaluation of expressions are reported (best of N runs).
+"""
+
+import io
+import os
+import sys
+import time
+
+from msp430.asm import cpp
+
+
+class TimedEvaluator(cpp.Evaluator):
+    """Evaluator that measures the time used for expressions"""
+
+    def __init__(self):
+        cpp.Evaluator.__init__(self)
+        self.depth = 0
+        self.count = 0
+        self.time = 0
+
+    def eval(self, expression):
+        # only measure the outermost call, definitions are evaluated recursively
+        if self.depth:
+            return cpp.Evaluator.eval(self, expression)
+        self.depth += 1
+        t_start = time.time()
+        try:
+            return cpp.Evaluator.eval(self, expression)
+        finally:
+            self.time += time.time() - t_start
+            self.count += 1
+            self.depth -= 1
+
+
+MODES = ('interpreted', 'cold', 'warm')
+
+
+def preprocess(header, include_path, defines, mode):
+    """\
+    Include the header and return a tuple (total time, expression time,
+    number of expressions).
+    """
+    preprocessor = cpp.Preprocessor()
+    preprocessor.namespace = TimedEvaluator()
+    preprocessor.namespace.compile_expressions = (mode != 'interpreted')
+    if mode == 'cold':
+        cpp.Evaluator.compiled.clear()
+    preprocessor.include_path.extend(include_path)
+    preprocessor.namespace.defines.update(defines)
+    source = io.StringIO(u'#include <{}>\n'.format(header))
+    t_start = time.time()
+    preprocessor.preprocess(source, cpp.Discard(), '<benchmark>')
+    return (time.time() - t_start,
+            preprocessor.namespace.time,
+            preprocessor.namespace.count)
+
+
+def run_benchmark(headers, include_path=(), defines={}, repeat=3):
+    """\
+    Preprocess all headers, return a list of tuples (header, number of
+    expressions, times) where times is a dictionary mode -> (total time,
+    expression time).
+    """
+    results = []
+    for header in headers:
+        times = {}
+        for mode in MODES:
+            runs = [preprocess(header, include_path, defines, mode)
+                    for n in range(repeat)]
+            times[mode] = (min(r[0] for r in runs), min(r[1] for r in runs))
+            count = runs[0][2]
+        results.append((header, count, times))
+    return results
+
+
+def main():
+    import argparse
+    import logging
+    logging.basicConfig()
+    # the headers are processed many times, do not repeat the warnings
+    logging.getLogger('cpp').setLevel(logging.ERROR)
+
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument(
+        'HEADER',
+        nargs='+',
+        help='name of a header, searched in the include path (e.g. msp430f2274.h)')
+
+    parser.add_argument(
+        '-D', '--define',
+        action='append',
+        dest='defines',
+        metavar='SYM[=VALUE]',
+        default=[],
+        help='define symbol')
+
+    parser.add_argument(
+        '-I', '--include-path',
+        action='append',
+        metavar='PATH',
+        default=[],
+        help='Add directory to the search path list for includes')
+
+    parser.add_argument(
+        '-n', '--repeat',
+        type=int,
+        default=3,
+        metavar='N',
+        help='runs per header and mode (default: %(default)s)')
+
+    args = parser.parse_args()
+
+    # same search path as msp430.asm.cpp
+    d = os.path.join(os.path.dirname(sys.modules['msp430.asm'].__file__), 'include')
+    include_path = [d, os.path.join(d, 'upstream')] + args.include_path
+    defines = {}
+    for definition in args.defines:
+        if '=' in definition:
+            symbol, value = definition.split('=', 1)
+        else:
+            symbol, value = definition, '1'
+        defines[symbol] = value
+
+    for header in args.HEADER:
+        if not any(os.path.exists(os.path.join(directory, header)) for directory in include_path):
+            sys.stderr.write('cpp_benchmark: {}: not found\n'.format(header))
+            sys.exit(1)
+    try:
+        results = run_benchmark(args.HEADER, include_path, defines, args.repeat)
+    except cpp.PreprocessorError as e:
+        sys.stderr.write('cpp_benchmark: {}\n'.format(e))
+        sys.exit(1)
+
+    sys.stdout.write('{:<24} {:>6}'.format('', ''))
+    for mode in MODES:
+        sys.stdout.write(' {:>17}'.format('{} [ms]'.format(mode)))
+    sys.stdout.write('\n{:<24} {:>6}'.format('header', '#if'))
+    for mode in MODES:
+        sys.stdout.write(' {:>8} {:>8}'.format('total', 'expr'))
+    sys.stdout.write('\n')
+    for header, count, times in results:
+        sys.stdout.write('{:<24} {:>6}'.format(header, count))
+        for mode in MODES:
+            sys.stdout.write(' {:>8.1f} {:>8.1f}'.format(times[mode][0] * 1e3, times[mode][1] * 1e3))
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
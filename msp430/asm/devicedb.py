@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of https://github.com/zsquareplusc/python-msp430-tools
+# (C) 2026 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Compact, indexed database of the registers and symbols of all devices.
+
+The database is compiled offline from a directory with C headers (e.g. the
+ones downloaded by include/fetchfiles.py): each header is run through the
+preprocessor and all defines that evaluate to a number are stored. Defines
+named like ``P1OUT_`` are registers (``P1OUT`` at that address), the same
+convention as used by msp430.asm.h2forth.
+
+The file is read with mmap, tables are searched in place (binary search),
+nothing is parsed when it is opened except the list of devices.
+
+Layout (all numbers little endian):
+
+- header: magic, version, number of devices, offset of the device table,
+  offset and size of the string table
+- device table, sorted by name: name, offset and length of the symbol
+  table, offset and length of the register table
+- symbol tables, sorted by name: name, value
+- register tables, sorted by address: address, name
+- string table: UTF-8, each string terminated by a zero byte
+
+Names are offsets into the string table. Identical tables are stored once.
+"""
+
+import bisect
+import codecs
+import logging
+import mmap
+import os
+import struct
+import msp430.asm.cpp
+from msp430.asm import cache
+
+try:
+    long
+except NameError:
+    long = int
+
+MAGIC = b'\x89MDB'
+VERSION = 1
+
+# magic, version, number of devices, device table offset, string table offset
+# and size
+HEADER = struct.Struct('<4sIIIII')
+# name, symbol table offset and count, register table offset and count
+DEVICE = struct.Struct('<IIIII')
+# name, value
+SYMBOL = struct.Struct('<Iq')
+# address, name
+REGISTER = struct.Struct('<II')
+
+# location next to the internal definition files (e.g. when the database is
+# installed along with the package)
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'definitions', 'devices.db')
+# environment variable with the path of the database file
+ENVIRONMENT_VARIABLE = 'MSP430_DEVICE_DB'
+
+
+def database_paths():
+    """\
+    Return the list of locations where the database is searched: the file
+    given by the environment variable MSP430_DEVICE_DB, devices.db in the
+    cache directory and DEFAULT_PATH. The first one is also the default output
+    of the compiler.
+    """
+    paths = []
+    if os.environ.get(ENVIRONMENT_VARIABLE):
+        paths.append(os.environ[ENVIRONMENT_VARIABLE])
+    directory = cache.cache_directory()
+    if directory:
+        paths.append(os.path.join(directory, 'devices.db'))
+    paths.append(DEFAULT_PATH)
+    return paths
+
+
+class DeviceDatabaseError(Exception):
+    """Raised when a database file can not be read"""
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# compiler
+
+def device_symbols(defines, evaluate):
+    """\
+    Return (symbols, registers) of a preprocessed header: a dictionary name ->
+    value and a list of (address, name). evaluate is a function that calculates the
+    value of a definition (e.g. Evaluator.eval).
+    """
+    symbols = {}
+    registers = []
+    for name, definition in defines.items():
+        if not definition:
+            continue
+        try:
+            value = evaluate(definition)
+        except Exception:
+            continue
+        if isinstance(value, bool):
+            value = int(value)
+        elif not isinstance(value, (int, long)):
+            continue
+        if not -2**63 <= value < 2**63:
+            continue
+        if name.endswith('_') and not name.startswith('_'):
+            name = name[:-1]
+            if 0 <= value < 2**32:
+                registers.append((value, name))
+        symbols[name] = value
+    return symbols, registers
+
+
+# state for the worker processes of compile_directory
+_compile_state = None
+
+
+def _init_compile(include_path, defines):
+    global _compile_state
+    _compile_state = (include_path, defines)
+
+
+def compile_header(path):
+    """\
+    Preprocess a header, return a tuple (device name, symbols, registers) or
+    (device name, error message, None).
+    """
+    include_path, defines = _compile_state
+    device = os.path.splitext(os.path.basename(path))[0].lower()
+    cpp = msp430.asm.cpp.Preprocessor()
+    cpp.include_path.extend(include_path)
+    cpp.namespace.defines.update(defines)
+    try:
+        with codecs.open(path, 'r', 'utf-8') as infile:
+            if cpp.preprocess(infile, msp430.asm.cpp.Discard(), path):
+                return device, '{}: #error found'.format(path), None
+        symbols, registers = device_symbols(cpp.namespace.defines, cpp.namespace.eval)
+    except msp430.asm.cpp.PreprocessorError as e:
+        return device, '{e.filename}:{e.line}: {e}'.format(e=e), None
+    except Exception as e:
+        # e.g. RPNError from an #if, IOError or UnicodeDecodeError. one broken
+        # header must not abort the compilation of the others
+        return device, '{}: {}: {}'.format(path, e.__class__.__name__, e), None
+    return device, symbols, registers
+
+
+def write_database(devices, fileobj):
+    """\
+    Write the database. devices is a dictionary device name -> (symbols,
+    registers), see device_symbols().
+    """
+    strings = {}
+    string_data = []
+    string_size = [0]
+
+    def string(text):
+        try:
+            return strings[text]
+        except KeyError:
+            data = text.encode('utf-8') + b'\0'
+            offset = strings[text] = string_size[0]
+            string_data.append(data)
+            string_size[0] += len(data)
+            return offset
+
+    # tables follow the header and the device table
+    tables = []
+    table_offsets = {}
+    position = [HEADER.size + DEVICE.size * len(devices)]
+
+    def table(data):
+        try:
+            return table_offsets[data]
+        except KeyError:
+            offset = table_offsets[data] = position[0]
+            tables.append(data)
+            position[0] += len(data)
+            return offset
+
+    device_table = []
+    for name in sorted(devices):
+        symbols, registers = devices[name]
+        symbol_table = b''.join(SYMBOL.pack(string(symbol), symbols[symbol]) for symbol in sorted(symbols))
+        register_table = b''.join(REGISTER.pack(address, string(register)) for address, register in sorted(registers))
+        device_table.append(DEVICE.pack(
+            string(name),
+            table(symbol_table), len(symbols),
+            table(register_table), len(registers)))
+    fileobj.write(HEADER.pack(MAGIC, VERSION, len(devices), HEADER.size, position[0], string_size[0]))
+    for data in device_table:
+        fileobj.write(data)
+    for data in tables:
+        fileobj.write(data)
+    for data in string_data:
+        fileobj.write(data)
+
+
+def compile_directory(directory, filename, include_path=(), defines={}, pattern='msp430*.h', jobs=1):
+    """\
+    Compile all headers matching the pattern in a directory to a database
+    file. Returns a list of (header, error message) for the headers that
+    failed, these are not in the database (e.g. msp430.h, which needs a
+    device to be defined).
+    """
+    import fnmatch
+    log = logging.getLogger('devicedb')
+    paths = [os.path.join(directory, name)
+             for name in sorted(fnmatch.filter(os.listdir(directory), pattern))]
+    # headers include other headers from the same directory
+    include_path = list(include_path) + [directory]
+    if jobs > 1 and len(paths) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(min(jobs, len(paths)), _init_compile, (include_path, defines))
+        try:
+            results = pool.map(compile_header, paths)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _init_compile(include_path, defines)
+        results = [compile_header(path) for path in paths]
+    devices = {}
+    errors = []
+    for path, (device, symbols, registers) in zip(paths, results):
+        if registers is None:
+            errors.append((path, symbols))
+        else:
+            log.info('{}: {} symbols, {} registers'.format(device, len(symbols), len(registers)))
+            devices[device] = (symbols, registers)
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    # write to a temporary file and rename, so that readers never see a
+    # partial file
+    with open(filename + '.tmp', 'wb') as f:
+        write_database(devices, f)
+    try:
+        os.replace(filename + '.tmp', filename)
+    except AttributeError:  # Python 2
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(filename + '.tmp', filename)
+    return errors
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# reader
+
+class DeviceDatabase(object):
+    """\
+    Access to a database file. The device list is read when it is opened, the
+    tables of a device are searched in the memory mapped file.
+    """
+
+    def __init__(self, filename=DEFAULT_PATH):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            try:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                raise DeviceDatabaseError('{}: not a device database'.format(filename))
+        if len(self.data) < HEADER.size:
+            raise DeviceDatabaseError('{}: not a device database'.format(filename))
+        magic, version, count, devices_offset, self.strings_offset, strings_size = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise DeviceDatabaseError('{}: not a device database (or unsupported version)'.format(filename))
+        self.devices = {}
+        for n in range(count):
+            record = DEVICE.unpack_from(self.data, devices_offset + n * DEVICE.size)
+            self.devices[self.string(record[0])] = record[1:]
+
+    def string(self, offset):
+        """Return the string at the given offset of the string table"""
+        start = self.strings_offset + offset
+        return self.data[start:self.data.find(b'\0', start)].decode('utf-8')
+
+    def device(self, name):
+        """Return DeviceSymbols for a device name (case insensitive), KeyError if unknown"""
+        return DeviceSymbols(self, name.lower(), *self.devices[name.lower()])
+
+
+class DeviceSymbols(object):
+    """\
+    Registers and symbols of one device from a DeviceDatabase. It has the same
+    methods for lookups as peripherals.SymbolDatabase, but bits are not known
+    (headers do not tell which bits belong to which register).
+    """
+
+    def __init__(self, database, name, symbols_offset, symbol_count, registers_offset, register_count):
+        self.database = database
+        self.name = name
+        self._symbols_offset = symbols_offset
+        self._symbol_count = symbol_count
+        self._registers_offset = registers_offset
+        self._register_count = register_count
+        self._addresses = None
+        self._labels = None
+
+    def _register_entry(self, index):
+        return REGISTER.unpack_from(self.database.data, self._registers_offset + index * REGISTER.size)
+
+    def registers(self):
+        """Return a list of (address, register name), sorted by address"""
+        return [(address, self.database.string(name))
+                for address, name in (self._register_entry(n) for n in range(self._register_count))]
+
+    def _register_names_at(self, address):
+        """Return the names of the registers at the given address"""
+        if self._addresses is None:
+            # the addresses are compared many times, unpack them once
+            self._addresses = [self._register_entry(n)[0] for n in range(self._register_count)]
+        start = bisect.bisect_left(self._addresses, address)
+        end = bisect.bisect_right(self._addresses, address, start)
+        return [self.database.string(self._register_entry(n)[1]) for n in range(start, end)]
+
+    def register_name_at(self, address):
+        """Return the name of the register at the given address or None"""
+        names = self._register_names_at(address)
+        return names[0] if names else None
+
+    def register(self, name):
+        """Return the register dictionary (with '__bits__' and '__values__') or None"""
+        address = self.labels().get(name)
+        if address is None or name not in self._register_names_at(address):
+            return None
+        return {'__name__': name, '__address__': address, '__bits__': {}, '__values__': {}}
+
+    def register_at(self, address):
+        """Return the register dictionary for an address or None"""
+        name = self.register_name_at(address)
+        return self.register(name) if name is not None else None
+
+    def bits(self, name):
+        """Return a dictionary bit mask -> bit name for a register (empty, not known)"""
+        return {}
+
+    def labels(self):
+        """Return all names and values"""
+        if self._labels is None:
+            data = self.database.data
+            string = self.database.string
+            self._labels = {}
+            for n in range(self._symbol_count):
+                name, value = SYMBOL.unpack_from(data, self._symbols_offset + n * SYMBOL.size)
+                self._labels[string(name)] = value
+        return self._labels
+
+
+_databases = {}     # filename -> DeviceDatabase
+
+
+def load_device(name, filename=None):
+    """\
+    Return DeviceSymbols for a device from the given database file or the
+    first one that exists in database_paths(). Raises KeyError if there is no
+    database or it does not contain the device, DeviceDatabaseError if the
+    file is not a database and IOError if the given file can not be read.
+    """
+    if filename is None:
+        for filename in database_paths():
+            if os.path.exists(filename):
+                break
+        else:
+            raise KeyError(name)
+    database = _databases.get(filename)
+    if database is None:
+        database = _databases[filename] = DeviceDatabase(filename)
+    return database.device(name)
+
+
+def main():
+    import argparse
+    import sys
+    logging.basicConfig()
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+
+    parser.add_argument(
+        'DIRECTORY',
+        nargs='?',
+        help='directory with the C headers')
+
+    parser.add_argument(
+        '-o', '--output',
+        metavar='FILE',
+        help='database file to write (default: ${} or devices.db in the cache directory)'.format(
+            ENVIRONMENT_VARIABLE))
+
+    parser.add_argument(
+        '--pattern',
+        default='msp430*.h',
+        help='file name pattern of the headers (default: %(default)s)')
+
+    parser.add_argument(
+        '-I', '--include-path',
+        action='append',
+        metavar='PATH',
+        default=[],
+        help='Add directory to the search path list for includes')
+
+    parser.add_argument(
+        '-D', '--define',
+        action='append',
+        dest='defines',
+        metavar='SYM[=VALUE]',
+        default=[],
+        help='define symbol')
+
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        metavar='N',
+        help='number of processes (default: number of CPUs)')
+
+    parser.add_argument(
+        '--show',
+        metavar='DEVICE',
+        help='print the registers of a device of the database (given with -o) instead of compiling')
+
+    parser.add_argument(
+        '-v', '--verbose',
+        action='store_true',
+        default=False,
+        help='print status messages')
+
+    args = parser.parse_args()
+    if args.output is None:
+        args.output = database_paths()[0]
+
+    if args.show:
+        try:
+            device = DeviceDatabase(args.output).device(args.show)
+        except (IOError, OSError, DeviceDatabaseError) as e:
+            sys.stderr.write('devicedb: {}\n'.format(e))
+            sys.exit(1)
+        except KeyError:
+            sys.stderr.write('devicedb: {}: device not found\n'.format(args.show))
+            sys.exit(1)
+        for address, name in device.registers():
+            sys.stdout.write('0x{:04x} {}\n'.format(address, name))
+        return
+
+    if args.DIRECTORY is None:
+        parser.error('DIRECTORY is required')
+    if args.verbose:
+        logging.getLogger('devicedb').setLevel(logging.INFO)
+    # definitions that are not numbers are skipped, do not log the errors
+    logging.getLogger('rpn').setLevel(logging.CRITICAL)
+    if args.jobs is None:
+        import multiprocessing
+        args.jobs = multiprocessing.cpu_count()
+
+    defines = {}
+    for definition in args.defines:
+        if '=' in definition:
+            symbol, value = definition.split('=', 1)
+        else:
+            symbol, value = definition, '1'
+        defines[symbol] = value
+
+    # same search path as msp430.asm.cpp
+    d = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'include')
+    include_path = [d, os.path.join(d, 'upstream')] + args.include_path
+    errors = compile_directory(args.DIRECTORY, args.output, include_path, defines, args.pattern, args.jobs)
+    for path, message in errors:
+        sys.stderr.write('devicedb: skipped {}\n'.format(message))
+
+
+if __name__ == '__main__':
+    main()
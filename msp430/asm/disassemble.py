@@ -8,6 +8,9 @@
 """\
 Disassembler for TI MSP430(X)
 """
+import sys
+import array
+import itertools
 import msp430.memory
 import msp430.asm.peripherals
 
@@ -128,39 +131,263 @@ def words(byte_stream):
         yield low
 
 
+def word_array(data):
+    """\
+    Return an array of 16 bit numbers (little endian), given a sequence of
+    bytes. An odd byte at the end is padded with zero.
+    """
+    data = bytearray(data)
+    if len(data) & 1:
+        data.append(0)
+    result = array.array('H')
+    if hasattr(result, 'frombytes'):
+        result.frombytes(bytes(data))
+    else:
+        result.fromstring(bytes(data))  # Python 2
+    if sys.byteorder == 'big':
+        result.byteswap()
+    return result
+
+
+# kinds of results from decode()
+DECODED_INSTRUCTION = 0
+DECODED_JUMP = 1
+DECODED_EXTENSION_WORD = 2
+DECODED_EXTENDED = 3
+DECODED_ILLEGAL = 4
+
+
+def decode(opcode, msp430x=False, extension_word=None):
+    """\
+    Decode the bit fields of an opcode. The result does not depend on the
+    following words, it contains templates for the operands instead. The
+    first element of the returned tuple is the kind:
+
+    DECODED_INSTRUCTION:
+        (kind, name, address_mode, src, src_word, dst, dst_word, cycles,
+        src_hi, dst_hi, skip_words) src and dst are strings or None.
+        If src_word/dst_word is true, the next word is formatted into the
+        template. skip_words is the number of words that are read but not
+        shown.
+    DECODED_JUMP:
+        (kind, name, offset, cycles)
+    DECODED_EXTENSION_WORD, DECODED_EXTENDED, DECODED_ILLEGAL:
+        (kind,) MSP430X extension word, MSP430X instructions that are
+        decoded by MSP430Disassembler.process_extended and unknown opcodes.
+
+    cycles does not include the cycles for reading the opcode and
+    operand words.
+    """
+    src_hi = 0
+    dst_hi = 0
+    # single operand
+    if ((opcode & 0xf000) == 0x1000 and
+            ((opcode >> 7) & 0x1f in singleOperandInstructions)):
+        bytemode = (opcode >> 6) & 1
+        asrc = (opcode >> 4) & 3
+        src = opcode & 0xf
+        x, y, c = addressMode(bytemode, asrc=asrc, src=src)
+        name, addcyles = singleOperandInstructions[(opcode >> 7) & 0x1f]
+        cycles = c + addcyles  # some functions have additional cycles (push etc)
+        if extension_word is not None:
+            name += 'x'
+            al = (extension_word >> 6) & 1
+            if asrc == 0:    # register mode
+                n = extension_word & 0xf
+                zc = (extension_word >> 8) & 1
+                cycles += 1 + n
+            else:           # non register mode
+                dst_hi = extension_word & 0xf
+                #~ src_hi = (extension_word >> 7) & 0xf
+        else:
+            al = 1
+        if al:
+            if bytemode:
+                address_mode = '.b'
+            else:
+                address_mode = ''
+        else:
+            if bytemode:
+                address_mode = '.a'
+            else:
+                address_mode = '.illegal'
+        if not (src == 2 or src == 3):
+            if asrc == 0:
+                if src == 0:
+                    cycles += 1  # destination PC adds one
+                if name == 'push':
+                    cycles += 2
+                if name == 'call':
+                    cycles += 2
+            elif asrc == 1 or asrc == 2:
+                cycles += 1
+            elif asrc == 3:
+                cycles += 1
+                if name == 'call':
+                    cycles += 1
+        else:  # this happens for immediate values provided by the constant generators
+            if name == 'push':
+                cycles += 2 - 1
+            if name == 'call':
+                cycles += 3
+
+        if name == 'reti':
+            return (DECODED_INSTRUCTION, name, '', None, False, None, False, cycles, 0, 0, int('%' in x))
+        return (DECODED_INSTRUCTION, name, address_mode, None, False, x, '%' in x, cycles, 0, 0, 0)
+
+    # double operand
+    elif (opcode >> 12) & 0xf in doubleOperandInstructions:
+        bytemode = (opcode >> 6) & 1
+        adst = (opcode >> 7) & 1
+        asrc = (opcode >> 4) & 3
+        x, y, c = addressMode(
+            bytemode,
+            src=(opcode >> 8) & 0xf,
+            ad=adst,
+            asrc=asrc,
+            dest=opcode & 0xf)
+        name = doubleOperandInstructions[(opcode >> 12) & 0xf]
+        cycles = c
+        if extension_word is not None:
+            name += 'x'
+            al = (extension_word >> 6) & 1
+            if asrc == 0 and adst == 0:    # register mode
+                n = extension_word & 0xf
+                zc = (extension_word >> 8) & 1
+                cycles += 1 + n
+            else:           # non register mode
+                dst_hi = extension_word & 0xf
+                src_hi = (extension_word >> 7) & 0xf
+        else:
+            al = 1
+        if al:
+            if bytemode:
+                address_mode = '.b'
+            else:
+                address_mode = ''
+        else:
+            if bytemode:
+                address_mode = '.a'
+            else:
+                address_mode = '.illegal'
+        return (DECODED_INSTRUCTION, name, address_mode, x, '%' in x, y, '%' in y, cycles, src_hi, dst_hi, 0)
+
+    # jump instructions
+    elif ((opcode & 0xe000) == 0x2000 and
+            ((opcode >> 10) & 0x7 in jumpInstructions)):
+        name = jumpInstructions[(opcode >> 10) & 0x7]
+        offset = ((opcode & 0x3ff) << 1)
+        if offset & 0x400:  # negative?
+            offset = -((~offset + 1) & 0x7ff)
+        return (DECODED_JUMP, name, offset, 1)  # jumps always have 2 cycles
+
+    # extended instructions
+    elif msp430x and ((opcode & 0xf000) == 0x0000 or (opcode & 0xf800) == 0x1000):
+        return (DECODED_EXTENDED,)
+
+    # extension word
+    elif msp430x and (opcode & 0xf800) == 0x1800:
+        return (DECODED_EXTENSION_WORD,)
+
+    return (DECODED_ILLEGAL,)
+
+
+def extended_words(opcode):
+    """\
+    Return the number of words that follow the opcode of a DECODED_EXTENDED
+    instruction (see MSP430Disassembler.process_extended).
+    """
+    if (opcode & 0xf000) == 0x0000:
+        return int((opcode >> 4) & 0xf in (2, 3, 6, 7, 8, 9, 10, 11))
+    elif (opcode & 0xff00) == 0x1300 and opcode != 0x1300:    # calla
+        return int((opcode >> 4) & 0xf in (5, 8, 9, 11))
+    return 0
+
+
+def table_entry(decoded):
+    """\
+    Prepare a decode() result for the disassembler. Instructions are
+    returned as:
+
+        (kind, name, address_mode, src, dst, text, src_word, dst_word,
+        src_hi, dst_hi, skip_words, cycles)
+
+    Emulated instructions are already resolved. text is the rendered
+    instruction, like src and dst it is a template for the operand words
+    (source word 'x', destination word 'y'). It is None when the emulated
+    instruction depends on the operand words. Other kinds are returned
+    unchanged.
+    """
+    if decoded[0] != DECODED_INSTRUCTION:
+        return decoded
+    kind, name, address_mode, src, src_word, dst, dst_word, cycles, src_hi, dst_hi, skip_words = decoded
+    if src_word and dst_word:
+        text = None     # e.g. "add &x, &y" is "rla &x" if x == y
+    else:
+        insn = Instruction(None, name, address_mode, src, dst)
+        name, src, dst, text = insn.name, insn.src, insn.dst, str(insn)
+    return (kind, name, address_mode, src, dst, text, src_word, dst_word, src_hi, dst_hi, skip_words, cycles)
+
+
+class DecodeTable(dict):
+    """\
+    Maps opcodes to table_entry() results. The entries are created when an
+    opcode is looked up the first time.
+    """
+    def __init__(self, msp430x=False):
+        dict.__init__(self)
+        self.msp430x = msp430x
+
+    def __missing__(self, opcode):
+        entry = self[opcode] = table_entry(decode(opcode, self.msp430x))
+        return entry
+
+
+_decode_tables = {}
+
+
+def decode_table(msp430x=False):
+    """Return the (shared) DecodeTable for the instruction set."""
+    try:
+        return _decode_tables[msp430x]
+    except KeyError:
+        table = _decode_tables[msp430x] = DecodeTable(msp430x)
+        return table
+
+
 class NamedSymbols(object):
     """Handle a collection of peripheral register names and associated bit names"""
     def __init__(self):
         self.peripherals = None
 
-    def load(self, name):
-        self.peripherals = msp430.asm.peripherals.load_internal(name)
+    def load(self, name, device_database=None):
+        self.peripherals = msp430.asm.peripherals.load_database(name, device_database)
 
     def symbol_from_adr(self, opt):
         """try to find a symbol name if the argument points to an absolute address"""
         if opt[0:1] == '&' and self.peripherals is not None:
-            adr = int(opt[1:], 0)
-            if adr in self.peripherals.registers_by_address:
-                return '&{}'.format(self.peripherals.registers_by_address[adr]['__name__'])
+            name = self.peripherals.register_name_at(int(opt[1:], 0))
+            if name is not None:
+                return '&{}'.format(name)
         return opt
 
     def symbols_for_bits(self, arg, opt):
         """for known targets, convert immediate values to a list of OR'ed bits"""
-        if opt[0:1] == '&' and self.peripherals is not None:
-            reg = opt[1:]
-            if arg[0:1] == '#' and reg in self.peripherals.registers_by_name:
+        if opt[0:1] == '&' and self.peripherals is not None and arg[0:1] == '#':
+            register = self.peripherals.register(opt[1:])
+            if register is not None:
                 value = int(arg[1:], 0)
                 result = []
-                if '__bits__' in self.peripherals.registers_by_name[reg]:
-                    for mask, name in sorted(self.peripherals.registers_by_name[reg]['__bits__'].items()):
+                if '__bits__' in register:
+                    for mask, name in sorted(register['__bits__'].items()):
                         if value & mask:
                             value &= ~mask          # clear this bit
                             result.append(name)
                 # if there are bits left, append them to the result, so that nothing gets lost
                 if value:
                     # look for named values
-                    if value in self.peripherals.registers_by_name[reg]['__values__']:
-                        result.append(self.peripherals.registers_by_name[reg]['__values__'][value])
+                    if value in register['__values__']:
+                        result.append(register['__values__'][value])
                     else:
                         result.append('0x{:x}'.format(value))
                 return '#{}'.format('|'.join(result))
@@ -174,7 +401,8 @@ class Instruction:
     It also saves the address the instruction started, the words used to
     decode the instruction and the number of cycles the CPU would have used.
     """
-    def __init__(self, address, name, address_mode='', src=None, dst=None, used_words=None, cycles=0, named_symbols=None):
+    def __init__(self, address, name, address_mode='', src=None, dst=None, used_words=None, cycles=0,
+                 named_symbols=None, text=None):
         self.address = address
         self.name = name
         self.address_mode = address_mode
@@ -183,8 +411,22 @@ class Instruction:
         self.used_words = used_words
         self.cycles = cycles
         self.named_symbols = named_symbols
+        # pre-rendered by table_entry(), emulated instructions are resolved
+        self.text = text
+        if text is None:
+            self.resolve_emulated()
 
-        # transformations of emulated instructions
+        # try to replace values by symbols
+        if self.named_symbols is not None:
+            self.text = None
+            if self.dst:
+                self.dst = self.named_symbols.symbol_from_adr(self.dst)
+            if self.src:
+                self.src = self.named_symbols.symbol_from_adr(self.src)
+                self.src = self.named_symbols.symbols_for_bits(self.src, self.dst)
+
+    def resolve_emulated(self):
+        """transformations of emulated instructions"""
         new_name = None
         if self.name in ('add', 'addx'):
             ex = 'x' if (self.name[-1] == 'x') else ''
@@ -284,15 +526,9 @@ class Instruction:
             self.name = new_name
             self.src = None
 
-        # try to replace values by symbols
-        if self.named_symbols is not None:
-            if self.dst:
-                self.dst = self.named_symbols.symbol_from_adr(self.dst)
-            if self.src:
-                self.src = self.named_symbols.symbol_from_adr(self.src)
-                self.src = self.named_symbols.symbols_for_bits(self.src, self.dst)
-
     def __str__(self):
+        if self.text is not None:
+            return self.text
         if self.src is not None and self.dst is not None:
             return '{name:<{width}} {src}, {dst}'.format(
                 width=INSN_WIDTH,
@@ -365,6 +601,7 @@ class MSP430Disassembler(object):
     def __init__(self, memory, msp430x=False, named_symbols=None):
         self.memory = memory
         self.msp430x = msp430x
+        self.decode_table = decode_table(msp430x)
         self.named_symbols = named_symbols
         self.cycles = 0
         self.used_words = []
@@ -431,120 +668,53 @@ class MSP430Disassembler(object):
         disassemble one instruction from a stream of words.
         """
         opcode = self.word()
-        x = y = None
-        src_hi = 0
-        dst_hi = 0
-        # single operand
-        if ((opcode & 0xf000) == 0x1000 and
-                ((opcode >> 7) & 0x1f in singleOperandInstructions)):
-            bytemode = (opcode >> 6) & 1
-            asrc = (opcode >> 4) & 3
-            src = opcode & 0xf
-            x, y, c = addressMode(bytemode, asrc=asrc, src=src)
-            name, addcyles = singleOperandInstructions[(opcode >> 7) & 0x1f]
-            self.cycles += c + addcyles  # some functions have additional cycles (push etc)
-            if extension_word is not None:
-                name += 'x'
-                al = (extension_word >> 6) & 1
-                if asrc == 0:    # register mode
-                    n = extension_word & 0xf
-                    zc = (extension_word >> 8) & 1
-                    self.cycles += 1 + n
-                else:           # non register mode
-                    dst_hi = extension_word & 0xf
-                    #~ src_hi = (extension_word >> 7) & 0xf
-            else:
-                al = 1
-            if al:
-                if bytemode:
-                    address_mode = '.b'
-                else:
-                    address_mode = ''
-            else:
-                if bytemode:
-                    address_mode = '.a'
-                else:
-                    address_mode = '.illegal'
-            if not (src == 2 or src == 3):
-                if asrc == 0:
-                    if src == 0:
-                        self.cycles += 1  # destination PC adds one
-                    if name == 'push':
-                        self.cycles += 2
-                    if name == 'call':
-                        self.cycles += 2
-                elif asrc == 1 or asrc == 2:
-                    self.cycles += 1
-                elif asrc == 3:
-                    self.cycles += 1
-                    if name == 'call':
-                        self.cycles += 1
-            else:  # this happens for immediate values provided by the constant generators
-                if name == 'push':
-                    self.cycles += 2 - 1
-                if name == 'call':
-                    self.cycles += 3
-
-            if '%' in x:
-                x = x % {'x': (src_hi << 16) | self.word()}
-            if name == 'reti':
-                self.instruction(name)
-            else:
-                self.instruction(name, address_mode, dst=x)
-
-        # double operand
-        elif (opcode >> 12) & 0xf in doubleOperandInstructions:
-            bytemode = (opcode >> 6) & 1
-            adst = (opcode >> 7) & 1
-            asrc = (opcode >> 4) & 3
-            x, y, c = addressMode(
-                bytemode,
-                src=(opcode >> 8) & 0xf,
-                ad=adst,
-                asrc=asrc,
-                dest=opcode & 0xf)
-            name = doubleOperandInstructions[(opcode >> 12) & 0xf]
-            self.cycles += c
-            if extension_word is not None:
-                name += 'x'
-                al = (extension_word >> 6) & 1
-                if asrc == 0 and adst == 0:    # register mode
-                    n = extension_word & 0xf
-                    zc = (extension_word >> 8) & 1
-                    self.cycles += 1 + n
-                else:           # non register mode
-                    dst_hi = extension_word & 0xf
-                    src_hi = (extension_word >> 7) & 0xf
-            else:
-                al = 1
-            if al:
-                if bytemode:
-                    address_mode = '.b'
-                else:
-                    address_mode = ''
-            else:
-                if bytemode:
-                    address_mode = '.a'
-                else:
-                    address_mode = '.illegal'
-            if '%' in x:
-                x = x % {'x': (src_hi << 16) | self.word()}
-            if '%' in y:
-                y = y % {'y': (dst_hi << 16) | self.word()}
-            self.instruction(name, address_mode, src=x, dst=y)
-
-        # jump instructions
-        elif ((opcode & 0xe000) == 0x2000 and
-                ((opcode >> 10) & 0x7 in jumpInstructions)):
-            name = jumpInstructions[(opcode >> 10) & 0x7]
-            offset = ((opcode & 0x3ff) << 1)
-            if offset & 0x400:  # negative?
-                offset = -((~offset + 1) & 0x7ff)
-            self.cycles += 1  # jumps always have 2 cycles
+        if extension_word is None:
+            decoded = self.decode_table[opcode]
+        else:
+            decoded = table_entry(decode(opcode, self.msp430x, extension_word))
+        kind = decoded[0]
+        if kind == DECODED_INSTRUCTION:
+            (kind, name, address_mode, src, dst, text, src_word, dst_word,
+             src_hi, dst_hi, skip_words, cycles) = decoded
+            self.cycles += cycles
+            if src_word or dst_word:
+                values = {}
+                if src_word:
+                    values['x'] = (src_hi << 16) | self.word()
+                if dst_word:
+                    values['y'] = (dst_hi << 16) | self.word()
+                    if not src_word:
+                        values['x'] = values['y']   # single operand
+                if src is not None:
+                    src = src % values
+                if dst is not None:
+                    dst = dst % values
+                if text is not None:
+                    text = text % values
+            for i in range(skip_words):
+                self.word()
+            self._save_instruction(Instruction(
+                self.first_address, name, address_mode, src, dst,
+                self.used_words, self.cycles, self.named_symbols, text))
+        elif kind == DECODED_JUMP:
+            kind, name, offset, cycles = decoded
+            self.cycles += cycles
             self.jump_instruction(name, offset)
+        elif kind == DECODED_EXTENSION_WORD:
+            self.process_word(extension_word=opcode)
+        elif kind == DECODED_EXTENDED:
+            self.process_extended(opcode)
+        else:
+            self.instruction('illegal-insn-0x{:04x}'.format(opcode))
 
+    def process_extended(self, opcode):
+        """\
+        disassemble MSP430X specific instructions (address instructions, calla,
+        pushm/popm). These read their operands in various ways and are not
+        in the decode table.
+        """
         # extended instructions
-        elif self.msp430x and (opcode & 0xf000) == 0x0000:
+        if (opcode & 0xf000) == 0x0000:
             src = (opcode >> 8) & 0xf
             dst = opcode & 0xf
             insnid = (opcode >> 4) & 0xf
@@ -681,7 +851,7 @@ class MSP430Disassembler(object):
                     dst=regnames[dst])
 
         # extended instructions 2
-        elif self.msp430x and (opcode & 0xf800) == 0x1000:
+        elif (opcode & 0xf800) == 0x1000:
             dst = opcode & 0xf
             if opcode == 0b0001001100000000:
                 self.instruction('reti')
@@ -718,86 +888,159 @@ class MSP430Disassembler(object):
                 n = (opcode >> 4) & 0xf
                 self.instruction('pop.w', src='#{}'.format(n), dst=regnames[dst])
 
-        # extension word
-        elif self.msp430x and (opcode & 0xf800) == 0x1800:
-            self.process_word(extension_word=opcode)
-            return
-
         # unknown instruction
         if self.used_words:  # if an instruction was set it would be the empty list
             self.instruction('illegal-insn-0x{:04x}'.format(opcode))
 
-    def disassemble(self, output, source_only=False):
-        """Iterate through the segments and disassemble, output at the end"""
-        lines = []
+    def iter_instructions(self, segment):
+        """\
+        Decode the instructions of a segment, yield them one by one. Only the
+        instruction that is currently decoded is held in memory.
+        """
+        self.restart(segment.startaddress)
+        self.words = iter(word_array(segment.data))
+        try:
+            while True:
+                self.process_word()
+                for insn in self.instructions:
+                    yield insn
+                del self.instructions[:]
+        except StopIteration:
+            pass
+
+    def add_label(self, address):
+        """Assign a label to the address, unless it already has one."""
+        if address not in self.labels:
+            # create a new label
+            self.labels[address] = '.L{:04d}'.format(self.label_num)
+            self.label_num += 1
+
+    def add_labels(self, instructions):
+        """Assign a label to the jump targets of the given instructions."""
+        for insn in instructions:
+            if insn.jumps():
+                self.add_label(insn.targetAddress(insn.address + 2))
+
+    def collect_labels(self):
+        """\
+        First pass: scan all segments and assign a label to each jump target.
+        Jumps and calls with an immediate target are recognized from their
+        decode table entry, no instructions are created. Only instructions
+        with an extension word are decoded completely.
+        """
+        table = self.decode_table
         for segment in sorted(self.memory.segments):
             self.restart(segment.startaddress)
-            self.words = words(segment.data)
-            lines.append((None, '; Segment starting at 0x{:08x}:'.format(segment.startaddress), '\n'))
+            words = iter(word_array(segment.data))
+            address = segment.startaddress
             try:
                 while True:
-                    self.process_word()
+                    opcode = next(words)
+                    decoded = table[opcode]
+                    kind = decoded[0]
+                    if kind == DECODED_JUMP:
+                        self.add_label(address + 2 + decoded[2])
+                        address += 2
+                    elif kind == DECODED_INSTRUCTION:
+                        operand_words = decoded[6] + decoded[7] + decoded[10]
+                        address += 2 + 2 * operand_words
+                        dst = decoded[4]
+                        if decoded[1] == 'call' and dst[0:1] == '#':
+                            if operand_words:   # call #immediate
+                                self.add_label(next(words))
+                            else:               # constant generator
+                                self.add_label(int(dst[1:], 0))
+                        else:
+                            for i in range(operand_words):
+                                next(words)
+                    elif kind == DECODED_EXTENDED:
+                        operand_words = extended_words(opcode)
+                        address += 2 + 2 * operand_words
+                        for i in range(operand_words):
+                            next(words)
+                    elif kind == DECODED_ILLEGAL:
+                        address += 2
+                    else:
+                        # extension word, the following opcode depends on it
+                        self.address = address
+                        self.words = itertools.chain((opcode,), words)
+                        self.process_word()
+                        self.add_labels(self.instructions)
+                        del self.instructions[:]
+                        address = self.address
             except StopIteration:
                 pass
 
-            for insn in self.instructions:
-                bytes = ' '.join(['{:04x}'.format(x) for x in insn.used_words])
+    def write_listing(self, output, sections, source_only=False):
+        """\
+        Render instructions and write them to output. sections is an
+        iterable of (title, instructions) tuples. The labels have to be
+        assigned before (see add_labels).
+        """
+        placed_labels = set()
+        adr_fmt = '%' + self.adr_fmt
+
+        def write_line(address, prefix, suffix):
+            """render line, put the label on the first line with its address"""
+            if address in self.labels and address not in placed_labels:
+                label = self.labels[address] + ':'
+                placed_labels.add(address)
+            else:
+                label = ''
+            if source_only and address is not None:
+                output.write('%-7s %s' % (label, suffix))
+            else:
+                output.write('%s %-7s %s' % (prefix, label, suffix))
+
+        for title, instructions in sections:
+            write_line(None, title, '\n')
+            for insn in instructions:
+                bytes = ' '.join(['%04x' % x for x in insn.used_words])
                 instext = str(insn)
-                # does this instruction jump? if so, get a label for the jump target
+                # does this instruction jump? if so, use the label of the jump target
                 if insn.jumps():
                     l_adr = insn.targetAddress(insn.address + 2)
-                    if l_adr not in self.labels:
-                        # create a new label
-                        label = '.L{:04d}'.format(self.label_num)
-                        self.label_num += 1
-                        self.labels[l_adr] = label
+                    instext = insn.str_width_label(self.labels[l_adr])
                     # update note with information about the values
                     if isinstance(insn, JumpInstruction):
-                        instext = insn.str_width_label(self.labels[l_adr])
-                        note = ' {:+d} --> {adr:{fmt}}'.format(insn.offset, fmt=self.adr_fmt, adr=l_adr)
+                        note = ' %+d --> %s' % (insn.offset, adr_fmt % l_adr)
                     else:
-                        instext = insn.str_width_label(self.labels[l_adr])
-                        note = ' --> {adr:{fmt}}'.format(fmt=self.adr_fmt, adr=l_adr)
+                        note = ' --> %s' % (adr_fmt % l_adr,)
                 else:
                     note = ''
-                # save generated line
-                lines.append((
+                write_line(
                     insn.address,
-                    '{adr:{fmt}}:  {dump:19}'.format(
-                        fmt=self.adr_fmt, adr=insn.address,
-                        dump=bytes),
-                    '{text:36} ; ca. {cycles} cycle{plural}{note}\n'.format(
-                        text=instext,
-                        cycles=insn.cycles, plural='s' if insn.cycles != 1 else '',
-                        note=note)))
+                    '%s:  %-19s' % (adr_fmt % insn.address, bytes),
+                    '%-36s ; ca. %d cycle%s%s\n' % (
+                        instext, insn.cycles, 's' if insn.cycles != 1 else '', note))
                 # after unconditional jumps, make an empty line
                 if insn.ends_a_block():
-                    lines.append((None, '', '\n'))
-
-        # now output all the lines, put the labels where they belong
-        unused_labels = dict(self.labels)        # work on a copy
-        for address, prefix, suffix in lines:
-            if address in unused_labels:
-                label = '{}:'.format(unused_labels[address])
-                del unused_labels[address]  # remove used label
-            else:
-                label = ''
-            # render lines with labels
-            if source_only:
-                if address is None:
-                    output.write('{} {:7} {}'.format(prefix, label, suffix))
-                else:
-                    output.write('{:7} {}'.format(label, suffix))
-            else:
-                output.write('{} {:7} {}'.format(prefix, label, suffix))
+                    write_line(None, '', '\n')
+
         # if there are labels left, print them in a list
+        unused_labels = [(address, label) for address, label in self.labels.items() if address not in placed_labels]
         if unused_labels:
             output.write('\nLabels that could not be placed:\n')
-            for address, label in unused_labels.items():
+            for address, label in unused_labels:
                 output.write('    {} = 0x{:04x}\n'.format(label, address))
 
+    def disassemble(self, output, source_only=False):
+        """\
+        Iterate through the segments and disassemble. The labels are collected
+        in a first pass, then the lines are rendered and written to output in
+        a second pass, so that the listing is never held in memory.
+        """
+        self.collect_labels()
+        self.write_listing(
+            output,
+            (('; Segment starting at 0x{:08x}:'.format(segment.startaddress),
+              self.iter_instructions(segment))
+             for segment in sorted(self.memory.segments)),
+            source_only)
+
 
 def main():
+    import argparse
     import msp430.commandline_helper
 
     class DisassemblerTool(msp430.commandline_helper.CommandLineTool):
@@ -824,12 +1067,57 @@ merged output.
                 help='read register names for given architecture (e.g. F1xx)',
                 metavar='NAME')
 
+            self.parser.add_argument(
+                '--device-db',
+                help='device database for --symbols (default: see msp430.asm.devicedb)',
+                metavar='FILE')
+
             self.parser.add_argument(
                 "--source",
                 default=False,
                 action='store_true',
                 help='omit hex dump, just output assembler source')
 
+            group = self.parser.add_argument_group('Control flow')
+
+            group.add_argument(
+                '--flow',
+                action='store_true',
+                default=False,
+                help='only disassemble code reachable from the vectors, listed by basic blocks')
+
+            group.add_argument(
+                '--entry',
+                action='append',
+                default=[],
+                type=lambda x: int(x, 0),
+                metavar='ADDRESS',
+                help='additional start address for --flow (can be given multiple times)')
+
+            group.add_argument(
+                '--vectors',
+                type=lambda x: int(x, 0),
+                default=None,
+                metavar='START',
+                help='start address of the interrupt vector table (default: 0xffe0)')
+
+            group.add_argument(
+                '--mcu',
+                metavar='MCU',
+                help='take the interrupt vector table from the definition of given MCU')
+
+            group.add_argument(
+                '--graph',
+                type=argparse.FileType('w'),
+                metavar='FILE',
+                help='write the basic block graph to given file')
+
+            group.add_argument(
+                '--graph-format',
+                choices=['json', 'dot'],
+                default='json',
+                help='format of the --graph file (default: %(default)s)')
+
         def run(self, args):
             if not args.SRC:
                 # if no files are given, read from stdin
@@ -840,18 +1128,42 @@ merged output.
 
             if args.symbols is not None:
                 named_symbols = NamedSymbols()
-                named_symbols.load(args.symbols)
+                named_symbols.load(args.symbols, args.device_db)
             else:
                 named_symbols = None
 
+            if args.flow or args.graph:
+                from msp430.asm import flow
+                if args.mcu is not None:
+                    try:
+                        vectors = flow.vector_table(args.mcu)
+                    except KeyError:
+                        self.parser.error('no vector table known for MCU: {}'.format(args.mcu))
+                else:
+                    vectors = (args.vectors if args.vectors is not None else flow.VECTORS_START, flow.VECTORS_END)
+
             for fileobj in args.SRC:
                 mem = msp430.memory.load(fileobj.name, fileobj, args.input_format)
 
                 if args.verbose:
                     args.output.write('{} ({} segments):\n'.format(fileobj.name, len(mem)))
 
-                dis = MSP430Disassembler(mem, msp430x=args.msp430x, named_symbols=named_symbols)
-                dis.disassemble(args.output, args.source)
+                if args.flow or args.graph:
+                    graph = flow.ControlFlowGraph(mem, msp430x=args.msp430x, named_symbols=named_symbols)
+                    graph.add_vectors(*vectors)
+                    for address in args.entry:
+                        graph.add_entry(address)
+                    graph.build()
+                    if args.graph:
+                        if args.graph_format == 'dot':
+                            graph.write_dot(args.graph)
+                        else:
+                            graph.write_json(args.graph)
+                if args.flow:
+                    graph.write_listing(args.output, args.source)
+                else:
+                    dis = MSP430Disassembler(mem, msp430x=args.msp430x, named_symbols=named_symbols)
+                    dis.disassemble(args.output, args.source)
 
     DisassemblerTool().main()
 
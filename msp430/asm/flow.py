@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of https://github.com/zsquareplusc/python-msp430-tools
+# (C) 2026 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Control flow analysis for MSP430(X) binaries.
+
+Starting from the reset and interrupt vectors (and optional additional entry
+points), the code is decoded by following jumps, branches and calls. Only
+reachable code is decoded, so data in between does not disturb the decoding.
+The result is a graph of basic blocks that can be exported as JSON or DOT.
+"""
+
+import json
+from msp430.asm.disassemble import MSP430Disassembler, JumpInstruction, word_array
+
+# the vector table is at the end of the 64k address space, the size depends on
+# the device (16 vectors on e.g. G2xx, up to 64 on F5xx), see vector_table()
+VECTORS_START = 0xffe0
+VECTORS_END = 0x10000
+
+# how a basic block ends
+EXIT_FALLTHROUGH = 'fallthrough'    # next instruction is the start of an other block
+EXIT_BRANCH = 'branch'              # conditional jump, two successors
+EXIT_JUMP = 'jump'                  # unconditional jump/branch
+EXIT_RETURN = 'return'              # ret, reti, reta
+EXIT_INDIRECT = 'indirect'          # branch with computed target (unknown successors)
+EXIT_INVALID = 'invalid'            # illegal instruction or end of memory
+
+
+def classify(insn):
+    """\
+    Return a tuple (kind, target) describing the effect of an instruction on
+    the control flow. kind is one of 'next', 'call', 'indirect-call', 'jump',
+    'branch', 'return', 'indirect' and 'invalid'. target is the destination
+    address or None if it is unknown or not applicable.
+    """
+    name = insn.name
+    if isinstance(insn, JumpInstruction):
+        target = insn.targetAddress(insn.address + 2)
+        if name == 'jmp':
+            return 'jump', target
+        return 'branch', target
+    if name.startswith('illegal'):
+        return 'invalid', None
+    if name in ('ret', 'retx', 'reta', 'reti'):
+        return 'return', None
+    if name in ('br', 'bra', 'call', 'callx', 'calla'):
+        kind = 'jump' if name.startswith('br') else 'call'
+        if insn.dst is not None and insn.dst[0:1] == '#':
+            try:
+                return kind, int(insn.dst[1:], 0)
+            except ValueError:
+                pass
+        return ('indirect' if kind == 'jump' else 'indirect-call'), None
+    if insn.dst == 'PC':
+        # e.g. add R15, PC (jump tables)
+        return 'indirect', None
+    return 'next', None
+
+
+def vector_table(mcu_name):
+    """\
+    Return a tuple (start, end) with the address range of the interrupt vector
+    table of an MCU, taken from the MCU definitions. Raises KeyError if the
+    MCU or its '.vectors' segment is not known.
+    """
+    from msp430.asm import mcu_definition_parser
+    segment = mcu_definition_parser.load_internal_expanded(mcu_name.upper())['.vectors']
+    return segment['start'], segment['end'] + 1
+
+
+class BasicBlock(object):
+    """\
+    A sequence of instructions that is entered at the first instruction and
+    left after the last one.
+    """
+    def __init__(self, address):
+        self.address = address
+        self.instructions = []
+        self.successors = []    # addresses of blocks that may follow
+        self.calls = []         # addresses of called functions
+        self.indirect_calls = 0  # number of calls with unknown target
+        self.exit = None
+
+    @property
+    def end(self):
+        """address after the last instruction"""
+        last = self.instructions[-1]
+        return last.address + 2 * len(last.used_words)
+
+    @property
+    def cycles(self):
+        """sum of the cycles of all instructions"""
+        return sum(insn.cycles for insn in self.instructions)
+
+    def __repr__(self):
+        return 'BasicBlock(0x{:04x}, {} instructions)'.format(self.address, len(self.instructions))
+
+
+class ControlFlowGraph(object):
+    """\
+    Decode reachable code of a msp430.memory.Memory instance and split it into
+    basic blocks.
+    """
+    def __init__(self, memory, msp430x=False, named_symbols=None):
+        self.disassembler = MSP430Disassembler(memory, msp430x=msp430x, named_symbols=named_symbols)
+        self._segments = [(segment.startaddress, segment.startaddress + len(segment.data), word_array(segment.data))
+                          for segment in sorted(memory.segments)]
+        self.entries = {}       # address -> name
+        self.functions = set()  # addresses of call targets and entries
+        self.instructions = {}  # address -> Instruction, reachable code only
+        self.blocks = {}        # address -> BasicBlock
+
+    def add_entry(self, address, name=None):
+        """Add a start point for the analysis."""
+        if name is None:
+            name = '0x{:04x}'.format(address)
+        self.entries.setdefault(address, name)
+
+    def add_vectors(self, start=VECTORS_START, end=VECTORS_END):
+        """\
+        Add the contents of the interrupt vector table as entries. Vectors
+        that are erased (0xffff) or not part of the memory image are skipped.
+        The last vector of the table is the reset vector.
+        """
+        for vector in range(start, end, 2):
+            address = self.read_word(vector)
+            if address is None or address == 0xffff:
+                continue
+            if self.read_word(address) is None:
+                continue
+            if vector == end - 2:
+                self.entries[address] = 'reset'     # preferred over other names
+            else:
+                self.add_entry(address, 'vector_0x{:04x}'.format(vector))
+
+    def read_word(self, address):
+        """Return the word at given address or None if it is not available."""
+        words = self._words_at(address, 1)
+        return words[0] if words else None
+
+    def _words_at(self, address, count):
+        """Return up to count words starting at address (an empty sequence if not available)."""
+        if address & 1:
+            return ()
+        for start, end, words in self._segments:
+            if start <= address < end:
+                offset = (address - start) >> 1
+                return words[offset:offset + count]
+        return ()
+
+    def decode(self, address):
+        """Decode and return the instruction at given address, None if not possible."""
+        if address in self.instructions:
+            return self.instructions[address]
+        dis = self.disassembler
+        dis.restart(address)
+        # instructions have up to 4 words (extension word, opcode, src, dst)
+        dis.words = iter(self._words_at(address, 4))
+        try:
+            dis.process_word()
+        except StopIteration:
+            return None     # truncated at the end of a segment
+        insn = dis.instructions[0]
+        self.instructions[address] = insn
+        return insn
+
+    def build(self):
+        """\
+        Decode all code that is reachable from the entries and create the
+        basic blocks. Returns self.
+        """
+        leaders = set(self.entries)
+        self.functions.update(self.entries)
+        todo = list(self.entries)
+        seen = set()
+        while todo:
+            address = todo.pop()
+            if address in seen:
+                continue
+            seen.add(address)
+            insn = self.decode(address)
+            if insn is None:
+                continue
+            kind, target = classify(insn)
+            following = address + 2 * len(insn.used_words)
+            if kind in ('next', 'call', 'indirect-call', 'branch'):
+                todo.append(following)
+            if kind == 'call':
+                self.functions.add(target)
+                leaders.add(target)
+                todo.append(target)
+            elif kind in ('jump', 'branch') and target is not None:
+                leaders.add(target)
+                todo.append(target)
+                if kind == 'branch':
+                    leaders.add(following)
+
+        self.blocks = {}
+        for address in sorted(leaders):
+            if address in self.instructions:
+                self.blocks[address] = self._make_block(address, leaders)
+            else:
+                # target could not be decoded, keep an empty block to show the edge
+                block = BasicBlock(address)
+                block.exit = EXIT_INVALID
+                self.blocks[address] = block
+        return self
+
+    def _make_block(self, address, leaders):
+        block = BasicBlock(address)
+        while True:
+            insn = self.instructions[address]
+            block.instructions.append(insn)
+            kind, target = classify(insn)
+            following = address + 2 * len(insn.used_words)
+            if kind == 'call':
+                block.calls.append(target)
+            elif kind == 'indirect-call':
+                block.indirect_calls += 1
+            elif kind == 'invalid':
+                block.exit = EXIT_INVALID
+                break
+            elif kind == 'return':
+                block.exit = EXIT_RETURN
+                break
+            elif kind == 'indirect':
+                block.exit = EXIT_INDIRECT
+                break
+            elif kind == 'jump':
+                block.exit = EXIT_JUMP
+                block.successors.append(target)
+                break
+            elif kind == 'branch':
+                block.exit = EXIT_BRANCH
+                block.successors.extend([target, following])
+                break
+            if following not in self.instructions:
+                block.exit = EXIT_INVALID     # end of memory or not decodable
+                break
+            if following in leaders:
+                block.exit = EXIT_FALLTHROUGH
+                block.successors.append(following)
+                break
+            address = following
+        return block
+
+    def iter_blocks(self):
+        """Yield the basic blocks sorted by address."""
+        for address in sorted(self.blocks):
+            yield self.blocks[address]
+
+    def block_title(self, block):
+        """Return a comment line that is used as title of a block in listings."""
+        title = '; Block at 0x{:04x}'.format(block.address)
+        if block.address in self.entries:
+            title += ' ({})'.format(self.entries[block.address])
+        elif block.address in self.functions:
+            title += ' (function)'
+        return title + ':'
+
+    def write_listing(self, output, source_only=False):
+        """Write a listing of the reachable code, block by block."""
+        dis = self.disassembler
+        for block in self.iter_blocks():
+            dis.add_labels(block.instructions)
+        dis.write_listing(
+            output,
+            ((self.block_title(block), block.instructions) for block in self.iter_blocks()),
+            source_only)
+
+    def to_json(self):
+        """Return the graph as dictionary that can be serialized with json."""
+        return {
+            'entries': [{'name': name, 'address': address}
+                        for address, name in sorted(self.entries.items())],
+            'functions': sorted(self.functions),
+            'blocks': [{
+                'address': block.address,
+                'end': block.end if block.instructions else block.address,
+                'cycles': block.cycles,
+                'exit': block.exit,
+                'successors': block.successors,
+                'calls': block.calls,
+                'indirect_calls': block.indirect_calls,
+                'instructions': [
+                    {'address': insn.address,
+                     'text': str(insn).rstrip(),
+                     'words': len(insn.used_words),
+                     'cycles': insn.cycles}
+                    for insn in block.instructions],
+            } for block in self.iter_blocks()],
+        }
+
+    def write_json(self, output):
+        json.dump(self.to_json(), output, indent=2, sort_keys=True)
+        output.write('\n')
+
+    def write_dot(self, output):
+        """\
+        Write the graph in the DOT format (graphviz). Solid edges are jumps
+        and fall through, dashed edges are calls.
+        """
+        output.write('digraph "control flow" {\n')
+        output.write('    node [shape=box, fontname="monospace"];\n')
+        for block in self.iter_blocks():
+            lines = [self.block_title(block)[2:]]
+            lines.extend('{:04x}: {}'.format(insn.address, str(insn).rstrip())
+                         for insn in block.instructions)
+            output.write('    b{:x} [label="{}\\l"];\n'.format(
+                block.address,
+                '\\l'.join(line.replace('\\', '\\\\').replace('"', '\\"') for line in lines)))
+        for block in self.iter_blocks():
+            for successor in block.successors:
+                output.write('    b{:x} -> b{:x};\n'.format(block.address, successor))
+            for target in block.calls:
+                output.write('    b{:x} -> b{:x} [style=dashed];\n'.format(block.address, target))
+        output.write('}\n')
@@ -26,8 +26,11 @@ import sys
 import os
 import codecs
 import pkgutil
+import pickle
 import logging
+from io import BytesIO
 from msp430.asm import rpn
+from msp430.asm import cache
 
 try:
     unicode
@@ -48,6 +51,7 @@ class DocumentTree(object):
         # output is buffered in memory first. this allows to group commands and
         # to output in alphabetical order
         self.chapter_name = None
+        self.section_name = None
         self.chapters = {}
         self.current_chapter = None
         self.current_section = None
@@ -61,16 +65,29 @@ class DocumentTree(object):
 
     def section(self, name):
         """Select name of text section to append output"""
+        self.section_name = name
         self.current_section = self.current_chapter.setdefault(name, [])
 
+    def select(self, chapter_name, section_name):
+        """Select chapter and section to append output"""
+        self.chapter(chapter_name)
+        self.section(section_name)
+
     def write(self, text):
         self.current_section.append(text)
 
     def push_state(self):
-        self._state.append((self.chapter_name, self.current_chapter, self.current_section))
+        self._state.append((self.chapter_name, self.section_name, self.current_chapter, self.current_section))
 
     def pop_state(self):
-        self.chapter_name, self.current_chapter, self.current_section = self._state.pop()
+        self.chapter_name, self.section_name, self.current_chapter, self.current_section = self._state.pop()
+
+    def merge(self, chapters):
+        """Append the text of the chapters of an other DocumentTree"""
+        for chapter_name, sections in chapters.items():
+            chapter = self.chapters.setdefault(chapter_name, {})
+            for name, text in sections.items():
+                chapter.setdefault(name, []).extend(text)
 
     def render(self, output):
         """Write sorted list of text sections"""
@@ -201,6 +218,54 @@ class Variable(object):
         return '{}({!r}, {!r})'.format(self.__class__.__name__, self.frame, self.offset)
 
 
+def _snapshot_base_key():
+    """\
+    Fingerprint of everything that determines the result of interpreting the
+    internal library: the Forth files and the interpreter. None if snapshots
+    are not possible.
+    """
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'forth')
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return None     # e.g. installed as zip file
+    items = [('file', __file__.replace('.pyc', '.py')), ('file', rpn.__file__.replace('.pyc', '.py'))]
+    # classes are pickled by module name, which is __main__ when run as script
+    items.append(__name__)
+    for name in names:
+        if name.endswith('.forth'):
+            items.extend([name, ('file', os.path.join(directory, name))])
+    return cache.fingerprint(*items)
+
+
+class _SnapshotPickler(pickle.Pickler):
+    """Pickle the Forth state, the instance and its methods are stored as references"""
+
+    def __init__(self, fileobj, forth):
+        pickle.Pickler.__init__(self, fileobj, 2)
+        self.forth = forth
+
+    def persistent_id(self, obj):
+        if obj is self.forth:
+            return 'forth'
+        if getattr(obj, '__self__', None) is self.forth:
+            return 'method:' + obj.__name__
+        return None
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    def __init__(self, fileobj, forth):
+        pickle.Unpickler.__init__(self, fileobj)
+        self.forth = forth
+
+    def persistent_load(self, pid):
+        if pid == 'forth':
+            return self.forth
+        elif pid.startswith('method:'):
+            return getattr(self.forth, pid[7:])
+        raise pickle.UnpicklingError('unsupported persistent id: {!r}'.format(pid))
+
+
 def immediate(function):
     """\
     Function decorator used to tag Forth methods that will be executed
@@ -357,11 +422,112 @@ class Forth(rpn.RPNBase, rpn.RPNStackOps, rpn.RPNSimpleMathOps,
         self.label_id = 0
         self.logger = logging.getLogger('forth')
         self.doctree = DocumentTree()
+        # snapshots of the state after including the internal library
+        self.use_snapshots = cache.cache_directory() is not None
+        self._snapshot_base_key = None
+        # describes how the current state was produced, None when it depends
+        # on user input
+        self._state_key = 'init' if namespace is None else None
+        self._include_depth = 0
+        self._user_includes = 0
+        # optional optimizer for threaded code (msp430.asm.forth_optimizer)
+        self.optimizer = None
+        # number of processes used to output the words in CROSS-COMPILE-MISSING
+        self.jobs = 1
 
     def init(self):
         # load core language definitions from a forth file
         self._include('__init__.forth')
 
+    def define(self, symbol, value):
+        """Define a symbol, e.g. given on the command line."""
+        self.namespace[symbol.lower()] = value  # XXX inserted as string only
+        if self._state_key is not None:
+            self._state_key = cache.fingerprint(self._state_key, 'define', symbol.lower(), value)
+
+    # state that is saved in snapshots (besides the stack)
+    SNAPSHOT_ATTRIBUTES = (
+        'namespace', 'target_namespace', 'variables', 'included_files',
+        'compiled_words', 'not_yet_compiled_words', 'use_ram', 'label_id',
+        'doctree')
+
+    def _dump_state(self):
+        """Serialize the interpreter state."""
+        state = dict((name, getattr(self, name)) for name in self.SNAPSHOT_ATTRIBUTES)
+        state['stack'] = list(self)
+        data = BytesIO()
+        _SnapshotPickler(data, self).dump(state)
+        return data.getvalue()
+
+    def _load_state(self, data):
+        state = _SnapshotUnpickler(BytesIO(data), self).load()
+        self[:] = state.pop('stack')
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def _snapshot_key(self, name):
+        """\
+        Return the cache key for the state after including the internal file
+        with the given name or None if no snapshot can be used. The key is
+        derived from the key of the current state, i.e. the previously
+        included files and defined symbols. The base key covers the contents
+        of all files of the internal library. Once user code was interpreted,
+        no snapshots are used.
+        """
+        if (not self.use_snapshots or self._state_key is None or self._include_depth or
+                self.compiling or name in self.included_files):
+            return None
+        for prefix in self.include_path:
+            if os.path.exists(os.path.join(prefix, name)):
+                return None     # user file, not the internal library
+        if self._snapshot_base_key is None:
+            self._snapshot_base_key = _snapshot_base_key()
+            if self._snapshot_base_key is None:
+                self.use_snapshots = False
+                return None
+        return cache.fingerprint(self._snapshot_base_key, self._state_key, name)
+
+    def _snapshot_name(self, name, key):
+        # part of the key is in the name so that snapshots for different
+        # states (e.g. other symbols defined) can coexist
+        return 'forth-snapshot-{}-{}.pickle'.format(name, key[:12])
+
+    def _include(self, name):
+        """\
+        Include given filename. The Forth code is directly executed. The state
+        after including files of the internal library is saved in a snapshot
+        and restored the next time instead of interpreting the files again.
+        """
+        key = self._snapshot_key(name)
+        if key is not None:
+            snapshot = cache.load(self._snapshot_name(name, key), key)
+            if snapshot is not None:
+                included_files, data = snapshot
+                # nested includes could be user files in the meantime
+                if not any(os.path.exists(os.path.join(prefix, included))
+                           for included in included_files
+                           for prefix in self.include_path):
+                    self._load_state(data)
+                    self._state_key = key
+                    self.logger.info('restored snapshot for include {}'.format(name))
+                    return
+        user_includes = self._user_includes
+        self._include_depth += 1
+        try:
+            self._include_file(name)
+        finally:
+            self._include_depth -= 1
+        if key is None or self._user_includes != user_includes:
+            self._state_key = None
+            return
+        self._state_key = key
+        try:
+            data = self._dump_state()
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            self.logger.info('no snapshot for include {}: {}'.format(name, e))
+        else:
+            cache.save(self._snapshot_name(name, key), key, (self.included_files, data))
+
     def look_up(self, word):
         """Find the word in one of the name spaces for the host and return the value"""
         # target words are included w/ least priority. they must be available
@@ -430,6 +596,9 @@ class Forth(rpn.RPNBase, rpn.RPNStackOps, rpn.RPNSimpleMathOps,
         # newlines are in the steam to support \ comments, they are otherwise ignored
         if word == '\n':
             return
+        if (self._state_key is not None and not self._include_depth and
+                word.lower() not in ('(', '\\', 'include')):
+            self._state_key = None  # state depends on user code now
         try:
             element = self.look_up(word)
         except KeyError:
@@ -915,7 +1084,7 @@ class Forth(rpn.RPNBase, rpn.RPNStackOps, rpn.RPNSimpleMathOps,
         if word not in self.compiled_words:
             self.not_yet_compiled_words.add(word)
 
-    def _compile_frame(self, frame):
+    def _compile_frame(self, frame, thread):
         """\
         Compilation of forth functions. Words referenced by this function are
         remembered and can be output later, either manually with `CROSS-COMPILE`_
@@ -931,65 +1100,87 @@ class Forth(rpn.RPNBase, rpn.RPNStackOps, rpn.RPNSimpleMathOps,
         # compilation of the thread
         self.doctree.write('\tbr #{}\n'.format(self.create_asm_label('DOCOL')))
         #~ self.doctree.write('\tjmp %s\n' % self.create_asm_label('DOCOL'))
-        self._compile_thread(frame)
+        self._compile_thread(thread)
         self.doctree.write('\t.word {}\n\n'.format(self.create_asm_label('EXIT')))
 
-    def _compile_thread(self, frame):
+    def _thread_instructions(self, frame):
+        """\
+        Iterate over the instructions of a thread. Yields tuples (entry,
+        argument), argument is None for entries without inline argument.
+        """
         frame_iterator = iter(frame)
-        try:
-            while True:
-                entry = next(frame_iterator)
-                if callable(entry):
-                    if entry == self.instruction_output_text:
-                        label = self.create_label()
+        for entry in frame_iterator:
+            if callable(entry) and (
+                    entry == self.instruction_output_text or
+                    entry == self.instruction_literal or
+                    entry == self.instruction_seek or
+                    entry == self.instruction_branch_if_false):
+                yield entry, next(frame_iterator)
+            else:
+                yield entry, None
+
+    def _compile_thread(self, frame):
+        for entry, argument in self._thread_instructions(frame):
+            if callable(entry):
+                if entry == self.instruction_output_text:
+                    label = self.create_label()
+                    self.doctree.write('\t.word {}, {}\n'.format(
+                            self.create_asm_label('__write_text'),
+                            self.create_asm_label(label)))
+                    self._compile_remember('__write_text')
+                    # output the text separately
+                    frame = NativeFrame(label)
+                    frame.chapter = self.doctree.chapter_name
+                    frame.append(self.instruction_output_text)
+                    frame.append('\t.asciiz "{}"\n'.format(codecs.escape_encode(argument)[0]))
+                    self.compiled_words.add(label)
+                    self.doctree.push_state()
+                    self._compile_native_frame(frame)
+                    self.doctree.pop_state()
+                elif entry == self.instruction_literal:
+                    if isinstance(argument, Frame):
                         self.doctree.write('\t.word {}, {}\n'.format(
-                                self.create_asm_label('__write_text'),
-                                self.create_asm_label(label)))
-                        self._compile_remember('__write_text')
-                        # output the text separately
-                        frame = NativeFrame(label)
-                        frame.chapter = self.doctree.chapter_name
-                        self.target_namespace[label] = frame
-                        self._compile_remember(label)
-                        text = next(frame_iterator)
-                        frame.append(self.instruction_output_text)
-                        frame.append('\t.asciiz "{}"\n'.format(codecs.escape_encode(text)[0]))
-                    elif entry == self.instruction_literal:
-                        value = next(frame_iterator)
-                        if isinstance(value, Frame):
-                            self.doctree.write('\t.word {}, {}\n'.format(
-                                    self.create_asm_label('LIT'),
-                                    self.create_asm_label(value.name),))
-                        else:
-                            self.doctree.write('\t.word {}, {:6} ; 0x{:04x}\n'.format(
-                                    self.create_asm_label('LIT'),
-                                    value,
-                                    value & 0xffff))
-                        self._compile_remember('LIT')
-                    elif entry == self.instruction_seek:
-                        # branch needs special case as offset needs to be recalculated
-                        offset = next(frame_iterator)
-                        self.doctree.write('\t.word {}, {}\n'.format(self.create_asm_label('BRANCH'), offset * 2))
-                        self._compile_remember('BRANCH')
-                    elif entry == self.instruction_branch_if_false:
-                        # branch needs special case as offset needs to be recalculated
-                        offset = next(frame_iterator)
-                        self.doctree.write('\t.word {}, {}\n'.format(self.create_asm_label('BRANCH0'), offset * 2))
-                        self._compile_remember('BRANCH0')
-                    elif hasattr(entry, 'rpn_name'):
-                        # for built-ins just take the name of the function
-                        self.doctree.write('\t.word {}\n'.format(self.create_asm_label(entry.rpn_name.upper())))
-                        self._compile_remember(entry.rpn_name)
-                    elif isinstance(entry, Frame):
-                        self.doctree.write('\t.word {}\n'.format(self.create_asm_label(entry.name)))
-                        self._compile_remember(entry.name)
+                                self.create_asm_label('LIT'),
+                                self.create_asm_label(argument.name),))
                     else:
-                        raise ValueError('Cross compilation undefined for {!r}'.format(entry))
+                        self.doctree.write('\t.word {}, {:6} ; 0x{:04x}\n'.format(
+                                self.create_asm_label('LIT'),
+                                argument,
+                                argument & 0xffff))
+                    self._compile_remember('LIT')
+                elif entry == self.instruction_seek:
+                    # branch needs special case as offset needs to be recalculated
+                    self.doctree.write('\t.word {}, {}\n'.format(self.create_asm_label('BRANCH'), argument * 2))
+                    self._compile_remember('BRANCH')
+                elif entry == self.instruction_branch_if_false:
+                    # branch needs special case as offset needs to be recalculated
+                    self.doctree.write('\t.word {}, {}\n'.format(self.create_asm_label('BRANCH0'), argument * 2))
+                    self._compile_remember('BRANCH0')
+                elif hasattr(entry, 'rpn_name'):
+                    # for built-ins just take the name of the function
+                    self.doctree.write('\t.word {}\n'.format(self.create_asm_label(entry.rpn_name.upper())))
+                    self._compile_remember(entry.rpn_name)
+                elif isinstance(entry, Frame):
+                    self.doctree.write('\t.word {}\n'.format(self.create_asm_label(entry.name)))
+                    self._compile_remember(entry.name)
                 else:
-                    self.doctree.write('\t.word {!r}\n'.format(entry))
-                    #~ raise ValueError('Cross compilation undefined for %r' % entry)
-        except StopIteration:
-            pass
+                    raise ValueError('Cross compilation undefined for {!r}'.format(entry))
+            else:
+                self.doctree.write('\t.word {!r}\n'.format(entry))
+                #~ raise ValueError('Cross compilation undefined for %r' % entry)
+
+    def _compile_optimized_native_frame(self, frame, lines):
+        """Output of a word that the optimizer translated to native code"""
+        self.doctree.chapter(frame.chapter)
+        self.doctree.section(frame.name)
+        self.doctree.write(u'.text\n.even\n')
+        self.doctree.write(u';{}\n'.format('-' * 76))
+        self.doctree.write(u'; compilation of native word {} (optimized)\n'.format(frame.name))
+        self.doctree.write(u';{}\n'.format('-' * 76))
+        self.doctree.write(u'{}:\n'.format(self.create_asm_label(frame.name)))
+        for line in lines:
+            self.doctree.write(u'\t{}\n'.format(line))
+        self.doctree.write(u'\tbr @IP+\t; NEXT\n\n')
 
     def _compile_native_frame(self, frame):
         """Compilation of native code function"""
@@ -1005,7 +1196,7 @@ class Forth(rpn.RPNBase, rpn.RPNStackOps, rpn.RPNSimpleMathOps,
         frame(self)
         self.doctree.write('\n')  # get some space between this and next word
 
-    def _compile_interrupt_frame(self, frame):
+    def _compile_interrupt_frame(self, frame, thread):
         """Compilation of interrupt function"""
         self.doctree.section(frame.name)
         self.doctree.write(u'.text\n.even\n')
@@ -1022,7 +1213,7 @@ class Forth(rpn.RPNBase, rpn.RPNStackOps, rpn.RPNSimpleMathOps,
         self.doctree.write('\tbr  #{}\n'.format(self.create_asm_label('DO-INTERRUPT')))
         # the thread for the interrupt handler
         self.doctree.write(u'{}:\n'.format(self.create_asm_label(frame.name)))
-        self._compile_thread(frame)
+        self._compile_thread(thread)
         self.doctree.write('\t.word {}\n\n'.format(self.create_asm_label('EXIT-INTERRUPT')))
         self._compile_remember('DO-INTERRUPT')
         self._compile_remember('EXIT-INTERRUPT')
@@ -1039,21 +1230,152 @@ class Forth(rpn.RPNBase, rpn.RPNStackOps, rpn.RPNSimpleMathOps,
         self.compiled_words.add(word)
         if word in self.not_yet_compiled_words:
             self.not_yet_compiled_words.remove(word)
-        # get the frame and compile it - prefer target_namespace
+        self._emit_plan(self._cross_compile_plan(word))
+
+    def _cross_compile_plan(self, word):
+        """\
+        Look up a word for cross compilation. Returns a tuple (kind, item,
+        code) where code is the thread that is output (optimized, if enabled)
+        or the assembler lines when the optimizer translated it to native code.
+        """
+        # get the frame - prefer target_namespace
         try:
             item = self.look_up_target(word)
         except KeyError:
             raise ValueError('word {!r} is not available on the target'.format(word))
         # translate, depending on type
         if isinstance(item, NativeFrame):
-            self._compile_native_frame(item)
+            return ('native', item, None)
         elif isinstance(item, InterruptFrame):
-            self._compile_interrupt_frame(item)
+            if self.optimizer is not None:
+                return ('interrupt', item, self.optimizer.optimize(item))
+            return ('interrupt', item, item)
         elif isinstance(item, Frame):
-            self._compile_frame(item)
+            if self.optimizer is not None:
+                native_code = self.optimizer.native_code(item)
+                if native_code is not None:
+                    return ('optimized', item, native_code)
+                return ('thread', item, self.optimizer.optimize(item))
+            return ('thread', item, item)
         else:
             raise ValueError('don\'t know how to compile word {!r}'.format(word))
 
+    def _emit_plan(self, plan):
+        """Output the assembler code for a plan from _cross_compile_plan"""
+        kind, item, code = plan
+        if kind == 'native':
+            self._compile_native_frame(item)
+        elif kind == 'interrupt':
+            self._compile_interrupt_frame(item, code)
+        elif kind == 'optimized':
+            self._compile_optimized_native_frame(item, code)
+        else:
+            self._compile_frame(item, code)
+
+    def _plan_dependencies(self, plan):
+        """\
+        Return the names of the words that are referenced by the output of a
+        plan. The list is not necessarily complete, CODE words may execute
+        DEPENDS-ON conditionally.
+        """
+        kind, item, code = plan
+        dependencies = []
+        if kind == 'native':
+            frame_iterator = iter(item)
+            for entry in frame_iterator:
+                if callable(entry) and entry == self.word_depends_on:
+                    dependencies.append(next(frame_iterator))
+        elif kind in ('thread', 'interrupt'):
+            for entry, argument in self._thread_instructions(code):
+                if not callable(entry):
+                    continue
+                elif entry == self.instruction_output_text:
+                    dependencies.append('__write_text')
+                elif entry == self.instruction_literal:
+                    dependencies.append('LIT')
+                elif entry == self.instruction_seek:
+                    dependencies.append('BRANCH')
+                elif entry == self.instruction_branch_if_false:
+                    dependencies.append('BRANCH0')
+                elif hasattr(entry, 'rpn_name'):
+                    dependencies.append(entry.rpn_name)
+                elif isinstance(entry, Frame):
+                    dependencies.append(entry.name)
+            if kind == 'interrupt':
+                dependencies.extend(['DO-INTERRUPT', 'EXIT-INTERRUPT'])
+        return [word.lower() for word in dependencies]
+
+    def _plan_label_count(self, plan):
+        """Number of labels created (by create_label) when the plan is output"""
+        kind, item, code = plan
+        if kind in ('thread', 'interrupt'):
+            return sum(1 for entry, argument in self._thread_instructions(code)
+                       if callable(entry) and entry == self.instruction_output_text)
+        return 0
+
+    def _resolve_dependencies(self):
+        """\
+        Dependency resolution phase of `CROSS-COMPILE-MISSING`_: find all words
+        that need to be output, starting with the not yet compiled words.
+        Returns a sorted list of (word, plan) tuples.
+        """
+        plans = {}
+        todo = sorted(self.not_yet_compiled_words, reverse=True)
+        self.not_yet_compiled_words.clear()
+        while todo:
+            word = todo.pop()
+            if word in plans or word in self.compiled_words:
+                continue
+            plan = plans[word] = self._cross_compile_plan(word)
+            todo.extend(self._plan_dependencies(plan))
+        self.compiled_words.update(plans)
+        return sorted(plans.items(), key=lambda item: item[0])
+
+    def _emit_fragment(self, word, label_id, position, plan=None):
+        """\
+        Output one word into a separate DocumentTree, starting with the given
+        label number and (chapter, section) position. Returns a tuple
+        (chapters, remembered words, final position).
+        """
+        state = (self.doctree, self.not_yet_compiled_words, self.label_id)
+        self.doctree = DocumentTree()
+        self.doctree.select(*position)
+        self.not_yet_compiled_words = set()
+        self.label_id = label_id
+        try:
+            self._emit_plan(plan if plan is not None else self._cross_compile_plan(word))
+            return (self.doctree.chapters,
+                    sorted(self.not_yet_compiled_words),
+                    (self.doctree.chapter_name, self.doctree.section_name))
+        finally:
+            self.doctree, self.not_yet_compiled_words, self.label_id = state
+
+    def _emit_words(self, plans):
+        """\
+        Emission phase of `CROSS-COMPILE-MISSING`_. The words are independent
+        of each other, they are output in separate DocumentTrees (in parallel
+        when self.jobs > 1) and merged in alphabetical order. Labels are
+        numbered in advance so that the output does not depend on the order of
+        execution.
+        """
+        position = (self.doctree.chapter_name, self.doctree.section_name)
+        jobs = []
+        for word, plan in plans:
+            jobs.append((word, self.label_id, position))
+            self.label_id += self._plan_label_count(plan)
+        results = None
+        if self.jobs > 1 and len(jobs) > 1:
+            results = _emit_in_processes(self, jobs)
+        if results is None:
+            results = [self._emit_fragment(*job, plan=plan) for job, (word, plan) in zip(jobs, plans)]
+        for chapters, remembered, position in results:
+            self.doctree.merge(chapters)
+            for word in remembered:
+                self._compile_remember(word)
+        if results:
+            # continue where the output of the last word ended
+            self.doctree.select(*position)
+
     @immediate
     @rpn.word('CROSS-COMPILE')
     def word_cross_compile(self, stack):
@@ -1075,7 +1397,7 @@ class Forth(rpn.RPNBase, rpn.RPNStackOps, rpn.RPNSimpleMathOps,
         then also compiled.
         """
         while self.not_yet_compiled_words:
-            self.instruction_cross_compile(self, word=self.not_yet_compiled_words.pop())
+            self._emit_words(self._resolve_dependencies())
 
     @rpn.word('CROSS-COMPILE-VARIABLES')
     def word_cross_compile_variables(self, stack):
@@ -1106,7 +1428,7 @@ class Forth(rpn.RPNBase, rpn.RPNStackOps, rpn.RPNSimpleMathOps,
         name = self.next_word()
         self._include(name)
 
-    def _include(self, name):
+    def _include_file(self, name):
         """Include given filename. The Forth code is directly executed."""
         # put all data from include in one chapter. remember previous chapter
         # at restore it at the end
@@ -1116,8 +1438,9 @@ class Forth(rpn.RPNBase, rpn.RPNStackOps, rpn.RPNSimpleMathOps,
             for prefix in self.include_path:
                 path = os.path.join(prefix, name)
                 if os.path.exists(path):
+                    self._user_includes += 1
                     self.logger.info('processing include {}'.format(name))
-                    self.interpret(rpn.words_in_file(name))
+                    self.interpret_sequence(rpn.tokens_in_file(name))
                     self.logger.info('done include {}'.format(name))
                     self.included_files.append(name)
                     break
@@ -1129,7 +1452,8 @@ class Forth(rpn.RPNBase, rpn.RPNStackOps, rpn.RPNSimpleMathOps,
                     raise ValueError('file not found: {}'.format(name))
                 else:
                     self.logger.info('processing include {}'.format(name))
-                    self.interpret(rpn.words_in_string(data, name='forth/{}'.format(name), include_newline=True))
+                    self.interpret_sequence(rpn.tokens_in_string(
+                        data, name='forth/{}'.format(name), include_newline=True))
                     self.logger.info('done include {}'.format(name))
                     self.included_files.append(name)
         self.doctree.pop_state()  # restore previous chapter and section
@@ -1153,6 +1477,41 @@ class Forth(rpn.RPNBase, rpn.RPNStackOps, rpn.RPNSimpleMathOps,
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
+# the instance used by the worker processes of _emit_in_processes
+_emitting_instance = None
+
+
+def _emit_fragment_in_process(job):
+    return _emitting_instance._emit_fragment(*job)
+
+
+def _emit_in_processes(forth, jobs):
+    """\
+    Run Forth._emit_fragment for the jobs in a pool of forked processes (they
+    inherit the state of the interpreter). Returns None if this is not
+    supported on this platform.
+    """
+    global _emitting_instance
+    import multiprocessing
+    try:
+        context = multiprocessing.get_context('fork')
+    except AttributeError:
+        # Python 2 forks on all platforms except Windows
+        if sys.platform == 'win32':
+            return None
+        context = multiprocessing
+    except ValueError:
+        return None
+    _emitting_instance = forth
+    pool = context.Pool(min(forth.jobs, len(jobs)))
+    try:
+        return pool.map(_emit_fragment_in_process, jobs)
+    finally:
+        pool.close()
+        pool.join()
+        _emitting_instance = None
+
+
 def main():
     import argparse
     logging.basicConfig(level=logging.ERROR)
@@ -1190,6 +1549,23 @@ def main():
         help='name of the output file (default: %(default)s)',
         metavar="FILE")
 
+    group.add_argument(
+        '-O', '--optimize',
+        type=int,
+        choices=(0, 1, 2),
+        default=0,
+        metavar='LEVEL',
+        help='optimization of the threaded code: 0=none, 1=constant folding'
+             ' and superinstructions, 2=also native code for small words'
+             ' (default: %(default)s)')
+
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=1,
+        metavar='N',
+        help='number of processes used to output the words (default: %(default)s)')
+
     parser.add_argument(
         '-i', '--interactive',
         action='store_true',
@@ -1221,19 +1597,19 @@ def main():
         # XXX make stderr unicode capable
         sys.stderr = codecs.getwriter("utf-8")(sys.stderr)
 
-    instructions = []
+    instructions = rpn.Tokens()
     include_paths = []
     for filename in args.FORTHFILE:
         if filename == '-':
             if args.verbose:
                 sys.stderr.write(u'reading stdin...\n')
-            instructions.extend(rpn.words_in_file('<stdin>', fileobj=sys.stdin, include_newline=True))
+            instructions.add_file('<stdin>', fileobj=sys.stdin, include_newline=True)
             include_paths.append('.')
         else:
             if args.verbose:
                 sys.stderr.write(u'reading file "{}"...\n'.format(filename))
             try:
-                instructions.extend(rpn.words_in_file(filename, include_newline=True))
+                instructions.add_file(filename, include_newline=True)
             except IOError as e:
                 sys.stderr.write('forth: {}: File not found\n'.format(filename))
                 sys.exit(1)
@@ -1242,6 +1618,10 @@ def main():
     try:
         forth = Forth()
         forth.init()
+        forth.jobs = args.jobs
+        if args.optimize:
+            from msp430.asm import forth_optimizer
+            forth.optimizer = forth_optimizer.ThreadOptimizer(forth, args.optimize)
         # default to source directory as include path
         forth.include_path = include_paths
         # extend include search path
@@ -1253,10 +1633,10 @@ def main():
                 symbol, value = definition.split('=', 1)
             else:
                 symbol, value = definition, '1'
-            forth.namespace[symbol.lower()] = value  # XXX inserted as string only
+            forth.define(symbol, value)
 
         #~ forth.doctree.chapter(filename)
-        forth.interpret(iter(instructions))
+        forth.interpret_sequence(instructions)
         forth.doctree.render(args.outfile)
     except rpn.RPNError as e:
         sys.stderr.write(u'{e.filename}:{e.lineno}: {e}\n'.format(e=e))
@@ -0,0 +1,459 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of https://github.com/zsquareplusc/python-msp430-tools
+# (C) 2026 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Optimizer for threaded code, used by the Forth cross compiler
+(msp430.asm.forth) before a Frame is output.
+
+- Optimization level 1: constant folding of literals, removal of constant
+  branches and replacement of common sequences by superinstructions (see
+  _superinstructions.forth).
+- Optimization level 2: additionally, small leaf words (only literals and
+  straight-line CODE words of the library) are compiled to native code.
+
+Only words of the built-in library are optimized, their semantics are known.
+The Frames of the host are not modified, the optimizer works on a copy.
+"""
+
+import re
+import sys
+
+try:
+    integer_types = (int, long)
+except NameError:
+    integer_types = (int,)
+
+# files of the built-in library, only words defined there are optimized
+LIBRARY = frozenset([
+    '__init__.forth',
+    '_builtins.forth',
+    '_memory.forth',
+    '_msp430_lowlevel.forth',
+    '_superinstructions.forth',
+])
+
+# maximal number of instructions of a word that is compiled to native code
+MAX_NATIVE = 8
+
+
+def s16(value):
+    """Interpret value as signed 16 bit number"""
+    value &= 0xffff
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def flag(condition):
+    return 0xffff if condition else 0
+
+
+# constant folding. the functions return None if the operation can not be
+# folded. the semantics are the ones of the target implementation.
+BINARY = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    'and': lambda a, b: a & b,
+    'or': lambda a, b: a | b,
+    'xor': lambda a, b: a ^ b,
+    'lshift': lambda a, b: a << b if 0 < b < 16 else None,
+    'rshift': lambda a, b: (a & 0xffff) >> b if 0 < b < 16 else None,
+    '<': lambda a, b: flag(s16(a) < s16(b)),
+    '>': lambda a, b: flag(s16(a) > s16(b)),
+    '>=': lambda a, b: flag(s16(a) >= s16(b)),
+    '=': lambda a, b: flag((a - b) & 0xffff == 0),
+    '==': lambda a, b: flag((a - b) & 0xffff == 0),
+    '!=': lambda a, b: flag((a - b) & 0xffff != 0),
+}
+
+UNARY = {
+    'invert': lambda a: ~a,
+    '2*': lambda a: a << 1,
+    '2/': lambda a: s16(a) >> 1,
+    '1+': lambda a: a + 1,
+    '1-': lambda a: a - 1,
+    '2+': lambda a: a + 2,
+    '2-': lambda a: a - 2,
+    '4+': lambda a: a + 4,
+    '4-': lambda a: a - 4,
+    'swpb': lambda a: ((a & 0xff) << 8) | ((a >> 8) & 0xff),
+    'sign-extend': lambda a: s16((a & 0xff) | (0xff00 if a & 0x80 else 0)),
+    '0=': lambda a: flag(a & 0xffff == 0),
+    'not': lambda a: flag(a & 0xffff == 0),
+}
+
+# literal followed by a word, replaced by a more efficient word
+LITERAL_WORDS = {
+    (1, '+'): '1+',
+    (2, '+'): '2+',
+    (4, '+'): '4+',
+    (1, '-'): '1-',
+    (2, '-'): '2-',
+    (4, '-'): '4-',
+}
+
+# (number of literals, word) -> superinstruction. the literals are stored
+# inline in the thread, after the superinstruction.
+SUPERINSTRUCTIONS = {
+    (1, '+'): 'LIT+',
+    (1, '-'): 'LIT-',
+    (1, 'and'): 'LIT-AND',
+    (1, 'or'): 'LIT-OR',
+    (1, 'xor'): 'LIT-XOR',
+    (1, '@'): 'LIT-@',
+    (1, 'c@'): 'LIT-C@',
+    (1, '!'): 'LIT-!',
+    (1, 'c!'): 'LIT-C!',
+    (2, '!'): 'LIT2-!',
+    (2, 'c!'): 'LIT2-C!',
+    (2, 'set'): 'LIT2-SET',
+    (2, 'reset'): 'LIT2-RESET',
+    (2, 'toggle'): 'LIT2-TOGGLE',
+    (2, 'cset'): 'LIT2-CSET',
+    (2, 'creset'): 'LIT2-CRESET',
+    (2, 'ctoggle'): 'LIT2-CTOGGLE',
+    (2, 'testbit'): 'LIT2-TESTBIT',
+    (2, 'ctestbit'): 'LIT2-CTESTBIT',
+}
+
+
+class Instruction(object):
+    """\
+    One decoded instruction of a thread. kind is one of 'lit', 'call',
+    'text', 'branch', 'branch0' and 'super'. Branches have a target, which is
+    an other Instruction or END.
+    """
+    __slots__ = ('kind', 'value', 'args', 'target')
+
+    def __init__(self, kind, value=None, args=(), target=None):
+        self.kind = kind
+        self.value = value
+        self.args = args
+        self.target = target
+
+    def cells(self):
+        """size in the thread"""
+        if self.kind == 'call':
+            return 1
+        elif self.kind == 'super':
+            return 1 + len(self.args)
+        return 2
+
+    def is_int_literal(self):
+        return self.kind == 'lit' and isinstance(self.value, integer_types) and not isinstance(self.value, bool)
+
+    def __repr__(self):
+        return 'Instruction({!r}, {!r})'.format(self.kind, self.value)
+
+
+END = Instruction('end')
+
+
+class ThreadOptimizer(object):
+    """Optimize the Frames of a Forth instance before they are cross compiled"""
+
+    def __init__(self, forth, level=1):
+        self.forth = forth
+        self.level = level
+        self._native_bodies = {}
+        # take the classes from the module of the instance, it may be
+        # __main__ when running "python -m msp430.asm.forth"
+        module = sys.modules[forth.__class__.__module__]
+        self.Frame = module.Frame
+        self.NativeFrame = module.NativeFrame
+        self.DocumentTree = module.DocumentTree
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def name_of(self, entry):
+        """Return the (lower case) name of a word in a thread"""
+        if hasattr(entry, 'rpn_name'):
+            return entry.rpn_name.lower()
+        elif isinstance(entry, self.Frame):
+            return entry.name.lower()
+        return None
+
+    def library_word(self, name):
+        """Return the target definition of a word if it is from the library"""
+        try:
+            definition = self.forth.look_up_target(name)
+        except KeyError:
+            return None
+        if isinstance(definition, self.Frame) and getattr(definition, 'chapter', None) in LIBRARY:
+            return definition
+        return None
+
+    def call_name(self, instruction):
+        """Name of a called library word or None"""
+        if instruction.kind == 'call':
+            name = self.name_of(instruction.value)
+            if name is not None and self.library_word(name) is not None:
+                return name
+        return None
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def decode(self, frame):
+        """\
+        Convert a Frame to a list of Instructions. Returns None if the frame
+        contains something that is not understood (then it is not optimized).
+        """
+        forth = self.forth
+        code = []
+        at_cell = {}
+        branches = []
+        position = 0
+        while position < len(frame):
+            entry = frame[position]
+            at_cell[position] = len(code)
+            if entry == forth.instruction_literal:
+                code.append(Instruction('lit', frame[position + 1]))
+                position += 2
+            elif entry == forth.instruction_output_text:
+                code.append(Instruction('text', frame[position + 1]))
+                position += 2
+            elif entry == forth.instruction_seek or entry == forth.instruction_branch_if_false:
+                kind = 'branch' if entry == forth.instruction_seek else 'branch0'
+                instruction = Instruction(kind)
+                branches.append((instruction, position + 1 + frame[position + 1]))
+                code.append(instruction)
+                position += 2
+            elif callable(entry) and self.name_of(entry) is not None:
+                code.append(Instruction('call', entry))
+                position += 1
+            else:
+                return None
+        for instruction, cell in branches:
+            if cell == len(frame):
+                instruction.target = END
+            elif cell in at_cell:
+                instruction.target = code[at_cell[cell]]
+            else:
+                return None     # jump into the middle of an instruction
+        return code
+
+    def encode(self, frame, code):
+        """Convert a list of Instructions back to a (new) Frame"""
+        forth = self.forth
+        positions = {}
+        position = 0
+        for instruction in code:
+            positions[id(instruction)] = position
+            position += instruction.cells()
+        positions[id(END)] = position
+        new_frame = frame.__class__.__new__(frame.__class__)
+        new_frame.__dict__.update(frame.__dict__)
+        for instruction in code:
+            if instruction.kind == 'lit':
+                new_frame.extend([forth.instruction_literal, instruction.value])
+            elif instruction.kind == 'text':
+                new_frame.extend([forth.instruction_output_text, instruction.value])
+            elif instruction.kind in ('branch', 'branch0'):
+                offset_cell = len(new_frame) + 1
+                if instruction.kind == 'branch':
+                    new_frame.append(forth.instruction_seek)
+                else:
+                    new_frame.append(forth.instruction_branch_if_false)
+                new_frame.append(positions[id(instruction.target)] - offset_cell)
+            elif instruction.kind == 'call':
+                new_frame.append(instruction.value)
+            elif instruction.kind == 'super':
+                new_frame.append(instruction.value)
+                new_frame.extend(instruction.args)
+        return new_frame
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def _targets(self, code):
+        return set(id(i.target) for i in code if i.kind in ('branch', 'branch0'))
+
+    def _replace(self, code, index, count, replacement):
+        """\
+        Replace count instructions at index. Branches to the first replaced
+        instruction are redirected to the replacement (or the instruction
+        following it).
+        """
+        old = code[index]
+        if replacement:
+            new_target = replacement[0]
+        elif index + count < len(code):
+            new_target = code[index + count]
+        else:
+            new_target = END
+        code[index:index + count] = replacement
+        for instruction in code:
+            if instruction.kind in ('branch', 'branch0') and instruction.target is old:
+                instruction.target = new_target
+
+    def _match(self, code, index, count, targets):
+        """True if count instructions are available and none but the first is a branch target"""
+        if index + count > len(code):
+            return False
+        return not any(id(i) in targets for i in code[index + 1:index + count])
+
+    def fold(self, code):
+        """Constant folding and removal of constant branches, in place"""
+        changed = True
+        while changed:
+            changed = False
+            targets = self._targets(code)
+            for index, instruction in enumerate(code):
+                replacement = None
+                if instruction.is_int_literal():
+                    if self._match(code, index, 3, targets) and code[index + 1].is_int_literal():
+                        name = self.call_name(code[index + 2])
+                        if name in BINARY:
+                            value = BINARY[name](instruction.value, code[index + 1].value)
+                            if value is not None:
+                                replacement = (3, [Instruction('lit', value & 0xffff)])
+                        elif name == 'swap':
+                            replacement = (3, [code[index + 1], instruction])
+                    if replacement is None and self._match(code, index, 2, targets):
+                        following = code[index + 1]
+                        name = self.call_name(following)
+                        if name in UNARY:
+                            replacement = (2, [Instruction('lit', UNARY[name](instruction.value) & 0xffff)])
+                        elif name == 'drop':
+                            replacement = (2, [])
+                        elif following.kind == 'branch0':
+                            if instruction.value & 0xffff:
+                                replacement = (2, [])
+                            else:
+                                replacement = (2, [Instruction('branch', target=following.target)])
+                elif instruction.kind == 'branch':
+                    following = code[index + 1] if index + 1 < len(code) else END
+                    if instruction.target is following:
+                        replacement = (1, [])
+                if replacement is not None:
+                    self._replace(code, index, replacement[0], replacement[1])
+                    changed = True
+                    break
+        return code
+
+    def fuse(self, code):
+        """Replace literal/word sequences by superinstructions, in place"""
+        index = 0
+        while index < len(code):
+            targets = self._targets(code)
+            for count in (2, 1):
+                if not self._match(code, index, count + 1, targets):
+                    continue
+                literals = code[index:index + count]
+                if not all(i.is_int_literal() for i in literals):
+                    continue
+                name = self.call_name(code[index + count])
+                if name is None:
+                    continue
+                if count == 1 and (literals[0].value, name) in LITERAL_WORDS:
+                    word = self.library_word(LITERAL_WORDS[literals[0].value, name])
+                    if word is not None:
+                        self._replace(code, index, 2, [Instruction('call', word)])
+                        break
+                super_name = SUPERINSTRUCTIONS.get((count, name))
+                if super_name is not None:
+                    word = self.library_word(super_name.lower())
+                    if word is not None:
+                        self._replace(code, index, count + 1, [
+                            Instruction('super', word, tuple(i.value for i in literals))])
+                        break
+            index += 1
+        return code
+
+    def optimize(self, frame):
+        """Return an optimized copy of the frame (or the frame itself)"""
+        code = self.decode(frame)
+        if code is None:
+            return frame
+        self.fold(code)
+        self.fuse(code)
+        return self.encode(frame, code)
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    def native_body(self, name):
+        """\
+        Return the assembler lines of a library CODE word, without the final
+        NEXT. None if the word can not be inlined (labels, jumps, access to
+        the thread etc.)
+        """
+        try:
+            return self._native_bodies[name]
+        except KeyError:
+            pass
+        body = None
+        word = self.library_word(name)
+        if isinstance(word, self.NativeFrame) and self.forth.word_depends_on not in word:
+            body = self._capture(word)
+        self._native_bodies[name] = body
+        return body
+
+    def _capture(self, word):
+        """Execute a CODE word and check if its output can be inlined"""
+        forth = self.forth
+        doctree = forth.doctree
+        forth.doctree = self.DocumentTree()
+        try:
+            word(forth)
+            text = u''.join(forth.doctree.current_section)
+        finally:
+            forth.doctree = doctree
+        lines = [line.strip() for line in text.splitlines() if line.strip()]
+        if not lines or _mnemonic(lines[-1]) != ('br', '@IP+'):
+            return None
+        lines = lines[:-1]
+        for line in lines:
+            mnemonic, operands = _mnemonic(line)
+            if (':' in line.split(';')[0] or mnemonic.startswith('j') or
+                    mnemonic in ('br', 'ret', 'reti') or m_ip.search(operands)):
+                return None
+        return lines
+
+    def native_code(self, frame):
+        """\
+        Return a list of assembler lines implementing a (leaf) word or None
+        if it can not be compiled to native code.
+        """
+        if self.level < 2 or type(frame) is not self.Frame:
+            return None
+        code = self.decode(frame)
+        if code is None:
+            return None
+        self.fold(code)
+        if not code or len(code) > MAX_NATIVE:
+            return None
+        lines = []
+        pending = []    # literals not yet pushed (cached at compile time)
+        for instruction in code:
+            if instruction.kind == 'lit':
+                if not instruction.is_int_literal():
+                    return None
+                pending.append(u'#{}'.format(instruction.value))
+            elif instruction.kind == 'call':
+                name = self.call_name(instruction)
+                body = self.native_body(name) if name is not None else None
+                if body is None:
+                    return None
+                for line in body:
+                    mnemonic, operands = _mnemonic(line)
+                    if pending and mnemonic == 'pop':
+                        lines.append(u'mov {}, {}'.format(pending.pop(), operands))
+                    elif pending and (mnemonic, operands) == ('incd', 'SP'):
+                        pending.pop()   # DROP of a literal
+                    else:
+                        lines.extend(u'push {}'.format(operand) for operand in pending)
+                        del pending[:]
+                        lines.append(line)
+            else:
+                return None
+        lines.extend(u'push {}'.format(operand) for operand in pending)
+        return lines
+
+
+m_ip = re.compile(r'\bIP\b')
+
+
+def _mnemonic(line):
+    """Split an assembler line in mnemonic and operands (without comment)"""
+    code = line.split(';')[0].strip()
+    parts = code.split(None, 1)
+    if not parts:
+        return ('', '')
+    return (parts[0].lower(), parts[1].strip() if len(parts) > 1 else '')
@@ -14,13 +14,182 @@ header files for the TI MSP430.
 
 import logging
 import codecs
+import os
+import sys
+from io import StringIO
 import msp430.asm.cpp
+from msp430.asm import cache
+
+
+def write_definitions(namespace, outfile, errors):
+    """\
+    Write the defines of the preprocessor (namespace is its Evaluator) as Forth
+    CONSTANTs. Definitions that can not be evaluated are reported to errors
+    (file like object).
+    """
+    outfile.write(u': <UNDEFINED> 0 ;\n')
+    #~ for definition in cpp.macros:
+        #~ print definition
+    for name, definition in sorted(namespace.defines.items()):
+        #~ print name, definition
+        # MSP430 specific hack to get peripherals:
+        if name.endswith('_') and not name.startswith('_'):
+            name = name[:-1]
+        if definition:
+            try:
+                value = namespace.eval(definition)
+            except msp430.asm.cpp.PreprocessorError as e:
+                errors.write(u'cannot convert expression: {}\n'.format(e))
+            except msp430.asm.rpn.RPNError as e:
+                errors.write(u'cannot convert expression: {}\n'.format(e))
+            else:
+                outfile.write(u'{!r} CONSTANT {}\n'.format(value, name))
+        else:
+            outfile.write(u'1 CONSTANT {}\n'.format(name))
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# batch conversion of a directory
+
+MANIFEST = 'h2forth-manifest.json'
+
+# state of the preprocessor after the preload file, set up in each worker
+_batch_state = None
+
+
+def _init_batch(include_path, defines, macros):
+    global _batch_state
+    _batch_state = (include_path, defines, macros)
+
+
+def convert_header(path):
+    """\
+    Convert one header, starting with the state given to _init_batch. Returns
+    a tuple (path, Forth text or None on errors, messages, included files).
+    """
+    include_path, defines, macros = _batch_state
+    cpp = msp430.asm.cpp.Preprocessor()
+    cpp.include_path.extend(include_path)
+    cpp.namespace.defines.update(defines)
+    cpp.macros.update(macros)
+    includes = []
+    errors = StringIO()
+    output = StringIO()
+    try:
+        with codecs.open(path, 'r', 'utf-8') as infile:
+            error_found = cpp.preprocess(infile, msp430.asm.cpp.Discard(), path, includes.append)
+        if error_found:
+            return path, None, u'{}: #error found\n'.format(path), includes
+        write_definitions(cpp.namespace, output, errors)
+    except msp430.asm.cpp.PreprocessorError as e:
+        return path, None, u'{e.filename}:{e.line}: {e}\n'.format(e=e), includes
+    except Exception as e:
+        # e.g. RPNError from an #if, IOError or UnicodeDecodeError. one broken
+        # header must not abort the conversion of the others
+        return path, None, u'{}: {}: {}\n'.format(path, e.__class__.__name__, e), includes
+    return path, output.getvalue(), errors.getvalue(), includes
+
+
+def convert_directory(directory, output_directory, include_path, defines, macros,
+                      pattern='*.h', jobs=1, force=False):
+    """\
+    Convert all headers matching the pattern in a directory to
+    <output_directory>/<name>.forth. The conversions run in a pool of jobs
+    processes, all starting with the given defines and macros (e.g. the state
+    after a common header).
+
+    A manifest with fingerprints of the headers and the files they include
+    is kept in the output directory, headers are only converted again if one
+    of these, the tool or the initial state changed. Returns a tuple (converted, skipped,
+    failed) with lists of header names.
+    """
+    import fnmatch
+    import json
+    log = logging.getLogger('h2forth')
+    # headers include other headers from the same directory
+    include_path = list(include_path) + [directory]
+    tool_key = cache.fingerprint(
+        ('file', __file__),
+        ('file', msp430.asm.cpp.__file__),
+        ('file', msp430.asm.rpn.__file__),
+        ('file', msp430.asm.infix2postfix.__file__),
+        include_path, sorted(defines.items()), sorted(macros.items()))
+    manifest_path = os.path.join(output_directory, MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if tool_key is None or manifest.get('tool') != tool_key:
+            manifest = {}
+    except (IOError, OSError, ValueError):
+        manifest = {}
+    headers = manifest.get('headers', {})
+
+    def output_name(name):
+        return os.path.join(output_directory, os.path.splitext(name)[0] + '.forth')
+
+    def unchanged(name):
+        entry = headers.get(name)
+        return (entry is not None and
+                os.path.exists(output_name(name)) and
+                msp430.asm.cpp.file_digest(os.path.join(directory, name)) == entry['digest'] and
+                all(msp430.asm.cpp.file_digest(include) == digest for include, digest in entry['includes']))
+
+    skipped = []
+    paths = []
+    for name in sorted(fnmatch.filter(os.listdir(directory), pattern)):
+        if not force and unchanged(name):
+            skipped.append(name)
+        else:
+            paths.append(os.path.join(directory, name))
+    log.info('{} headers to convert, {} unchanged'.format(len(paths), len(skipped)))
+
+    if not os.path.isdir(output_directory):
+        os.makedirs(output_directory)
+    try:
+        if jobs > 1 and len(paths) > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(min(jobs, len(paths)), _init_batch, (include_path, defines, macros))
+            try:
+                results = pool.imap(convert_header, paths)
+                converted, failed = _save_results(results, output_name, headers, log)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            _init_batch(include_path, defines, macros)
+            converted, failed = _save_results((convert_header(path) for path in paths), output_name, headers, log)
+    finally:
+        # keep the headers that were converted so far, also when aborted
+        with open(manifest_path, 'w') as f:
+            json.dump({'tool': tool_key, 'headers': headers}, f, indent=1, sort_keys=True)
+    return converted, skipped, failed
+
+
+def _save_results(results, output_name, headers, log):
+    """Write the results of convert_header and update the manifest entries"""
+    converted = []
+    failed = []
+    for path, text, messages, includes in results:
+        name = os.path.basename(path)
+        for line in messages.splitlines():
+            log.warning('{}: {}'.format(name, line))
+        if text is None:
+            headers.pop(name, None)
+            failed.append(name)
+            continue
+        with codecs.open(output_name(name), 'w', 'utf-8') as f:
+            f.write(text)
+        headers[name] = {
+            'digest': msp430.asm.cpp.file_digest(path),
+            'includes': [(include, msp430.asm.cpp.file_digest(include)) for include in includes],
+        }
+        converted.append(name)
+        log.info('converted {}'.format(name))
+    return converted, failed
 
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 def main():
-    import sys
-    import os
     import argparse
     logging.basicConfig()
 
@@ -33,6 +202,11 @@ def main():
 
     group = parser.add_argument_group('Input')
 
+    group.add_argument(
+        '-p', '--preload',
+        help='process this file first. its output is discarded but definitions are kept.',
+        metavar='FILE')
+
     group.add_argument(
         '-I', '--include-path',
         action='append',
@@ -57,6 +231,35 @@ def main():
         help='name of the output file (default: %(default)s)',
         metavar="FILE")
 
+    group = parser.add_argument_group('Batch conversion')
+
+    group.add_argument(
+        '--batch',
+        metavar='DIR',
+        help='convert all headers in the directory instead of HEADERFILE')
+
+    group.add_argument(
+        '--pattern',
+        default='msp430*.h',
+        help='file name pattern of the headers in batch mode (default: %(default)s)')
+
+    group.add_argument(
+        '--output-directory',
+        metavar='DIR',
+        help='where the .forth files and the manifest are written in batch mode')
+
+    group.add_argument(
+        '-j', '--jobs',
+        type=int,
+        metavar='N',
+        help='number of processes in batch mode (default: number of CPUs)')
+
+    group.add_argument(
+        '--force',
+        action='store_true',
+        default=False,
+        help='convert all headers in batch mode, even if unchanged')
+
     parser.add_argument(
         '-v', '--verbose',
         action='store_true',
@@ -70,6 +273,8 @@ def main():
         help='print debug messages')
 
     args = parser.parse_args()
+    if args.batch and not args.output_directory:
+        parser.error('--batch requires --output-directory')
 
     if args.develop:
         logging.getLogger('cpp').setLevel(logging.DEBUG)
@@ -77,6 +282,7 @@ def main():
         logging.getLogger('cpp').setLevel(logging.INFO)
     else:
         logging.getLogger('cpp').setLevel(logging.WARN)
+    logging.getLogger('h2forth').setLevel(logging.INFO if args.verbose else logging.WARN)
 
     cpp = msp430.asm.cpp.Preprocessor()
     # extend include search path
@@ -94,6 +300,25 @@ def main():
             symbol, value = definition, '1'
         cpp.namespace.defines[symbol] = value
 
+    if args.preload:
+        cpp.preprocess(codecs.open(args.preload, 'r', 'utf-8'), msp430.asm.cpp.Discard(), args.preload)
+
+    if args.batch:
+        # errors are reported per header, without the traceback of the RPN logger
+        logging.getLogger('rpn').setLevel(logging.CRITICAL)
+        if args.jobs is None:
+            import multiprocessing
+            args.jobs = multiprocessing.cpu_count()
+        converted, skipped, failed = convert_directory(
+            args.batch, args.output_directory,
+            cpp.include_path, cpp.namespace.defines, cpp.macros,
+            pattern=args.pattern, jobs=args.jobs, force=args.force)
+        sys.stderr.write('h2forth: {} converted, {} unchanged, {} failed\n'.format(
+            len(converted), len(skipped), len(failed)))
+        if failed:
+            sys.exit(1)
+        return
+
     if not args.HEADERFILE or args.HEADERFILE == '-':
         infilename = '<stdin>'
         infile = argparse.FileType('r')('-')
@@ -119,25 +344,7 @@ def main():
                 sys.stderr.write('{e.filename}:{e.line}: input line: {e.text!r}\n'.format(e=e))
         sys.exit(1)
 
-    args.outfile.write(': <UNDEFINED> 0 ;\n')
-    #~ for definition in cpp.macros:
-        #~ print definition
-    for name, definition in sorted(cpp.namespace.defines.items()):
-        #~ print name, definition
-        # MSP430 specific hack to get peripherals:
-        if name.endswith('_') and not name.startswith('_'):
-            name = name[:-1]
-        if definition:
-            try:
-                value = cpp.namespace.eval(definition)
-            except msp430.asm.cpp.PreprocessorError as e:
-                sys.stderr.write('cannot convert expression: {}\n'.format(e))
-            except msp430.asm.rpn.RPNError as e:
-                sys.stderr.write('cannot convert expression: {}\n'.format(e))
-            else:
-                args.outfile.write('{!r} CONSTANT {}\n'.format(value, name))
-        else:
-            args.outfile.write('1 CONSTANT {}\n'.format(name))
+    write_definitions(cpp.namespace, args.outfile, sys.stderr)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of https://github.com/zsquareplusc/python-msp430-tools
+# (C) 2026 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Compare two layout reports, as written by ``ld --layout``.
+
+This allows to track the size of segments, input files and symbols between
+builds without linking again. The exit code can be used to flag size
+regressions.
+"""
+
+import json
+
+
+def symbol_key(symbol):
+    """\
+    Key to identify a symbol across reports. Local symbols (starting with a
+    dot) are only unique within their input file.
+    """
+    if symbol['name'].startswith('.'):
+        return u'{}:{}'.format(symbol['file'], symbol['name'])
+    return symbol['name']
+
+
+def compare(old, new):
+    """\
+    Compare two layout reports (dictionaries). Return a dictionary with
+    lists of (name, old_size, new_size) tuples for 'segments', 'inputs' and
+    'symbols', containing only the entries that changed. The sizes are None
+    for entries that are missing in one of the reports.
+    """
+    result = {}
+    for category, key in (('segments', lambda x: x['name']),
+                          ('inputs', lambda x: x['file']),
+                          ('symbols', symbol_key)):
+        old_sizes = dict((key(entry), entry['size']) for entry in old[category])
+        new_sizes = dict((key(entry), entry['size']) for entry in new[category])
+        changes = []
+        for name in sorted(set(old_sizes) | set(new_sizes)):
+            old_size = old_sizes.get(name)
+            new_size = new_sizes.get(name)
+            if old_size != new_size:
+                changes.append((name, old_size, new_size))
+        result[category] = changes
+    return result
+
+
+def format_size(size):
+    return '-' if size is None else str(size)
+
+
+def format_delta(old_size, new_size):
+    return '{:+d}'.format((new_size or 0) - (old_size or 0))
+
+
+def print_changes(output, title, changes):
+    """Write a table with changes."""
+    if changes:
+        output.write(u'{}:\n'.format(title))
+        for name, old_size, new_size in changes:
+            output.write(u'    {:<32} {:>8} {:>8} {:>8}\n'.format(
+                name,
+                format_size(old_size),
+                format_size(new_size),
+                format_delta(old_size, new_size)))
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def main():
+    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description="""\
+Compare two layout reports written by "ld --layout". The exit code is 1 when
+the total size grew more than allowed by --max-growth.""")
+
+    parser.add_argument(
+        'OLD',
+        type=argparse.FileType('r'),
+        help='layout report of the reference build')
+
+    parser.add_argument(
+        'NEW',
+        type=argparse.FileType('r'),
+        help='layout report of the build to check')
+
+    parser.add_argument(
+        '--max-growth',
+        type=int,
+        metavar='BYTES',
+        help='fail if the total (downloaded) size grew more than this')
+
+    parser.add_argument(
+        '--no-symbols',
+        action='store_false',
+        dest='symbols',
+        default=True,
+        help='do not list changes of individual symbols')
+
+    args = parser.parse_args()
+
+    old = json.load(args.OLD)
+    new = json.load(args.NEW)
+    changes = compare(old, new)
+
+    sys.stdout.write(u'    {:<32} {:>8} {:>8} {:>8}\n'.format('', 'old', 'new', 'delta'))
+    print_changes(sys.stdout, 'Segments', changes['segments'])
+    print_changes(sys.stdout, 'Inputs', changes['inputs'])
+    if args.symbols:
+        print_changes(sys.stdout, 'Symbols', changes['symbols'])
+    sys.stdout.write(u'Total: {} -> {} bytes ({})\n'.format(
+        old['total'], new['total'], format_delta(old['total'], new['total'])))
+
+    if args.max_growth is not None and new['total'] - old['total'] > args.max_growth:
+        sys.stderr.write('layout: total size grew by {} bytes (allowed: {})\n'.format(
+            new['total'] - old['total'], args.max_growth))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,13 +8,13 @@
 """\
 Linker for TI MSP430.
 
-Inputs are '.o4' files from 'as.py'
+Inputs are '.o4' files from 'as.py' (text or binary format).
 """
 
 import sys
 import codecs
 from msp430.asm import mcu_definition_parser
-from msp430.asm import rpn, peripherals
+from msp430.asm import rpn, peripherals, object_file
 from msp430.asm.cpp import hexlify
 
 
@@ -211,10 +211,39 @@ class Linker(rpn.RPN):
         self.source_filename = '<unknown>'
         self.source_line = None
         self.source_column = None
+        self.input_filename = None
         # internal states
         self.current_segment = None
         self.address = 0
         self.segments = {}
+        # BRANCH instructions (counted per pass) that are written as JMP and
+        # the list of all branches, recorded while relaxing
+        self.relaxed_branches = set()
+        self.branches = None
+        self._branch_count = 0
+        # symbol extents and per input contributions, recorded in pass 3
+        self.layout_symbols = None
+        self.layout_contributions = None
+        self._layout_symbol = None
+        self._layout_start = None
+
+    def interpret_sequence(self, sequence, filename=None):
+        """\
+        Interpret a sequence of words. The words of an ObjectCode instance are
+        plain strings, their location is looked up in the side table when an
+        error occurs.
+        """
+        if not isinstance(sequence, object_file.ObjectCode):
+            return rpn.RPN.interpret_sequence(self, sequence, filename)
+        iterator = iter(sequence.words)
+        try:
+            self.interpret(iterator)
+        except rpn.RPNError as e:
+            if e.lineno is None:
+                position = len(sequence.words) - iterator.__length_hint__() - 1
+                filename, e.lineno, e.text = sequence.location(position)
+                e.filename = filename or e.filename
+            raise
 
     def linker_error(self, message):
         """\
@@ -229,7 +258,9 @@ class Linker(rpn.RPN):
         Reset state. This can be used between files, so that every file starts
         with the same preconditions (such as no segment selected).
         """
+        self.close_layout_block()
         self.current_segment = None
+        self.input_filename = None
         self.source_filename = '<unknown>'
         self.source_line = None
         self.source_column = None
@@ -248,6 +279,7 @@ class Linker(rpn.RPN):
             segment = self.segments[name]
         except KeyError:
             self.linker_error('There is no segment named {}'.format(name))
+        self.close_layout_block()
         self.current_segment = segment
         if segment.start_address is not None:
             address = segment.start_address
@@ -255,16 +287,20 @@ class Linker(rpn.RPN):
             # this happens in the first pass
             address = 0
         self.address = address + len(segment.data)
+        self._layout_start = self.address
 
     @rpn.word('FILENAME')
     def word_FILENAME(self, rpn):
         """\
         Store source filename for error messages. This also clears all local
-        symbols. Example::
+        symbols. The first filename after ``RESET`` names the input file (used
+        for the layout report). Example::
 
             FILENAME source.S
         """
         self.source_filename = self.next_word()
+        if self.input_filename is None:
+            self.input_filename = self.source_filename
 
     @rpn.word('LINE')
     def word_LINE(self, rpn):
@@ -387,7 +423,21 @@ class Linker(rpn.RPN):
     @rpn.word('CREATE-SYMBOL')
     def _create_symbol(self, rpn):
         """Mark current location with symbol. Example: ``CREATE-SYMBOL somelabel``"""
-        name = self.name_symbol(self.next_word())
+        word = self.next_word()
+        # local labels (starting with a dot) belong to the preceding global
+        # symbol, as for garbage_collect()
+        if self.layout_symbols is not None and self.current_segment is not None and word[0] != '.':
+            if self._layout_symbol is not None:
+                self._layout_symbol['end'] = self.address
+            self._layout_symbol = {
+                'name': word,
+                'file': self.input_filename,
+                'segment': self.current_segment.name,
+                'start': self.address,
+                'end': self.address,
+            }
+            self.layout_symbols.append(self._layout_symbol)
+        name = self.name_symbol(word)
         #~ # this simple check does not work as we're doing multiple passes
         if self.check_labels is not None:
             if name in self.check_labels:
@@ -438,6 +488,38 @@ class Linker(rpn.RPN):
         self.current_segment.write_16bit(instruction)
         self.address += 2
 
+    @rpn.word('BRANCH')
+    def word_BRANCH(self, rpn):
+        """\
+        MSP430 branch instruction (``BR #target``). Takes instruction and
+        target address from the stack and writes the instruction followed by
+        the address. If the branch was selected by relax_branches(), a JMP
+        (2 bytes instead of 4) is written instead.
+
+        Example::
+
+            0x4030 GET-SYMBOL somelabel BRANCH
+        """
+        target = self.pop()
+        instruction = self.pop()
+        if self.current_segment is None:
+            self.linker_error('No segment selected (use .text, .section etc.)')
+        n = self._branch_count
+        self._branch_count += 1
+        if self.branches is not None:
+            self.branches.append((n, self.address, target, self.current_segment))
+        if n in self.relaxed_branches:
+            distance = target - self.address - 2
+            if distance < -512 * 2 or distance > 511 * 2:
+                if self.errors_are_fatal:
+                    self.linker_error('Relaxed branch out of range (distance {})'.format(distance))
+            self.current_segment.write_16bit(0x3c00 | (0x3ff & (distance // 2)))
+            self.address += 2
+        else:
+            self.current_segment.write_16bit(instruction)
+            self.current_segment.write_16bit(target)
+            self.address += 4
+
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     def segments_from_definition(self, segment_definitions):
@@ -504,6 +586,58 @@ class Linker(rpn.RPN):
             if segment.mirror_of is not None:
                 segment.data = list(self.segments[segment.mirror_of].data)
 
+    def close_layout_block(self):
+        """\
+        Account the data that was written since the last symbol or segment
+        change to the current symbol and input file. Only active in pass 3.
+        """
+        if self.layout_symbols is None:
+            return
+        if self._layout_symbol is not None:
+            self._layout_symbol['end'] = self.address
+            self._layout_symbol = None
+        if self.current_segment is not None and self._layout_start is not None:
+            key = (self.input_filename, self.current_segment.name)
+            self.layout_contributions[key] = self.layout_contributions.get(key, 0) + self.address - self._layout_start
+        self._layout_start = None
+
+    def layout(self):
+        """\
+        Return a dictionary describing the memory layout after linking: used
+        segments, the contribution of each input file per segment and the
+        location and size of each symbol. It can be saved as JSON and compared
+        with ``msp430.asm.layout``.
+        """
+        segments = []
+        for segment in sorted(self.segments.values()):
+            if segment is self.top_segment or None in (segment.start_address, segment.end_address):
+                continue
+            if segment.end_address > segment.start_address:
+                segments.append({
+                    'name': segment.name,
+                    'start': segment.start_address,
+                    'end': segment.end_address,
+                    'size': segment.end_address - segment.start_address,
+                    'parent': segment.parent,
+                    'programmable': segment.programmable,
+                })
+        inputs = {}
+        for (filename, segment_name), size in self.layout_contributions.items():
+            if size:
+                inputs.setdefault(filename, {})[segment_name] = size
+        symbols = []
+        for symbol in sorted(self.layout_symbols, key=lambda x: (x['start'], x['name'])):
+            symbol = dict(symbol)
+            symbol['size'] = symbol['end'] - symbol['start']
+            symbols.append(symbol)
+        return {
+            'segments': segments,
+            'inputs': [{'file': filename, 'segments': sizes, 'size': sum(sizes.values())}
+                       for filename, sizes in sorted(inputs.items())],
+            'symbols': symbols,
+            'total': sum(len(segment.data) for segment in self.segments.values() if segment.programmable),
+        }
+
     def name_symbol(self, name):
         """Name mangling for local symbols, otherwise return original name."""
         if name[0] == '.':
@@ -516,6 +650,121 @@ class Linker(rpn.RPN):
             if name[0] == '.':
                 del self.labels[name]
 
+    def garbage_collect(self, keep=(), segments=('.text',)):
+        """\
+        Remove blocks of code that are not referenced. A block starts with a
+        global label (``CREATE-SYMBOL``, local labels belong to the block of
+        the preceding global label) in one of the given segments and extends
+        up to the next global label or segment change.
+
+        The roots are the contents of all other segments (e.g. the interrupt
+        vectors, including the reset vector), code in front of the first label
+        of a segment, blocks that define constants or weak aliases and the
+        symbols listed in keep. A block that does not end with an
+        unconditional jump, branch or return also keeps the following block,
+        as execution may continue there.
+
+        The instructions are replaced, the removed symbols are returned.
+        """
+        words = list(self.instructions)
+        blocks = []         # [start, end, labels, references, is_root]
+        defined_in = {}     # symbol name -> block index
+        weak_alias = {}
+        root_references = set(keep)
+        block = None
+        segment = None
+        self.word_reset(self)
+        position = 0
+        while position < len(words):
+            word = words[position].lower()
+            if word in ('reset', 'segment') or (
+                    word == 'create-symbol' and segment in segments and words[position + 1][0] != '.'):
+                if block is not None:
+                    block[1] = position
+                if word == 'reset':
+                    block = segment = None
+                    self.word_reset(self)
+                else:
+                    if word == 'segment':
+                        segment = words[position + 1]
+                    block = [position, len(words), [], set(), segment not in segments or word == 'segment']
+                    blocks.append(block)
+            if word == 'filename':
+                self.source_filename = words[position + 1]
+                position += 2
+            elif word == 'segment':
+                position += 2
+            elif word == 'create-symbol':
+                name = self.name_symbol(words[position + 1])
+                if block is not None:
+                    block[2].append(name)
+                    defined_in[name] = len(blocks) - 1
+                position += 2
+            elif word == 'get-symbol':
+                name = self.name_symbol(words[position + 1])
+                (block[3] if block is not None else root_references).add(name)
+                position += 2
+            elif word == 'constant-symbol':
+                if block is not None:
+                    block[4] = True
+                position += 2
+            elif word == 'weak-alias':
+                if block is not None:
+                    block[4] = True
+                weak_alias[self.name_symbol(words[position + 1])] = self.name_symbol(words[position + 2])
+                position += 3
+            else:
+                position += 1
+        self.word_reset(self)
+
+        # mark all blocks that are reachable from the roots
+        todo = [n for n, block in enumerate(blocks) if block[4]]
+        for name in root_references:
+            while name not in defined_in and name in weak_alias:
+                name = weak_alias[name]
+            if name in defined_in:
+                todo.append(defined_in[name])
+        reachable = set()
+        while todo:
+            n = todo.pop()
+            if n in reachable:
+                continue
+            reachable.add(n)
+            start, end, labels, references, is_root = blocks[n]
+            for name in references:
+                while name not in defined_in and name in weak_alias:
+                    name = weak_alias[name]
+                if name in defined_in:
+                    todo.append(defined_in[name])
+            if n + 1 < len(blocks) and blocks[n + 1][0] == end and not ends_with_transfer(words[start:end]):
+                todo.append(n + 1)
+
+        # keep everything except unreachable blocks, but keep the FILENAME
+        # statements as local symbol names depend on them
+        kept = []
+        removed = []
+        position = 0
+        for n, (start, end, labels, references, is_root) in enumerate(blocks):
+            if n in reachable:
+                continue
+            removed.extend(labels)
+            kept.append((position, start))
+            for i in range(start, end - 1):
+                if words[i].lower() == 'filename':
+                    kept.append((i, i + 2))
+            position = end
+        kept.append((position, len(words)))
+        if isinstance(self.instructions, object_file.ObjectCode):
+            instructions = object_file.ObjectCode()
+            for start, end in kept:
+                instructions.append_object(self.instructions.slice(start, end))
+        else:
+            instructions = []
+            for start, end in kept:
+                instructions.extend(self.instructions[start:end])
+        self.instructions = instructions
+        return removed
+
     # helper functions for 3 pass linking
 
     def pass_one(self):
@@ -525,11 +774,45 @@ class Linker(rpn.RPN):
         """
         self.errors_are_fatal = False     # 1st two runs are used to find out data positioning only
         self.top_segment.clear()
+        self._branch_count = 0
         self.interpret_sequence(self.instructions)
         # update segment start and end_addresses, handle alignment
         self.update_mirrored_segments()
         self.top_segment.shrink_to_fit()
 
+    def relax_branches(self):
+        """\
+        Optional step between pass 1 and 2: replace BRANCH instructions by
+        a JMP when the target is within the same segment and in range. As the
+        code gets smaller, other branches can get in range, so the positions
+        are determined again until no more branches are converted and the
+        labels are stable. Return the number of converted branches.
+        """
+        while True:
+            labels = dict(self.labels)
+            self.top_segment.clear()
+            self.branches = []
+            self._branch_count = 0
+            self.interpret_sequence(self.instructions)
+            branches, self.branches = self.branches, None
+            self.update_mirrored_segments()
+            self.top_segment.shrink_to_fit()
+            if self.labels != labels:
+                # forward references used old values, run again
+                continue
+            converted = False
+            for n, address, target, segment in branches:
+                if n in self.relaxed_branches:
+                    continue
+                distance = target - address - 2
+                if (-512 * 2 <= distance <= 511 * 2 and not distance & 1 and
+                        segment.start_address <= target < segment.end_address):
+                    self.relaxed_branches.add(n)
+                    converted = True
+            if not converted:
+                break
+        return len(self.relaxed_branches)
+
     def pass_two(self):
         """\
         Shortcut to run the 2nd pass of 3 stage linking.
@@ -537,6 +820,7 @@ class Linker(rpn.RPN):
         """
         self.top_segment.clear()
         self.check_labels = {}
+        self._branch_count = 0
         self.interpret_sequence(self.instructions)
         self.check_labels = None
         # create automatic labels for all segments (start/end)
@@ -555,13 +839,60 @@ class Linker(rpn.RPN):
         """
         self.errors_are_fatal = True
         self.top_segment.clear()
+        self.layout_symbols = []
+        self.layout_contributions = {}
+        self._layout_symbol = self._layout_start = None
+        self._branch_count = 0
         self.interpret_sequence(self.instructions)
+        self.close_layout_block()
         self.update_mirrored_segments()
         self.clear_local_symbols()
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
+def ends_with_transfer(words):
+    """\
+    Check if the last statement in the given words is an unconditional jump,
+    branch (MOV to PC) or return, so that execution can not continue after
+    it. The assembler writes opcodes as hexadecimal numbers, while operands
+    and data are decimal or expressions, so the last hexadecimal number marks
+    the start of the last instruction. Unknown cases return False.
+    """
+    tail = [word.lower() for word in words]
+    # skip trailing location information
+    while len(tail) > 1 and (tail[-1] == 'line' or tail[-2] == 'filename'):
+        del tail[-2:]
+    for position in range(len(tail) - 1, -1, -1):
+        if tail[position].startswith('0x'):
+            break
+    else:
+        return False
+    try:
+        opcode = int(tail[position], 16)
+    except ValueError:
+        return False
+    tail = tail[position + 1:]
+    if opcode & 0xfc00 == 0x3c00:
+        # JMP, the following words calculate the distance
+        return tail[-1:] == ['jmp']
+    if opcode == 0x4030 and tail[-1:] == ['branch']:
+        # BR #target, the following words calculate the target
+        return True
+    if opcode == 0x1300:
+        # RETI
+        return tail == ['16bit']
+    if opcode & 0xf0cf == 0x4000:
+        # MOV src, PC: BR, RET
+        source = (opcode >> 8) & 0x0f
+        mode = (opcode >> 4) & 3
+        if mode == 1 or (mode == 3 and source == 0):
+            # an extension word follows
+            return tail[:1] == ['16bit'] and tail[-1:] == ['16bit'] and tail.count('16bit') == 2
+        return tail == ['16bit']
+    return False
+
+
 def substitute_none(data):
     """Ensure that stream does not contain None"""
     for value in data:
@@ -627,7 +958,7 @@ Output is in "TI-Text" format.""")
 
     group.add_argument(
         'INPUT',
-        type=argparse.FileType('r'),
+        type=argparse.FileType('rb'),
         nargs='+',
         default=['-'])
 
@@ -643,6 +974,27 @@ Output is in "TI-Text" format.""")
         metavar='MCU',
         default='MSP430F1121')
 
+    group = parser.add_argument_group('Linking')
+
+    group.add_argument(
+        '--gc',
+        action='store_true',
+        default=False,
+        help='remove code blocks (labels in .text) that are not referenced from the interrupt vectors or other data')
+
+    group.add_argument(
+        '--relax',
+        action='store_true',
+        default=False,
+        help='replace branches (BR #label) by shorter jumps where the target is in range')
+
+    group.add_argument(
+        '--gc-keep',
+        action='append',
+        default=[],
+        help='do not remove this symbol (can be given multiple times)',
+        metavar='SYMBOL')
+
     group = parser.add_argument_group('Output')
 
     group.add_argument(
@@ -658,6 +1010,12 @@ Output is in "TI-Text" format.""")
         help='write map file',
         metavar='FILE')
 
+    group.add_argument(
+        '--layout',
+        type=argparse.FileType('w'),
+        help='write layout report (JSON) with symbol sizes, compare with "python -m msp430.asm.layout"',
+        metavar='FILE')
+
     parser.add_argument(
         '-v', '--verbose',
         action='count',
@@ -676,6 +1034,11 @@ Output is in "TI-Text" format.""")
         help='read register names for given architecture (e.g. F1xx)',
         metavar='NAME')
 
+    parser.add_argument(
+        '--device-db',
+        help='device database for --symbols (default: see msp430.asm.devicedb)',
+        metavar='FILE')
+
     args = parser.parse_args()
 
     #~ print(args)
@@ -691,36 +1054,30 @@ Output is in "TI-Text" format.""")
         # XXX make stderr unicode capable
         sys.stderr = codecs.getwriter("utf-8")(sys.stderr)
 
-    instructions = []
+    instructions = object_file.ObjectCode()
     for fileobj in args.INPUT:
         if args.verbose > 2:
             sys.stderr.write(u'reading file "{}"...\n'.format(fileobj.name))
-        instructions.append('reset')
-        instructions.extend(['filename', fileobj.name])
+        instructions.add_location(fileobj.name, None)
+        instructions.extend(['reset', 'filename', fileobj.name])
         try:
-            instructions.extend(rpn.words_in_file(fileobj.name, fileobj=fileobj))
+            instructions.append_object(object_file.load(fileobj, fileobj.name))
         except IOError as e:
             sys.stderr.write('ld: {}: File not found\n'.format(fileobj.name))
             sys.exit(1)
+        except object_file.ObjectFileError as e:
+            sys.stderr.write('ld: {}: {}\n'.format(fileobj.name, e))
+            sys.exit(1)
 
     linker = Linker(instructions)
 
     # load symbols
     if args.symbols is not None:
-        all_peripherals = peripherals.load_internal(args.symbols)
-        for peripheral in all_peripherals.peripherals.values():
-            for reg_name, register in peripheral.items():
-                if reg_name.startswith('__'):
-                    continue
-                if '__address__' in register:
-                    linker.labels[register['__name__']] = register['__address__']
-                for value, name in register['__bits__'].items():
-                    linker.labels[name] = value
-                for value, name in register['__values__'].items():
-                    linker.labels[name] = value
-            if '__values__' in peripheral:
-                for value, name in peripheral['__values__'].items():
-                    linker.labels[name] = value
+        try:
+            linker.labels.update(peripherals.load_database(args.symbols, args.device_db).labels())
+        except IOError as e:
+            sys.stderr.write('ld: {}\n'.format(e))
+            sys.exit(1)
 
     # ========= load MCU definition =========
 
@@ -729,12 +1086,13 @@ Output is in "TI-Text" format.""")
 
     # load the file and get the desired MCU description
     try:
+        args.mcu = args.mcu.upper()  # XXX hack
         if args.segmentfile:
             mem_maps = mcu_definition_parser.load_from_file(args.segmentfile)
+            segment_definitions = mcu_definition_parser.expand_definition(mem_maps, args.mcu)
         else:
-            mem_maps = mcu_definition_parser.load_internal()
-        args.mcu = args.mcu.upper()  # XXX hack
-        segment_definitions = mcu_definition_parser.expand_definition(mem_maps, args.mcu)
+            # prebuilt and cached
+            segment_definitions = mcu_definition_parser.load_internal_expanded(args.mcu)
     except Exception as msg:
         sys.stderr.write('ERROR loading segment descriptions: {}\n'.format(msg))
         raise
@@ -746,6 +1104,14 @@ Output is in "TI-Text" format.""")
         sys.stderr.write('Segments available:\n')
         linker.top_segment.print_tree(sys.stderr)
 
+    if args.gc:
+        removed = linker.garbage_collect(keep=args.gc_keep)
+        if args.verbose:
+            sys.stderr.write('Removed {} unreferenced symbol(s).\n'.format(len(removed)))
+        if args.verbose > 1:
+            for name in removed:
+                sys.stderr.write(u'    {}\n'.format(name))
+
     # ========= Do the actual linking =========
 
     try:
@@ -754,6 +1120,13 @@ Output is in "TI-Text" format.""")
             sys.stderr.write("        Pass 1: determinate segment sizes.\n")
         linker.pass_one()
 
+        if args.relax:
+            if args.verbose > 1:
+                sys.stderr.write("        Relaxation: replace branches by jumps.\n")
+            converted = linker.relax_branches()
+            if args.verbose:
+                sys.stderr.write('Relaxed {} branch(es) to jumps.\n'.format(converted))
+
         if args.verbose > 1:
             sys.stderr.write("        Pass 2: calculate labels.\n")
         linker.pass_two()
@@ -793,6 +1166,12 @@ Output is in "TI-Text" format.""")
             args.mapfile.write(u'0x{:04x} {}\n'.format(address, label))
         args.mapfile.close()
 
+    if args.layout:
+        import json
+        json.dump(linker.layout(), args.layout, indent=1, sort_keys=True)
+        args.layout.write('\n')
+        args.layout.close()
+
     if args.verbose:
         sys.stderr.write('Segments used:\n')
         linker.top_segment.sort_subsegments(by_address=True)
@@ -75,6 +75,7 @@ Example::
 """
 
 from . import rpn
+from . import cache
 import pkgutil
 
 
@@ -368,7 +369,10 @@ def parse_words(iterable):
     Parse a configuration file/text using the given iterable.
     """
     p = MCUDefintitions()
-    p.interpret(iterable)
+    if isinstance(iterable, rpn.Tokens):
+        p.interpret_sequence(iterable)
+    else:
+        p.interpret(iterable)
     return p.memory_maps
 
 
@@ -390,13 +394,37 @@ def expand_definition(memory_maps, name):
     return map
 
 
+def _load_internal_cached():
+    """\
+    Return a tuple (memory_maps, expanded_maps) for the internal definitions.
+    The parsed and expanded maps are cached on disk, the cache is invalidated
+    when the definition file or this module changes.
+    """
+    data = pkgutil.get_data('msp430.asm', 'definitions/msp430-mcu-list.txt')
+    key = cache.fingerprint(data, ('file', __file__.replace('.pyc', '.py')))
+    maps = cache.load('mcu-definitions.pickle', key)
+    if maps is None:
+        memory_maps = rpn.plain(parse_words(rpn.tokens_in_string(data.decode('utf-8'), name='msp430-mcu-list.txt')))
+        expanded_maps = dict((name, expand_definition(memory_maps, name)) for name in memory_maps)
+        maps = (memory_maps, expanded_maps)
+        cache.save('mcu-definitions.pickle', key, maps)
+    return maps
+
+
 def load_internal():
     """\
-    Load configuration file and only return a single, expanded memory map for
-    given mcu_name.
+    Load the internal configuration file and return all memory maps (not
+    expanded).
+    """
+    return _load_internal_cached()[0]
+
+
+def load_internal_expanded(mcu_name):
+    """\
+    Return the expanded memory map for the given MCU from the internal
+    configuration file. Raises KeyError if the MCU is not known.
     """
-    data = pkgutil.get_data('msp430.asm', 'definitions/msp430-mcu-list.txt').decode('utf-8')
-    return parse_words(rpn.words_in_string(data, name='msp430-mcu-list.txt'))
+    return _load_internal_cached()[1][mcu_name]
 
 
 def load_from_file(filename):
@@ -404,7 +432,7 @@ def load_from_file(filename):
     Load configuration file and only return a single, expanded memory map for
     given mcu_name.
     """
-    return parse_words(rpn.words_in_file(filename))
+    return parse_words(rpn.tokens_in_file(filename))
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
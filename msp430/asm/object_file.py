@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of https://github.com/zsquareplusc/python-msp430-tools
+# (C) 2026 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Read and write object files ('.o4') for the assembler and linker.
+
+Object files contain a sequence of words for the linker. There are two
+flavors that both load into an ObjectCode instance:
+
+- text: one statement per line, written by default and easy to debug with a
+  text editor.
+- binary: a string table, the words as indices into that table and a side
+  table with source locations. Locations are only looked up when an error is
+  reported, words are not annotated one by one.
+"""
+
+import bisect
+import struct
+from msp430.asm import rpn
+
+MAGIC = b'\x89O4B'
+VERSION = 1
+
+# header: version, index size, length of string table, number of words,
+# number of location entries
+HEADER = struct.Struct('<BBIII')
+
+
+class ObjectFileError(Exception):
+    """Raised when an object file can not be loaded"""
+
+
+class ObjectCode(object):
+    """\
+    A sequence of words (plain strings) for the linker along with a side table
+    that maps word positions to source locations.
+    """
+    def __init__(self):
+        self.words = []
+        self._location_index = []   # position of 1st word of each entry, sorted
+        self._locations = []        # (filename, lineno, text) per entry
+
+    def __len__(self):
+        return len(self.words)
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def add_location(self, filename, lineno, text=None):
+        """\
+        Set the source location for the words that are appended next. If text
+        is None, it is made up from the words when needed.
+        """
+        position = len(self.words)
+        if self._location_index and self._location_index[-1] == position:
+            self._locations[-1] = (filename, lineno, text)
+        else:
+            self._location_index.append(position)
+            self._locations.append((filename, lineno, text))
+
+    def extend(self, words):
+        """Append words (without changing the location)."""
+        self.words.extend(words)
+
+    def append_object(self, other):
+        """Append the words and locations of an other ObjectCode instance."""
+        offset = len(self.words)
+        self.words.extend(other.words)
+        for position, location in zip(other._location_index, other._locations):
+            if self._location_index and self._location_index[-1] == position + offset:
+                self._locations[-1] = location
+            else:
+                self._location_index.append(position + offset)
+                self._locations.append(location)
+
+    def slice(self, start, end):
+        """Return a new ObjectCode instance with the words from start to end and their locations."""
+        code = ObjectCode()
+        code.words = self.words[start:end]
+        entry = max(0, bisect.bisect_right(self._location_index, start) - 1)
+        while entry < len(self._location_index) and self._location_index[entry] < end:
+            code._location_index.append(max(0, self._location_index[entry] - start))
+            code._locations.append(self._locations[entry])
+            entry += 1
+        return code
+
+    def location(self, position):
+        """\
+        Return the tuple (filename, lineno, text) for the word at given
+        position. All elements are None if no location is known.
+        """
+        entry = bisect.bisect_right(self._location_index, position) - 1
+        if entry < 0:
+            return (None, None, None)
+        filename, lineno, text = self._locations[entry]
+        if text is None:
+            if entry + 1 < len(self._location_index):
+                end = self._location_index[entry + 1]
+            else:
+                end = len(self.words)
+            text = u' '.join(self.words[self._location_index[entry]:end])
+        return (filename, lineno, text)
+
+    def annotated_words(self):
+        """Yield rpn.Word objects, annotated with the location from the side table."""
+        for position, word in enumerate(self.words):
+            filename, lineno, text = self.location(position)
+            yield rpn.Word(word, filename, lineno, text)
+
+    def to_bytes(self):
+        """Return the binary representation."""
+        strings = {}
+        for word in self.words:
+            strings.setdefault(word, len(strings))
+        for filename, lineno, text in self._locations:
+            strings.setdefault(filename or u'', len(strings))
+        table = sorted(strings, key=strings.get)
+        blob = u'\n'.join(table).encode('utf-8')
+        index_format = 'H' if len(table) <= 0x10000 else 'I'
+        locations = []
+        for position, (filename, lineno, text) in zip(self._location_index, self._locations):
+            locations.extend((position, strings[filename or u''], lineno or 0))
+        return b''.join([
+            MAGIC,
+            HEADER.pack(VERSION, struct.calcsize(index_format), len(blob), len(self.words), len(self._locations)),
+            blob,
+            struct.pack('<{}{}'.format(len(self.words), index_format), *[strings[word] for word in self.words]),
+            struct.pack('<{}I'.format(len(locations)), *locations),
+        ])
+
+
+def from_bytes(data):
+    """Decode the binary representation, return an ObjectCode instance."""
+    if not data.startswith(MAGIC):
+        raise ObjectFileError('not a binary object file')
+    try:
+        offset = len(MAGIC)
+        version, index_size, blob_size, n_words, n_locations = HEADER.unpack_from(data, offset)
+        if version != VERSION:
+            raise ObjectFileError('unsupported object file version: {}'.format(version))
+        offset += HEADER.size
+        table = data[offset:offset + blob_size].decode('utf-8').split(u'\n')
+        offset += blob_size
+        index_format = {2: 'H', 4: 'I'}[index_size]
+        indices = struct.unpack_from('<{}{}'.format(n_words, index_format), data, offset)
+        offset += n_words * index_size
+        locations = struct.unpack_from('<{}I'.format(3 * n_locations), data, offset)
+        code = ObjectCode()
+        code.words = [table[index] for index in indices]
+        code._location_index = list(locations[0::3])
+        code._locations = [(table[name] or None, lineno or None, None)
+                           for name, lineno in zip(locations[1::3], locations[2::3])]
+    except (struct.error, KeyError, IndexError, UnicodeError) as e:
+        raise ObjectFileError('corrupt object file ({})'.format(e))
+    return code
+
+
+def from_text(data, filename, source_locations=False):
+    """\
+    Parse an object file in text format, return an ObjectCode instance.
+
+    The locations point to the lines of the object file itself. When
+    source_locations is true, the ``FILENAME`` and ``LINE`` statements are
+    used instead, so that locations point to the original source. The
+    ``LINE`` statements are removed from the words in this case, the linker
+    takes the line number from the side table.
+    """
+    code = ObjectCode()
+    source_filename = filename
+    source_lineno = None
+    for lineno, line in enumerate(data.splitlines(True), 1):
+        words = rpn.m_comment.sub('', line).split()
+        if source_locations:
+            if len(words) > 1 and words[1] == 'LINE':
+                source_lineno = int(words[0])
+                del words[:2]
+            elif len(words) > 1 and words[0] == 'FILENAME':
+                source_filename = words[1]
+        if not words:
+            continue
+        if source_locations:
+            code.add_location(source_filename, source_lineno)
+        else:
+            code.add_location(filename, lineno, line)
+        code.extend(words)
+    return code
+
+
+def load(fileobj, filename):
+    """\
+    Read an object file, text or binary format is detected automatically.
+    Return an ObjectCode instance.
+    """
+    data = fileobj.read()
+    if isinstance(data, bytes):
+        if data.startswith(MAGIC):
+            return from_bytes(data)
+        data = data.decode('utf-8')
+    return from_text(data, filename)
+
+
+class BinaryObjectWriter(object):
+    """\
+    File like object that collects the text output of the assembler and
+    writes it as binary object file when saved.
+    """
+    def __init__(self):
+        self._parts = []
+
+    def write(self, text):
+        self._parts.append(text)
+
+    def object_code(self):
+        """Return the ObjectCode instance for the text written so far."""
+        return from_text(u''.join(self._parts), None, source_locations=True)
+
+    def save(self, fileobj):
+        """Write the binary object file to given (binary) file object."""
+        fileobj.write(self.object_code().to_bytes())
@@ -43,7 +43,9 @@ WORD-ACCESS <name>
 """
 
 from msp430.asm import rpn
+from msp430.asm import cache
 import pkgutil
+import re
 
 
 class SymbolError(Exception):
@@ -73,7 +75,7 @@ class SymbolDefinitions(rpn.RPN):
             # XXX currently only internal imports are supported
             long_name = 'definitions/{}.peripheral'.format(name)
             data = pkgutil.get_data('msp430.asm', long_name).decode('utf-8')
-            self.interpret(rpn.words_in_string(data, name=long_name))
+            self.interpret_sequence(rpn.tokens_in_string(data, name=long_name))
 
     @rpn.word('BIT')
     def word_BIT(self, stack):
@@ -202,7 +204,10 @@ def parse_words(iterable):
     Parse a configuration file/text using the given iterable.
     """
     s = SymbolDefinitions()
-    s.interpret(iterable)
+    if isinstance(iterable, rpn.Tokens):
+        s.interpret_sequence(iterable)
+    else:
+        s.interpret(iterable)
     return s
 
 
@@ -210,15 +215,171 @@ def load_symbols(filename):
     """\
     Load symbols from given filename.
     """
-    return parse_words(rpn.words_in_file(filename))
+    return parse_words(rpn.tokens_in_file(filename))
 
 
 def load_internal(name):
     """\
     Load symbols from internal definition given name.
     """
-    data = pkgutil.get_data('msp430.asm', 'definitions/{}.peripheral'.format(name)).decode('utf-8')
-    return parse_words(rpn.words_in_string(data))
+    long_name = 'definitions/{}.peripheral'.format(name)
+    data = pkgutil.get_data('msp430.asm', long_name).decode('utf-8')
+    return parse_words(rpn.tokens_in_string(data, name=long_name))
+
+
+def symbol_labels(symbols):
+    """\
+    Return a dictionary with all names (registers, bits, values) and their
+    values, as used by the linker.
+    """
+    labels = {}
+    for peripheral in symbols.peripherals.values():
+        for reg_name, register in peripheral.items():
+            if reg_name.startswith('__'):
+                continue
+            if '__address__' in register:
+                labels[register['__name__']] = register['__address__']
+            for value, name in register['__bits__'].items():
+                labels[name] = value
+            for value, name in register['__values__'].items():
+                labels[name] = value
+        if '__values__' in peripheral:
+            for value, name in peripheral['__values__'].items():
+                labels[name] = value
+    return labels
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+m_include = re.compile(r'^\s*INCLUDE\s+(\S+)', re.MULTILINE | re.IGNORECASE)
+
+
+class SymbolDatabase(object):
+    """\
+    Indexed symbols of an internal definition (device). The index (register
+    names and addresses) is loaded from the disk cache, the bits and values of
+    a peripheral are loaded when one of its registers is looked up. The
+    definition is only parsed if the cache is missing or outdated.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._key = self._source_key()
+        self._peripherals = {}      # peripheral name -> dict, loaded ones only
+        self._labels = None
+        self.index = cache.load(self._cache_name('index'), self._key)
+        if self.index is None:
+            self._build()
+
+    def _cache_name(self, part):
+        return 'peripherals-{}-{}.pickle'.format(self.name, part)
+
+    def _source_key(self):
+        """Fingerprint of the definition file, the files it includes and this module"""
+        items = [('file', __file__.replace('.pyc', '.py'))]
+        todo = [self.name]
+        seen = set()
+        while todo:
+            name = todo.pop(0)
+            if name in seen:
+                continue
+            seen.add(name)
+            try:
+                data = pkgutil.get_data('msp430.asm', 'definitions/{}.peripheral'.format(name))
+            except IOError:
+                # the scan is textual, the parser reports real errors
+                continue
+            items.append(data)
+            todo.extend(m_include.findall(data.decode('utf-8')))
+        return cache.fingerprint(*items)
+
+    def _build(self):
+        """Parse the definition and store the index and the peripherals in the cache"""
+        symbols = load_internal(self.name)
+        self.index = {
+            'peripherals': list(symbols.peripherals),
+            # register name -> peripheral name
+            'registers': {},
+            # address -> register name
+            'addresses': {},
+        }
+        for peripheral_name, peripheral in symbols.peripherals.items():
+            for reg_name, register in peripheral.items():
+                if not reg_name.startswith('__'):
+                    self.index['registers'][reg_name] = peripheral_name
+        for address, register in symbols.registers_by_address.items():
+            if address is not None:
+                self.index['addresses'][address] = register['__name__']
+        self.index = rpn.plain(self.index)
+        self._labels = rpn.plain(symbol_labels(symbols))
+        for peripheral_name, peripheral in symbols.peripherals.items():
+            self._peripherals[peripheral_name] = rpn.plain(peripheral)
+            cache.save(self._cache_name('p-' + peripheral_name), self._key, self._peripherals[peripheral_name])
+        cache.save(self._cache_name('labels'), self._key, self._labels)
+        cache.save(self._cache_name('index'), self._key, self.index)
+
+    def peripheral(self, name):
+        """Return the dictionary of a peripheral (registers and values)"""
+        try:
+            return self._peripherals[name]
+        except KeyError:
+            pass
+        peripheral = cache.load(self._cache_name('p-' + name), self._key)
+        if peripheral is None:
+            self._build()   # cache was removed in the meantime
+            return self._peripherals[name]
+        self._peripherals[name] = peripheral
+        return peripheral
+
+    def register_name_at(self, address):
+        """Return the name of the register at the given address or None"""
+        return self.index['addresses'].get(address)
+
+    def register(self, name):
+        """Return the register dictionary (with '__bits__' and '__values__') or None"""
+        peripheral_name = self.index['registers'].get(name)
+        if peripheral_name is None:
+            return None
+        return self.peripheral(peripheral_name)[name]
+
+    def register_at(self, address):
+        """Return the register dictionary for an address or None"""
+        name = self.register_name_at(address)
+        return self.register(name) if name is not None else None
+
+    def bits(self, name):
+        """Return a dictionary bit mask -> bit name for a register (empty if unknown)"""
+        register = self.register(name)
+        return register['__bits__'] if register is not None else {}
+
+    def labels(self):
+        """Return all names and values, see symbol_labels()"""
+        if self._labels is None:
+            self._labels = cache.load(self._cache_name('labels'), self._key)
+            if self._labels is None:
+                self._build()
+        return self._labels
+
+
+def load_database(name, device_database=None):
+    """\
+    Return a SymbolDatabase for an internal definition. If there is no such
+    definition, the device is looked up in the compiled device database (see
+    msp430.asm.devicedb), the given file or the default locations. Raises
+    IOError if the device is not found or the database can not be read.
+    """
+    try:
+        return SymbolDatabase(name)
+    except IOError as e:
+        error = e
+    from msp430.asm import devicedb
+    try:
+        return devicedb.load_device(name, device_database)
+    except KeyError:
+        pass
+    except devicedb.DeviceDatabaseError as e:
+        raise IOError(str(e))
+    raise error
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -12,7 +12,7 @@ Simple, extensible RPN calculator.
 from __future__ import division
 
 import sys
-import pprint
+import array
 import codecs
 import re
 import logging
@@ -45,6 +45,10 @@ class Word(unicode):
     def lower(self):
         return Word(unicode.lower(self), self.filename, self.lineno, self.text)
 
+    def __getnewargs__(self):
+        # support pickle, keeping the annotations
+        return (unicode(self), self.filename, self.lineno, self.text)
+
     #~ def __repr__(self):
         #~ return "%s(%s, %s, %s)" % (
                 #~ self.__class__.__name__,
@@ -53,6 +57,20 @@ class Word(unicode):
                 #~ self.lineno)
 
 
+def plain(obj):
+    """\
+    Return a copy of parsed data (nested dicts and lists) where annotated
+    words are replaced by plain strings, e.g. so that it can be pickled.
+    """
+    if isinstance(obj, dict):
+        return dict((plain(key), plain(value)) for key, value in obj.items())
+    elif isinstance(obj, list):
+        return [plain(x) for x in obj]
+    elif isinstance(obj, Word):
+        return unicode(obj)
+    return obj
+
+
 def annotated_words(sequence, filename=None, lineno=None, offset=None, text=None):
     """Wrap words and annotate them with given filename etc."""
     for word in sequence:
@@ -88,6 +106,97 @@ def words_in_file(filename, fileobj=None, include_newline=False):
             yield Word('\n', filename, n, line)
 
 
+def _split_lines(data):
+    """\
+    Split text in lines. Unlike splitlines(), only '\\n' ends a line (not e.g.
+    form feeds), so that the line numbers are the same as in editors.
+    """
+    lines = data.split('\n')
+    if lines[-1] == '':
+        lines.pop()     # text ends with a newline
+    return lines
+
+
+class Tokens(object):
+    """\
+    Words of one or more texts as plain strings. The position of each word is
+    kept in a compact side table (source id, line, column) and it is only
+    resolved to a filename and the line of text when needed, e.g. for error
+    messages.
+    """
+
+    def __init__(self):
+        self.words = []
+        self.positions = array.array('I')   # source id, line, column per word
+        self._names = []
+        self._sources = []
+        self._lines = {}
+
+    def __len__(self):
+        return len(self.words)
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def add_string(self, data, name='<string>', include_newline=False):
+        """Split a string in words, with comments removed."""
+        source_id = len(self._names)
+        self._names.append(name)
+        self._sources.append(data)
+        words = self.words
+        positions = self.positions
+        for lineno, line in enumerate(_split_lines(data), 1):
+            if '#' in line:
+                line = line[:line.index('#')]     # same as m_comment
+            column = 0
+            for word in line.split():
+                column = line.index(word, column)
+                words.append(word)
+                positions.extend((source_id, lineno, column + 1))
+                column += len(word)
+            if include_newline:
+                words.append('\n')
+                positions.extend((source_id, lineno, len(line) + 1))
+
+    def add_file(self, filename, fileobj=None, include_newline=False):
+        """Split the contents of a file in words, with comments removed."""
+        if fileobj is None:
+            with codecs.open(filename, 'r', 'utf-8') as fileobj:
+                data = fileobj.read()
+        else:
+            data = fileobj.read()
+        self.add_string(data, filename, include_newline)
+
+    def location(self, position):
+        """\
+        Return a tuple (filename, lineno, column, text) for the word at the
+        given position.
+        """
+        source_id, lineno, column = self.positions[3 * position:3 * position + 3]
+        lines = self._lines.get(source_id)
+        if lines is None:
+            lines = self._lines[source_id] = _split_lines(self._sources[source_id])
+        return self._names[source_id], lineno, column, lines[lineno - 1].rstrip('\r')
+
+
+def tokens_in_string(data, name='<string>', include_newline=False):
+    """\
+    Return the words of a string as Tokens, with comments removed.
+    """
+    tokens = Tokens()
+    tokens.add_string(data, name, include_newline)
+    return tokens
+
+
+def tokens_in_file(filename, fileobj=None, include_newline=False):
+    """\
+    Return the words of a file as Tokens, with comments removed.
+    """
+    tokens = Tokens()
+    tokens.add_file(filename, fileobj, include_newline)
+    return tokens
+
+
 class RPNError(Exception):
     """interpreter error"""
     def __init__(self, message, filename=None, lineno=None, column=None, offset=None, text=None):
@@ -143,13 +252,27 @@ class RPNBase(list):
                 self.builtins[function.rpn_name] = function
 
     def interpret_sequence(self, sequence, filename=None):
-        """interpret a sequence of words"""
-        self.interpret(annotated_words(sequence, filename))
+        """\
+        Interpret a sequence of words. The words of a Tokens instance are plain
+        strings, their location is looked up in the side table when an error
+        occurs.
+        """
+        if not isinstance(sequence, Tokens):
+            return self.interpret(annotated_words(sequence, filename))
+        iterator = iter(sequence.words)
+        count = len(sequence.words)
+
+        def location():
+            # position of the word that was read last
+            return sequence.location(max(0, count - iterator.__length_hint__() - 1))
+        self.interpret(iterator, location)
 
-    def interpret(self, iterator):
+    def interpret(self, iterator, location=None):
         """\
         Interpret a sequence of words given a 'next' function that get the
-        next word from the sequence.
+        next word from the sequence. location is an optional function that
+        returns (filename, lineno, column, text) of the current word, it is
+        used for errors in words that are not annotated.
         """
         # keep old reference in case of nested calls
         old_iterator = self._iterator
@@ -162,14 +285,20 @@ class RPNBase(list):
                 self.interpret_word(word)
         except StopIteration:
             pass
-        except RPNError:
+        except RPNError as e:
+            if e.lineno is None and location is not None:
+                e.filename, e.lineno, e.column, e.text = location()
             raise
         except Exception as e:
-            filename = getattr(word, 'filename', '<unknown>')
-            lineno = getattr(word, 'lineno', None)
-            column = getattr(word, 'column', None)
-            offset = getattr(word, 'offset', None)
-            text = getattr(word, 'text', None)
+            if location is not None and not isinstance(word, Word):
+                filename, lineno, column, text = location()
+                offset = None
+            else:
+                filename = getattr(word, 'filename', '<unknown>')
+                lineno = getattr(word, 'lineno', None)
+                column = getattr(word, 'column', None)
+                offset = getattr(word, 'offset', None)
+                text = getattr(word, 'text', None)
             logging.getLogger('rpn').exception('{}:{}: Error in word "{}": {}'.format(filename, lineno, word, e))
             raise RPNError('Error in word "{}": {}'.format(word, e), filename, lineno, column, offset, text)
             # XXX consider showing the full traceback of the original exception
@@ -239,6 +368,7 @@ class RPNBase(list):
     # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
     def prettyprint(self, stack):
+        import pprint
         pprint.pprint(self.pop())
 
     def __str__(self):
@@ -436,6 +566,7 @@ class RPNLogicOps(object):
     def word_LIST(self, stack):
         """testing only: print all knwon words to stdout"""
         for namespace in (self.namespace, self.builtins):
+            import pprint
             pprint.pprint(namespace)
 
 
@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of https://github.com/zsquareplusc/python-msp430-tools
+# (C) 2026 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Static worst case stack usage and cycle count analysis.
+
+The analysis works on the call graph found by msp430.asm.flow. For each
+function (call target or vector), the deepest stack and the longest path in
+cycles is calculated, including the called functions. The cycle counts are
+based on the (approximate) values from the disassembler.
+
+Some things can not be analyzed statically, they are reported as notes:
+
+- loops: the cycle count is unbounded (the number of iterations is not
+  known)
+- recursion: stack and cycles are unbounded
+- indirect calls and branches: the targets are unknown, the result only
+  covers the known code
+- unknown modifications of SP: the stack usage is unknown
+"""
+
+import re
+import msp430.asm.flow
+
+# the CPU pushes PC and SR when accepting an interrupt
+INTERRUPT_STACK = 4
+# cycles from the interrupt request to the first instruction of the ISR
+INTERRUPT_LATENCY = 6
+
+# notes
+NOTE_LOOP = 'loop'
+NOTE_RECURSION = 'recursion'
+NOTE_INDIRECT_CALL = 'indirect call'
+NOTE_INDIRECT_BRANCH = 'indirect branch'
+NOTE_UNKNOWN_SP = 'unknown SP modification'
+NOTE_INVALID = 'invalid code'
+
+# notes that make the values incomplete (not covering all of the code), even
+# if they are not unbounded
+UNVERIFIED_NOTES = frozenset([NOTE_INDIRECT_CALL, NOTE_INDIRECT_BRANCH, NOTE_UNKNOWN_SP, NOTE_INVALID])
+
+# stack_effect() result for instructions that set SP to a new value
+STACK_RESET = 'reset'
+
+re_immediate = re.compile(r'^#(-?(0x)?[0-9a-fA-F]+)$')
+
+
+def immediate(operand):
+    """Return the value of an immediate operand or None."""
+    if operand is not None:
+        m = re_immediate.match(operand)
+        if m:
+            return int(m.group(1), 0)
+    return None
+
+
+def stack_effect(insn):
+    """\
+    Return by how many bytes the stack grows by executing the instruction,
+    STACK_RESET if SP is loaded with a new value or None if the effect is
+    unknown. The return address pushed by calls is not included.
+    """
+    name = insn.name
+    wide = insn.address_mode == '.a' or name.endswith('.a')
+    if name in ('push', 'pushx'):
+        return 4 if wide else 2
+    elif name in ('pop', 'popx'):
+        return -4 if wide else -2
+    elif name in ('pushm.a', 'pushm.w'):
+        return (4 if wide else 2) * immediate(insn.src)
+    elif name in ('pop.a', 'pop.w'):   # popm
+        return -(4 if wide else 2) * immediate(insn.src)
+    if insn.dst != 'SP' or name.startswith(('cmp', 'tst', 'bit')):
+        return 0
+    # instructions that modify SP
+    if name in ('decd', 'decdx', 'decda'):
+        return 2
+    elif name in ('incd', 'incdx', 'incda'):
+        return -2
+    value = immediate(insn.src)
+    if value is not None:
+        if name in ('sub', 'subx', 'suba'):
+            return value
+        elif name in ('add', 'addx', 'adda'):
+            return -value
+        elif name in ('mov', 'movx', 'mova'):
+            return STACK_RESET
+    return None
+
+
+class FunctionResult(object):
+    """Worst case values of one function, None means unbounded or unknown."""
+    def __init__(self, address, name):
+        self.address = address
+        self.name = name
+        self.stack = 0
+        self.cycles = 0
+        self.calls = set()
+        self.notes = set()
+
+    def to_json(self):
+        return {
+            'address': self.address,
+            'name': self.name,
+            'stack': self.stack,
+            'cycles': self.cycles,
+            'calls': sorted(self.calls),
+            'notes': sorted(self.notes),
+        }
+
+
+class WorstCaseAnalyzer(object):
+    """\
+    Calculate worst case stack usage and cycle counts for all functions of a
+    ControlFlowGraph (after build() was called).
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        self.results = {}       # address -> FunctionResult
+        self._active = set()    # functions currently analyzed (recursion detection)
+
+    def name(self, address):
+        if address in self.graph.entries:
+            return self.graph.entries[address]
+        return 'func_0x{:04x}'.format(address)
+
+    def analyze(self):
+        """Analyze all functions. Returns self."""
+        for address in sorted(self.graph.functions):
+            self.function(address)
+        return self
+
+    def function(self, address):
+        """Return the FunctionResult for the function at given address."""
+        if address in self.results:
+            return self.results[address]
+        result = FunctionResult(address, self.name(address))
+        if address in self._active:
+            # recursion, the result is not stored
+            result.stack = result.cycles = None
+            result.notes.add(NOTE_RECURSION)
+            return result
+        self._active.add(address)
+        try:
+            blocks = self._function_blocks(address, result)
+            result.stack = self._stack(address, blocks, result)
+            result.cycles = self._cycles(address, blocks, result)
+        finally:
+            self._active.remove(address)
+        self.results[address] = result
+        return result
+
+    def _function_blocks(self, address, result):
+        """Return the set of block addresses that belong to the function."""
+        blocks = set()
+        todo = [address]
+        while todo:
+            block_address = todo.pop()
+            if block_address in blocks:
+                continue
+            block = self.graph.blocks.get(block_address)
+            if block is None or not block.instructions:
+                result.notes.add(NOTE_INVALID)
+                continue
+            blocks.add(block_address)
+            if block.exit == msp430.asm.flow.EXIT_INDIRECT:
+                result.notes.add(NOTE_INDIRECT_BRANCH)
+            elif block.exit == msp430.asm.flow.EXIT_INVALID:
+                result.notes.add(NOTE_INVALID)
+            todo.extend(block.successors)
+        return blocks
+
+    def _callee(self, insn, result):
+        """Return the FunctionResult of the function called by insn, None for indirect calls."""
+        kind, target = msp430.asm.flow.classify(insn)
+        if kind == 'indirect-call':
+            result.notes.add(NOTE_INDIRECT_CALL)
+            return None
+        result.calls.add(target)
+        callee = self.function(target)
+        result.notes.update(callee.notes)
+        return callee
+
+    def _walk_stack(self, block, depth, result):
+        """Return (peak, depth at end) for a block, entered with given depth. None if unknown."""
+        peak = depth
+        for insn in block.instructions:
+            kind, target = msp430.asm.flow.classify(insn)
+            if kind in ('call', 'indirect-call'):
+                return_address = 4 if insn.name == 'calla' else 2
+                callee = self._callee(insn, result)
+                if callee is not None:
+                    if callee.stack is None:
+                        return None, None
+                    peak = max(peak, depth + return_address + callee.stack)
+                else:
+                    peak = max(peak, depth + return_address)
+                continue
+            effect = stack_effect(insn)
+            if effect is None:
+                result.notes.add(NOTE_UNKNOWN_SP)
+                return None, None
+            elif effect == STACK_RESET:
+                depth = 0
+            else:
+                depth += effect
+            peak = max(peak, depth)
+        return peak, depth
+
+    def _stack(self, address, blocks, result):
+        """\
+        Worst case stack depth in bytes, relative to SP at the function entry.
+        The stack depth at the start of each block is the maximum of all
+        paths to it. If it keeps growing, a loop is pushing data.
+        """
+        entry_depth = {address: 0}
+        updates = dict.fromkeys(blocks, 0)
+        peak = 0
+        todo = [address]
+        while todo:
+            block_address = todo.pop()
+            block = self.graph.blocks[block_address]
+            block_peak, depth = self._walk_stack(block, entry_depth[block_address], result)
+            if block_peak is None:
+                return None
+            peak = max(peak, block_peak)
+            for successor in block.successors:
+                if successor not in blocks:
+                    continue
+                if successor not in entry_depth or entry_depth[successor] < depth:
+                    entry_depth[successor] = depth
+                    updates[successor] += 1
+                    if updates[successor] > len(blocks):
+                        result.notes.add(NOTE_LOOP)
+                        return None
+                    todo.append(successor)
+        return peak
+
+    def _block_cycles(self, block, result):
+        """Cycles of a block, including the called functions. None if unbounded."""
+        cycles = 0
+        for insn in block.instructions:
+            cycles += insn.cycles
+            kind, target = msp430.asm.flow.classify(insn)
+            if kind in ('call', 'indirect-call'):
+                callee = self._callee(insn, result)
+                if callee is not None:
+                    if callee.cycles is None:
+                        return None
+                    cycles += callee.cycles
+        return cycles
+
+    def _cycles(self, address, blocks, result):
+        """Longest path through the function in cycles. None if there are loops."""
+        # depth first search for a topological order, back edges are loops
+        order = []
+        state = {}      # 1: on the stack, 2: done
+        stack = [(address, iter(self.graph.blocks[address].successors))]
+        state[address] = 1
+        while stack:
+            block_address, successors = stack[-1]
+            for successor in successors:
+                if successor not in blocks:
+                    continue
+                if state.get(successor) == 1:
+                    result.notes.add(NOTE_LOOP)
+                    return None
+                if successor not in state:
+                    state[successor] = 1
+                    stack.append((successor, iter(self.graph.blocks[successor].successors)))
+                    break
+            else:
+                stack.pop()
+                state[block_address] = 2
+                order.append(block_address)
+        # successors come first in order
+        longest = {}
+        for block_address in order:
+            block = self.graph.blocks[block_address]
+            cycles = self._block_cycles(block, result)
+            if cycles is None:
+                return None
+            following = [longest[s] for s in block.successors if s in longest]
+            longest[block_address] = cycles + max(following or [0])
+        return longest[address]
+
+    def vectors(self):
+        """\
+        Return a list of FunctionResult for the interrupt handlers, the values
+        include the stack frame and latency of the interrupt.
+        """
+        vectors = []
+        for address, name in sorted(self.graph.entries.items()):
+            if name.startswith('vector_'):
+                function = self.function(address)
+                result = FunctionResult(address, name)
+                result.calls = function.calls
+                result.notes = function.notes
+                if function.stack is not None:
+                    result.stack = INTERRUPT_STACK + function.stack
+                else:
+                    result.stack = None
+                if function.cycles is not None:
+                    result.cycles = INTERRUPT_LATENCY + function.cycles
+                else:
+                    result.cycles = None
+                vectors.append(result)
+        return vectors
+
+    def main_functions(self):
+        """Return a list of FunctionResult for the code reached from reset."""
+        return [self.function(address) for address, name in self.graph.entries.items() if name == 'reset']
+
+    def total_stack(self):
+        """\
+        Worst case stack usage of the application: the functions that are
+        reached from reset plus the largest interrupt handler (interrupts are
+        assumed not to be nested). None if unknown.
+        """
+        stacks = [function.stack for function in self.main_functions()]
+        interrupts = [vector.stack for vector in self.vectors()]
+        if None in stacks or None in interrupts:
+            return None
+        return max(stacks or [0]) + max(interrupts or [0])
+
+
+def format_value(value):
+    return 'unbounded' if value is None else str(value)
+
+
+def write_report(output, analyzer):
+    """Write a table with the results."""
+    output.write('{:<20} {:>10} {:>10} {:>10}  {}\n'.format('Function', 'Address', 'Stack', 'Cycles', 'Notes'))
+    for address in sorted(analyzer.results):
+        result = analyzer.results[address]
+        output.write('{:<20} {:>#10x} {:>10} {:>10}  {}\n'.format(
+            result.name, address,
+            format_value(result.stack), format_value(result.cycles),
+            ', '.join(sorted(result.notes))))
+    vectors = analyzer.vectors()
+    if vectors:
+        output.write('\nInterrupts (including entry and stack frame):\n')
+        for result in vectors:
+            output.write('{:<20} {:>#10x} {:>10} {:>10}  {}\n'.format(
+                result.name, result.address,
+                format_value(result.stack), format_value(result.cycles),
+                ', '.join(sorted(result.notes))))
+    total = analyzer.total_stack()
+    output.write('\nWorst case stack usage: {}\n'.format('unbounded' if total is None else '{} bytes'.format(total)))
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def main():
+    import sys
+    import json
+    import msp430.commandline_helper
+
+    class WorstCaseTool(msp430.commandline_helper.CommandLineTool):
+        description = """\
+Static analysis of the worst case stack usage and cycle counts of functions
+and interrupt handlers.
+
+The exit code is 1 if a budget given with --max-stack or --max-cycles is
+exceeded or can not be verified (e.g. recursion, loops, indirect calls).
+"""
+
+        def configure_parser(self):
+            self.parser_add_input(nargs=1)
+            self.parser_add_output(textual=True)
+
+            self.parser.add_argument(
+                '-x', '--msp430x',
+                action='store_true',
+                default=False,
+                help='Enable MSP430X instruction set')
+
+            self.parser.add_argument(
+                '--entry',
+                action='append',
+                default=[],
+                type=lambda x: int(x, 0),
+                metavar='ADDRESS',
+                help='additional function address (can be given multiple times)')
+
+            self.parser.add_argument(
+                '--vectors',
+                type=lambda x: int(x, 0),
+                default=msp430.asm.flow.VECTORS_START,
+                metavar='START',
+                help='start address of the interrupt vector table (default: 0xffe0)')
+
+            self.parser.add_argument(
+                '--mcu',
+                metavar='MCU',
+                help='take the interrupt vector table from the definition of given MCU')
+
+            self.parser.add_argument(
+                '--max-stack',
+                type=int,
+                metavar='BYTES',
+                help='fail if the total worst case stack usage is larger')
+
+            self.parser.add_argument(
+                '--max-cycles',
+                type=int,
+                metavar='CYCLES',
+                help='fail if an interrupt handler can take longer')
+
+            self.parser.add_argument(
+                '--allow-unbounded',
+                action='store_true',
+                default=False,
+                help='accept indirect calls/branches, unknown SP modifications and invalid code '
+                     'for the budgets (only the known code is checked)')
+
+            self.parser.add_argument(
+                '--json',
+                action='store_true',
+                default=False,
+                help='write the results as JSON')
+
+        def run(self, args):
+            if args.mcu is not None:
+                try:
+                    vectors = msp430.asm.flow.vector_table(args.mcu)
+                except KeyError:
+                    self.parser.error('no vector table known for MCU: {}'.format(args.mcu))
+            else:
+                vectors = (args.vectors, msp430.asm.flow.VECTORS_END)
+            fileobj = args.SRC[0]
+            mem = msp430.memory.load(fileobj.name, fileobj, args.input_format)
+            graph = msp430.asm.flow.ControlFlowGraph(mem, msp430x=args.msp430x)
+            graph.add_vectors(*vectors)
+            for address in args.entry:
+                graph.add_entry(address)
+            graph.build()
+            analyzer = WorstCaseAnalyzer(graph).analyze()
+
+            if args.json:
+                json.dump({
+                    'functions': [analyzer.results[address].to_json() for address in sorted(analyzer.results)],
+                    'vectors': [result.to_json() for result in analyzer.vectors()],
+                    'stack': analyzer.total_stack(),
+                }, args.output, indent=2, sort_keys=True)
+                args.output.write('\n')
+            else:
+                write_report(args.output, analyzer)
+
+            errors = []
+            # indirect calls etc. leave parts of the code out of the values,
+            # so that they are no proof that the budget is met
+            checked = []
+            if args.max_stack is not None:
+                checked.extend(analyzer.main_functions())
+            if args.max_stack is not None or args.max_cycles is not None:
+                checked.extend(analyzer.vectors())
+            if not args.allow_unbounded:
+                for result in checked:
+                    for note in sorted(result.notes & UNVERIFIED_NOTES):
+                        errors.append('{}: {}, budget can not be verified (see --allow-unbounded)'.format(
+                            result.name, note))
+            if args.max_stack is not None:
+                total = analyzer.total_stack()
+                if total is None or total > args.max_stack:
+                    errors.append('stack usage {} exceeds budget of {} bytes'.format(
+                        format_value(total), args.max_stack))
+            if args.max_cycles is not None:
+                for result in analyzer.vectors():
+                    if result.cycles is None or result.cycles > args.max_cycles:
+                        errors.append('{} takes {} cycles, budget is {}'.format(
+                            result.name, format_value(result.cycles), args.max_cycles))
+            if errors:
+                for message in errors:
+                    sys.stderr.write('worst_case: {}\n'.format(message))
+                sys.exit(1)
+
+    WorstCaseTool().main()
+
+
+if __name__ == '__main__':
+    main()
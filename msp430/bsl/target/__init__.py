@@ -11,7 +11,6 @@ Simple MSP430 BSL implementation using the serial port.
 
 import sys
 from msp430.bsl import bsl
-import serial
 import struct
 import logging
 import time
@@ -65,6 +64,7 @@ class SerialBSL(bsl.BSL):
         self.ignore_answer = False
 
     def open(self, port, baudrate=9600, ignore_answer=False):
+        import serial   # imported here, not needed for --help etc.
         self.ignore_answer = ignore_answer
         self.logger.info('Opening serial port {!r}'.format(port))
         try:
@@ -390,6 +390,7 @@ class SerialBSLTarget(SerialBSL, msp430.target.Target):
 
     def parse_extra_options(self):
         if self.verbose > 1:   # debug infos
+            import serial
             if hasattr(serial, 'VERSION'):
                 sys.stderr.write('pySerial version: {}\n'.format(serial.VERSION))
 
@@ -84,9 +84,7 @@ class HIDBSL5Base(bsl5.BSL5):
 
 # some platform specific code follows
 if sys.platform == 'win32':
-    from pywinusb import hid
-    import ctypes
-    import Queue
+    # pywinusb, ctypes and Queue are imported when a device is opened
 
     class HIDBSL5(HIDBSL5Base):
         """\
@@ -94,6 +92,8 @@ if sys.platform == 'win32':
         """
 
         def open(self, device=None):
+            from pywinusb import hid
+            import Queue
             if device is None:
                 filter = hid.HidDeviceFilter(vendor_id=0x2047, product_id=0x0200)
                 all_devices = filter.get_devices()
@@ -129,6 +129,7 @@ if sys.platform == 'win32':
             while self.receiving_queue.qsize():
                 self.receiving_queue.get_nowait()
             # write report
+            import ctypes
             self.hid_device.send_output_report([ctypes.c_ubyte(x) for x in data])
 
         def read_report(self):
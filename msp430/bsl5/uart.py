@@ -13,7 +13,6 @@ import binascii
 import sys
 import functools
 from msp430.bsl5 import bsl5
-import serial
 import struct
 import logging
 import time
@@ -73,6 +72,7 @@ class SerialBSL5(bsl5.BSL5):
         self.control_delay = 0.05
 
     def open(self, port, baudrate=9600, ignore_answer=False):
+        import serial   # imported here, not needed for --help etc.
         self.ignore_answer = ignore_answer
         self.logger.info('Opening serial port %r' % port)
         try:
@@ -331,6 +331,7 @@ class SerialBSL5Target(SerialBSL5, msp430.target.Target):
 
     def parse_extra_options(self):
         if self.verbose > 1:   # debug infos
+            import serial
             if hasattr(serial, 'VERSION'):
                 sys.stderr.write("pySerial version: %s\n" % serial.VERSION)
 
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of https://github.com/zsquareplusc/python-msp430-tools
+# (C) 2026 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Benchmark memory transfers over the GDB remote protocol.
+
+Local servers (msp430.gdb.server) are started, unless servers are given with
+--connect, and all of them are used in parallel. For each write method, the
+flash is erased, the data written and read back for verification.
+"""
+
+import os
+import sys
+import threading
+import time
+
+from msp430.gdb import gdb
+from msp430.gdb.server import GDBServer, MemoryTarget
+
+METHODS = ('M', 'X', 'vFlashWrite')
+
+
+def write_blocks(client, method, address, data, block_size):
+    """Write data with the given method, split in blocks"""
+    if method == 'vFlashWrite':
+        client.flash_erase(address, len(data))
+    else:
+        client.monitor('erase')
+    for offset in range(0, len(data), block_size):
+        block = data[offset:offset + block_size]
+        if method == 'M':
+            client.write_memory(address + offset, block)
+        elif method == 'X':
+            client.write_memory_binary(address + offset, block)
+        else:
+            client.flash_write(address + offset, block)
+    if method == 'vFlashWrite':
+        client.flash_done()
+
+
+def read_blocks(client, address, size, block_size):
+    data = bytearray()
+    for offset in range(0, size, block_size):
+        data.extend(client.read_memory(address + offset, min(block_size, size - offset)))
+    return data
+
+
+class Worker(threading.Thread):
+    """Run all methods against one server"""
+
+    def __init__(self, host_port, methods, address, data):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.host_port = host_port
+        self.methods = methods
+        self.address = address
+        self.data = data
+        self.results = {}   # method -> (write time, read time)
+        self.error = None
+
+    def run(self):
+        try:
+            client = gdb.GDBClient(self.host_port)
+            try:
+                packet_size = int(client.supported().get('PacketSize', '400'), 16)
+                # hex encoding is the worst case for all methods (binary data
+                # may need escapes for every byte)
+                block_size = (packet_size - 32) // 2
+                for method in self.methods:
+                    t_start = time.time()
+                    write_blocks(client, method, self.address, self.data, block_size)
+                    t_write = time.time()
+                    readback = read_blocks(client, self.address, len(self.data), block_size)
+                    t_read = time.time()
+                    if readback != self.data:
+                        raise gdb.GDBException('verification failed ({})'.format(method))
+                    self.results[method] = (t_write - t_start, t_read - t_write)
+            finally:
+                client.close()
+        except Exception as e:
+            self.error = e
+
+
+def run_benchmark(servers, methods=METHODS, address=0xc000, size=0x4000):
+    """\
+    Run the benchmark against a list of (host, port) tuples. Returns a
+    dictionary method -> (write time, read time), the times are the maximum
+    over all servers (the time until all transfers are completed).
+    """
+    data = bytearray(os.urandom(size))
+    workers = [Worker(host_port, methods, address, data) for host_port in servers]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        if worker.error is not None:
+            raise worker.error
+    return dict((method, (max(w.results[method][0] for w in workers),
+                          max(w.results[method][1] for w in workers)))
+                for method in methods)
+
+
+def main():
+    import msp430.commandline_helper
+
+    class BenchmarkTool(msp430.commandline_helper.CommandLineTool):
+        description = __doc__
+
+        def configure_parser(self):
+            self.parser.add_argument(
+                '-n', '--instances',
+                type=int,
+                default=4,
+                metavar='N',
+                help='number of local servers (default: %(default)s)')
+
+            self.parser.add_argument(
+                '-c', '--connect',
+                action='append',
+                default=[],
+                metavar='HOST:PORT',
+                help='use a running server instead of local ones, can be given multiple times')
+
+            self.parser.add_argument(
+                '--size',
+                type=lambda x: int(x, 0),
+                default=0x4000,
+                help='bytes to transfer per server (default: %(default)s)')
+
+            self.parser.add_argument(
+                '--address',
+                type=lambda x: int(x, 0),
+                default=0xc000,
+                help='start address of the data, must be in flash (default: 0xc000)')
+
+            self.parser.add_argument(
+                '--method',
+                action='append',
+                choices=METHODS,
+                help='write method, can be given multiple times (default: all)')
+
+            self.parser.add_argument(
+                '--latency',
+                type=float,
+                default=0,
+                metavar='SECONDS',
+                help='delay per packet of local servers')
+
+            self.parser.add_argument(
+                '--speed',
+                type=float,
+                default=0,
+                metavar='BYTES_PER_S',
+                help='transfer speed of local servers (default: unlimited)')
+
+            self.parser.add_argument(
+                '--packet-size',
+                type=lambda x: int(x, 0),
+                default=0x400,
+                help='packet size of local servers (default: 0x400)')
+
+        def run(self, args):
+            local_servers = []
+            if args.connect:
+                servers = []
+                for host_port in args.connect:
+                    host, port = host_port.split(':')
+                    servers.append((host, int(port)))
+            else:
+                for n in range(args.instances):
+                    local_servers.append(GDBServer(
+                        ('localhost', 0),
+                        MemoryTarget(),
+                        latency=args.latency,
+                        speed=args.speed,
+                        packet_size=args.packet_size).start())
+                servers = [('localhost', server.port) for server in local_servers]
+            try:
+                methods = args.method or METHODS
+                results = run_benchmark(servers, methods, args.address, args.size)
+            finally:
+                for server in local_servers:
+                    server.stop()
+            total = args.size * len(servers)
+            sys.stdout.write('{} server(s), {} bytes each\n'.format(len(servers), args.size))
+            sys.stdout.write('method        write [s]  read [s]  write [kB/s]  read [kB/s]\n')
+            for method in methods:
+                t_write, t_read = results[method]
+                sys.stdout.write('{:<12} {:>10.3f} {:>9.3f} {:>13.1f} {:>12.1f}\n'.format(
+                    method, t_write, t_read, total / t_write / 1e3, total / t_read / 1e3))
+
+    tool = BenchmarkTool()
+    tool.main()
+
+
+if __name__ == '__main__':
+    main()
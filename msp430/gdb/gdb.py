@@ -82,11 +82,15 @@ class ClientSocketConnector(threading.Thread):
         self._alive = True
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.connect(host_port)
+        # small packets in both directions, do not wait to combine them
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.socket.settimeout(5)
         self.start()
 
     def write(self, text):
         """Just send everything"""
+        if not isinstance(text, bytes):
+            text = text.encode('latin-1')   # Python 3
         self.socket.sendall(text)
 
     def close(self):
@@ -109,6 +113,8 @@ class ClientSocketConnector(threading.Thread):
             else:
                 if not text:
                     break  # EOF -> terminate
+                if not isinstance(text, str):
+                    text = text.decode('latin-1')   # Python 3
                 self.handle_partial_data(text)
         self._alive = False
 
@@ -138,16 +144,40 @@ def decodeStopReplyPackets(message):
         raise GDBException("unknown Stop Reply Packet")
 
 
+# the hex encoding is already removed by GDBClient.handle_packet
 def hex2registers(message):
-    return list(unpack('<HHHHHHHHHHHHHHHH', binascii.unhexlify(message)))
+    return list(unpack('<HHHHHHHHHHHHHHHH', message))
 
 
 def decodeRegister(message):
-    return unpack('<H', binascii.unhexlify(message))[0]
+    return unpack('<H', message)[0]
 
 
 def encodeRegister(value):
-    return bytes(binascii.hexlify(pack('<H', value)))
+    return binascii.hexlify(pack('<H', value)).decode('ascii')
+
+
+def escape_binary(data):
+    """Escape binary data for X and vFlashWrite packets"""
+    res = []
+    for b in bytearray(data):
+        if b in (0x23, 0x24, 0x2a, 0x7d):     # '#', '$', '*', '}'
+            res.extend(['\x7d', chr(b ^ 0x20)])
+        else:
+            res.append(chr(b))
+    return ''.join(res)
+
+
+def decode_supported(message):
+    """Decode the answer to qSupported into a dictionary"""
+    features = {}
+    for feature in message.split(';'):
+        if '=' in feature:
+            name, value = feature.split('=', 1)
+            features[name] = value
+        elif feature:
+            features[feature[:-1]] = feature[-1] == '+'
+    return features
 
 
 class GDBClient(ClientSocketConnector):
@@ -164,14 +194,14 @@ class GDBClient(ClientSocketConnector):
     def handle_partial_data(self, data):
         #~ print data
         for character in data:
-            if character == '+':
+            if character == '+' and self.recv_mode == IDLE:
                 #~ print "ACK"    #XXX DEBUG
                 self.acknowledged = SUCCESS
                 #~ self.answer.put(None)
-            elif character == '-':
+            elif character == '-' and self.recv_mode == IDLE:
                 #~ print "NACK"    #XXX DEBUG
                 self.errorcounter += 1
-                self.answer.put(GDBRemoteError('Checksum error'))
+                self.answer.put(GDBRemoteError(None, 'Checksum error'))
             elif character == '$':
                 del self.packet[:]
                 self.recv_mode = DATA
@@ -197,6 +227,8 @@ class GDBClient(ClientSocketConnector):
                             self.recv_mode = IDLE
                         else:
                             self.write('-')
+                            del self.packet[:]
+                            self.recv_mode = IDLE
 
     def handle_packet(self, packet):
         #~ print 'handle_packet(%r) decoder=%r' % (packet, self.decoder)
@@ -212,9 +244,13 @@ class GDBClient(ClientSocketConnector):
             if len(message) & 1:
                 sys.stderr.write("Odd length 'o' message - cutting off last character\n")  # XXX hack
                 message = message[:-1]
-            self.output(binascii.unhexlify(message))
+            self.output(binascii.unhexlify(message).decode('latin-1'))
         else:
-            self.answer.put(binascii.unhexlify(packet))
+            try:
+                self.answer.put(binascii.unhexlify(packet))
+            except (TypeError, ValueError):
+                # not hex encoded, e.g. answer to qSupported
+                self.answer.put(packet)
             #~ else:
                 #~ print "unwanted packet: %r" % packet  # XXX ugly
 
@@ -280,7 +316,8 @@ class GDBClient(ClientSocketConnector):
     def write_memory(self, startaddress, data):
         """maddr,length -- read memory
         expected answer 'OK' or 'Enn'"""
-        return self._remote_command('M%x,%x:%s' % (startaddress, len(data), binascii.hexlify(bytes(data))))
+        return self._remote_command('M%x,%x:%s' % (
+            startaddress, len(data), binascii.hexlify(bytes(data)).decode('ascii')))
 
     def read_register(self, regnum):
         """pn... -- read reg (reserved)
@@ -327,15 +364,7 @@ class GDBClient(ClientSocketConnector):
     def write_memory_binary(self, startaddress, data):
         """maddr,data -- write memory
         expected answer 'OK' or 'Enn'"""
-        def escape(s):
-            res = []
-            for c in s:
-                if c in ('$', '#', '\x7d'):
-                    res.extend(['\x7d', chr(ord(c) ^ 0x20)])
-                else:
-                    res.append(c)
-            return ''.join(res)
-        return self._remote_command('X%x,%x:%s' % (startaddress, len(data), escape(data)))
+        return self._remote_command('X%x,%x:%s' % (startaddress, len(data), escape_binary(data)))
 
     def remove_breakpoint(self, type, address, length):
         """zt,addr,length -- remove break or watchpoint (draft)
@@ -350,7 +379,27 @@ class GDBClient(ClientSocketConnector):
     def monitor(self, command, nowait=False):
         """pass commands to the target interpreter
         expected answer 'OK' or 'Enn' or ''"""
-        return self.query('Rcmd,%s' % binascii.hexlify(bytes(command)), nowait=nowait)
+        return self.query('Rcmd,%s' % binascii.hexlify(command.encode('latin-1')).decode('ascii'), nowait=nowait)
+
+    def supported(self, features=''):
+        """qSupported -- exchange supported features
+        expected answer 'name=value;name+;...', returned as dictionary"""
+        return self._remote_command('qSupported%s' % (features and ':' + features), decoder=decode_supported)
+
+    def flash_erase(self, startaddress, size):
+        """vFlashErase:addr,length -- erase flash memory
+        expected answer 'OK' or 'Enn'"""
+        return self._remote_command('vFlashErase:%x,%x' % (startaddress, size))
+
+    def flash_write(self, startaddress, data):
+        """vFlashWrite:addr:data -- write flash memory (binary)
+        expected answer 'OK' or 'Enn'"""
+        return self._remote_command('vFlashWrite:%x:%s' % (startaddress, escape_binary(data)))
+
+    def flash_done(self):
+        """vFlashDone -- finish flash programming
+        expected answer 'OK' or 'Enn'"""
+        return self._remote_command('vFlashDone')
 
     # ---
     def interrupt(self):
@@ -370,7 +419,7 @@ class GDBClient(ClientSocketConnector):
             checksum = 0
             for character in cmd:
                 checksum = (checksum + ord(character)) & 0xff
-            message = b'$%s#%02x' % (cmd, checksum)
+            message = '$%s#%02x' % (cmd, checksum)
             self.write(message)
 
             if nowait:
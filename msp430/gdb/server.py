@@ -0,0 +1,515 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of https://github.com/zsquareplusc/python-msp430-tools
+# (C) 2026 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+GDB remote protocol server, backed by a memory image instead of hardware.
+
+It implements the commands that are used to up- and download data (m, M, X,
+vFlashErase, vFlashWrite, monitor erase...) so that GDB clients such as
+``msp430.gdb.target`` can be tested without a debug adapter. Flash memory
+follows the rules of the real device: programming can only clear bits and
+erasing works on whole segments. A latency per packet and a transfer speed
+can be configured to emulate the timing of a JTAG connection.
+"""
+
+import binascii
+import socket
+import sys
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver     # Python 2
+
+import msp430.memory
+
+
+PACKET_SIZE = 0x4000
+
+# error codes of 'E' replies
+E_PACKET = 1        # malformed packet
+E_ADDRESS = 2       # address out of range
+E_FLASH = 3         # flash location not erased (bits can not be set)
+E_COMMAND = 4       # unknown monitor command
+
+# (name, start, end, segment size) of the flash memory, the defaults fit
+# the F1xx/F2xx/F4xx devices with 64k address space
+DEFAULT_FLASH = [
+    ('info', 0x1000, 0x1100, 64),
+    ('main', 0x1100, 0x10000, 512),
+]
+
+
+class MemoryTarget(object):
+    """\
+    Memory of a simulated target. Locations outside of the flash regions
+    are RAM-like and can be written freely.
+    """
+
+    def __init__(self, memory=None, flash=DEFAULT_FLASH, size=0x10000):
+        self.data = bytearray(b'\xff' * size)
+        self.flash = list(flash)
+        self.registers = [0] * 16
+        self.lock = threading.Lock()
+        if memory is not None:
+            self.load(memory)
+
+    def load(self, memory):
+        """\
+        Initialize contents from a msp430.memory.Memory instance. The data is
+        copied as is, flash rules do not apply.
+        """
+        for segment in memory.segments:
+            self._check_range(segment.startaddress, len(segment.data))
+            self.data[segment.startaddress:segment.startaddress + len(segment.data)] = bytearray(segment.data)
+        self.reset()
+
+    def to_memory(self):
+        """Return the contents of the flash regions as msp430.memory.Memory instance."""
+        memory = msp430.memory.Memory()
+        for name, start, end, segment_size in sorted(self.flash, key=lambda x: x[1]):
+            memory.append(msp430.memory.Segment(start, bytes(self.data[start:end])))
+        return memory
+
+    def reset(self):
+        """Load PC from the reset vector, clear the other registers."""
+        self.registers = [0] * 16
+        if len(self.data) >= 0x10000:
+            self.registers[0] = self.data[0xfffe] | (self.data[0xffff] << 8)
+
+    def _check_range(self, address, length):
+        if address < 0 or length < 0 or address + length > len(self.data):
+            raise IndexError('address range 0x{:x}/{} not available'.format(address, length))
+
+    def flash_region(self, address):
+        """Return the flash region tuple that contains the address or None."""
+        for region in self.flash:
+            if region[1] <= address < region[2]:
+                return region
+        return None
+
+    def read(self, address, length):
+        """Read memory, returns a bytearray."""
+        self._check_range(address, length)
+        return self.data[address:address + length]
+
+    def write(self, address, data):
+        """\
+        Write memory. Flash locations can only be programmed from 1 to 0,
+        ValueError is raised if the data would require an erase (the
+        possible bits are programmed anyway, as on the hardware).
+        """
+        data = bytearray(data)
+        self._check_range(address, len(data))
+        not_erased = False
+        for offset, value in enumerate(data):
+            location = address + offset
+            if self.flash_region(location) is not None:
+                old = self.data[location]
+                if value & ~old:
+                    not_erased = True
+                value &= old
+            self.data[location] = value
+        if not_erased:
+            raise ValueError('flash at 0x{:x}/{} is not erased'.format(address, len(data)))
+
+    def erase_segment(self, address):
+        """Erase the flash segment that contains the address."""
+        region = self.flash_region(address)
+        if region is None:
+            raise IndexError('no flash at 0x{:x}'.format(address))
+        name, start, end, segment_size = region
+        segment_start = max(start, address & ~(segment_size - 1))
+        segment_end = min(end, (address & ~(segment_size - 1)) + segment_size)
+        self.data[segment_start:segment_end] = b'\xff' * (segment_end - segment_start)
+
+    def erase_range(self, address, length):
+        """Erase all segments that overlap with the given range."""
+        self._check_range(address, length)
+        location = address
+        while location < address + length:
+            region = self.flash_region(location)
+            if region is None:
+                raise IndexError('no flash at 0x{:x}'.format(location))
+            self.erase_segment(location)
+            location = (location & ~(region[3] - 1)) + region[3]
+
+    def erase(self, names=None):
+        """Erase all flash regions or the ones with given names."""
+        for name, start, end, segment_size in self.flash:
+            if names is None or name in names:
+                self.data[start:end] = b'\xff' * (end - start)
+
+    def memory_map(self):
+        """Return the memory map in the XML format used by GDB (qXfer:memory-map)."""
+        lines = ['<?xml version="1.0"?>',
+                 '<!DOCTYPE memory-map PUBLIC "+//IDN gnu.org//DTD GDB Memory Map V1.0//EN"'
+                 ' "http://sourceware.org/gdb/gdb-memory-map.dtd">',
+                 '<memory-map>']
+        address = 0
+        for name, start, end, segment_size in sorted(self.flash, key=lambda x: x[1]):
+            if start > address:
+                lines.append('<memory type="ram" start="0x{:x}" length="0x{:x}"/>'.format(address, start - address))
+            lines.append('<memory type="flash" start="0x{:x}" length="0x{:x}">'
+                         '<property name="blocksize">0x{:x}</property></memory>'.format(
+                             start, end - start, segment_size))
+            address = end
+        if address < len(self.data):
+            lines.append('<memory type="ram" start="0x{:x}" length="0x{:x}"/>'.format(
+                address, len(self.data) - address))
+        lines.append('</memory-map>')
+        return '\n'.join(lines)
+
+
+def unescape_binary(text):
+    """Decode the binary data of X and vFlashWrite packets"""
+    data = bytearray()
+    escaped = False
+    for character in text:
+        value = ord(character)
+        if escaped:
+            data.append(value ^ 0x20)
+            escaped = False
+        elif value == 0x7d:
+            escaped = True
+        else:
+            data.append(value)
+    return data
+
+
+def hex_text(message):
+    return binascii.hexlify(message.encode('latin-1')).decode('ascii')
+
+
+class GDBRequestHandler(socketserver.BaseRequestHandler):
+    """Handle one connection of a GDB client."""
+
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.target = self.server.target
+        self.ack = True
+        self.last_reply = None
+        self.transferred = 0    # bytes read/written by the current command
+
+    def handle(self):
+        buffer = b''
+        while True:
+            try:
+                data = self.request.recv(65536)
+            except IOError:
+                break
+            if not data:
+                break
+            buffer += data
+            position = 0
+            while position < len(buffer):
+                character = buffer[position:position + 1]
+                if character == b'$':
+                    end = buffer.find(b'#', position)
+                    if end < 0 or end + 3 > len(buffer):
+                        break   # incomplete, wait for more data
+                    payload = buffer[position + 1:end]
+                    checksum = buffer[end + 1:end + 3]
+                    position = end + 3
+                    try:
+                        valid = int(checksum, 16) == sum(bytearray(payload)) & 0xff
+                    except ValueError:
+                        valid = False
+                    if not valid:
+                        self.request.sendall(b'-')
+                        continue
+                    if self.ack:
+                        self.request.sendall(b'+')
+                    if not isinstance(payload, str):
+                        payload = payload.decode('latin-1')     # Python 3
+                    reply = self.process(payload)
+                    if reply is None:
+                        return      # kill or detach
+                    self.send_packet(reply)
+                    if payload == 'QStartNoAckMode':
+                        self.ack = False
+                elif character == b'-':
+                    position += 1
+                    if self.last_reply is not None:
+                        self.send_packet(self.last_reply)
+                elif character == b'\x03':
+                    position += 1
+                    self.send_packet('S02')     # target is never running
+                else:
+                    position += 1   # '+' and garbage between packets
+            buffer = buffer[position:]
+
+    def send_packet(self, reply):
+        self.last_reply = reply
+        packet = '${}#{:02x}'.format(reply, sum(bytearray(reply.encode('latin-1'))) & 0xff)
+        self.request.sendall(packet.encode('latin-1'))
+
+    def output(self, message):
+        """Send a text to the console of the client (O packet)"""
+        self.send_packet('O' + hex_text(message))
+
+    def process(self, packet):
+        """Execute one command, returns the reply or None to close the connection"""
+        self.transferred = 0
+        try:
+            reply = self.dispatch(packet)
+        except IndexError:
+            reply = 'E{:02x}'.format(E_ADDRESS)
+        except (ValueError, TypeError):
+            reply = 'E{:02x}'.format(E_PACKET)
+        self.server.emulate_timing(self.transferred)
+        return reply
+
+    def dispatch(self, packet):
+        command = packet[0:1]
+        target = self.target
+        if command == 'm':
+            address, length = [int(x, 16) for x in packet[1:].split(',')]
+            with target.lock:
+                data = target.read(address, length)
+            self.transferred = length
+            return binascii.hexlify(bytes(data)).decode('ascii')
+        elif command in ('M', 'X'):
+            location, payload = packet[1:].split(':', 1)
+            address, length = [int(x, 16) for x in location.split(',')]
+            if command == 'M':
+                data = binascii.unhexlify(payload)
+            else:
+                data = unescape_binary(payload)
+            if len(data) != length:
+                raise ValueError('length mismatch')
+            return self.write(address, data)
+        elif command == 'v':
+            return self.dispatch_v(packet)
+        elif command == 'q':
+            return self.dispatch_query(packet)
+        elif packet == 'QStartNoAckMode':
+            return 'OK'     # handle() switches the mode after the reply
+        elif command == '?':
+            return 'S05'
+        elif command == 'g':
+            return ''.join('{:02x}{:02x}'.format(r & 0xff, (r >> 8) & 0xff) for r in target.registers)
+        elif command == 'G':
+            values = bytearray(binascii.unhexlify(packet[1:]))
+            target.registers = [values[2 * i] | (values[2 * i + 1] << 8) for i in range(16)]
+            return 'OK'
+        elif command == 'p':
+            r = target.registers[int(packet[1:], 16)]
+            return '{:02x}{:02x}'.format(r & 0xff, (r >> 8) & 0xff)
+        elif command == 'P':
+            number, value = packet[1:].split('=')
+            value = bytearray(binascii.unhexlify(value))
+            target.registers[int(number, 16)] = value[0] | (value[1] << 8)
+            return 'OK'
+        elif command in ('c', 's', 'C', 'S'):
+            return 'S05'    # no code execution, report a stop immediately
+        elif command == '!':
+            return 'OK'
+        elif command == 'D':
+            self.send_packet('OK')
+            return None
+        elif command == 'k':
+            return None
+        return ''   # not supported
+
+    def dispatch_query(self, packet):
+        if packet.startswith('qSupported'):
+            return 'PacketSize={:x};qXfer:memory-map:read+;QStartNoAckMode+'.format(self.server.packet_size)
+        elif packet.startswith('qRcmd,'):
+            return self.monitor(binascii.unhexlify(packet[6:]).decode('latin-1'))
+        elif packet.startswith('qXfer:memory-map:read::'):
+            offset, length = [int(x, 16) for x in packet[23:].split(',')]
+            xml = self.target.memory_map()
+            chunk = xml[offset:offset + length]
+            return ('l' if offset + length >= len(xml) else 'm') + chunk
+        elif packet == 'qAttached':
+            return '1'
+        return ''
+
+    def dispatch_v(self, packet):
+        if packet.startswith('vFlashErase:'):
+            address, length = [int(x, 16) for x in packet[12:].split(',')]
+            with self.target.lock:
+                self.target.erase_range(address, length)
+            return 'OK'
+        elif packet.startswith('vFlashWrite:'):
+            address, payload = packet[12:].split(':', 1)
+            return self.write(int(address, 16), unescape_binary(payload))
+        elif packet == 'vFlashDone':
+            return 'OK'
+        return ''
+
+    def write(self, address, data):
+        self.transferred = len(data)
+        try:
+            with self.target.lock:
+                self.target.write(address, data)
+        except ValueError:
+            return 'E{:02x}'.format(E_FLASH)
+        return 'OK'
+
+    def monitor(self, command):
+        """Commands as implemented by msp430-gdbproxy and mspdebug"""
+        words = command.split()
+        target = self.target
+        with target.lock:
+            if words == ['erase'] or words == ['erase', 'main']:
+                target.erase(['main'])
+            elif words == ['erase', 'all']:
+                target.erase()
+            elif len(words) == 3 and words[:2] == ['erase', 'segment']:
+                target.erase_segment(int(words[2], 0))
+            elif words == ['reset']:
+                target.reset()
+            elif words == ['help']:
+                self.output('erase [all|main|segment ADDRESS], reset\n')
+            else:
+                self.output('unknown command: {}\n'.format(command))
+                return 'E{:02x}'.format(E_COMMAND)
+        return 'OK'
+
+
+class GDBServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """\
+    GDB server for a MemoryTarget. Each connection is handled in its own
+    thread, all connections share the target. Use port 0 to let the OS
+    choose a free port.
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address=('localhost', 2000), target=None, latency=0, speed=0, packet_size=PACKET_SIZE):
+        socketserver.TCPServer.__init__(self, address, GDBRequestHandler)
+        self.target = target if target is not None else MemoryTarget()
+        self.latency = latency          # seconds per packet
+        self.speed = speed              # bytes per second, 0 for unlimited
+        self.packet_size = packet_size
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def emulate_timing(self, transferred):
+        """Delay the reply like a slow connection to the hardware would"""
+        delay = self.latency
+        if self.speed:
+            delay += float(transferred) / self.speed
+        if delay > 0:
+            time.sleep(delay)
+
+    def start(self):
+        """Serve in a background thread, returns self."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop a server that was started with start()."""
+        self.shutdown()
+        self.server_close()
+
+
+def parse_flash(text):
+    """Parse START-END/SEGMENT_SIZE for --flash"""
+    addresses, segment_size = text.split('/')
+    start, end = addresses.split('-')
+    return ('flash', int(start, 0), int(end, 0) + 1, int(segment_size, 0))
+
+
+def main():
+    import msp430.commandline_helper
+
+    class ServerTool(msp430.commandline_helper.CommandLineTool):
+        description = """\
+GDB server that simulates a MSP430 target (memory only, no code execution).
+
+It supports up- and download of data, flash erase and programming, e.g. to
+test msp430.gdb.target or to benchmark transfers without hardware. Multiple
+instances can be started on consecutive ports.
+"""
+
+        def configure_parser(self):
+            self.parser_add_input(nargs='*')
+
+            self.parser.add_argument(
+                '--host',
+                default='localhost',
+                help='interface to listen on (default: %(default)s)')
+
+            self.parser.add_argument(
+                '-p', '--port',
+                type=int,
+                default=2000,
+                help='TCP port, 0 chooses a free port (default: %(default)s)')
+
+            self.parser.add_argument(
+                '-n', '--instances',
+                type=int,
+                default=1,
+                metavar='N',
+                help='number of servers, each with its own memory (default: %(default)s)')
+
+            self.parser.add_argument(
+                '--flash',
+                action='append',
+                type=parse_flash,
+                metavar='START-END/SIZE',
+                help='flash region and its segment size, can be given multiple times'
+                     ' (default: 0x1000-0x10ff/64 and 0x1100-0xffff/512)')
+
+            self.parser.add_argument(
+                '--latency',
+                type=float,
+                default=0,
+                metavar='SECONDS',
+                help='delay per packet')
+
+            self.parser.add_argument(
+                '--speed',
+                type=float,
+                default=0,
+                metavar='BYTES_PER_S',
+                help='limit memory transfer speed (default: unlimited)')
+
+            self.parser.add_argument(
+                '--packet-size',
+                type=lambda x: int(x, 0),
+                default=PACKET_SIZE,
+                help='packet size reported to the client (default: %(default)s)')
+
+        def run(self, args):
+            image = msp430.memory.Memory()
+            for fileobj in args.SRC:
+                for segment in msp430.memory.load(fileobj.name, fileobj, args.input_format).segments:
+                    image.append(segment)
+            servers = []
+            for n in range(args.instances):
+                server = GDBServer(
+                    (args.host, args.port + n if args.port else 0),
+                    MemoryTarget(image, args.flash or DEFAULT_FLASH),
+                    latency=args.latency,
+                    speed=args.speed,
+                    packet_size=args.packet_size)
+                servers.append(server)
+                sys.stderr.write('GDB server listening on {}:{}\n'.format(args.host, server.port))
+            for server in servers[1:]:
+                server.start()
+            try:
+                servers[0].serve_forever()
+            finally:
+                for server in servers:
+                    server.server_close()
+
+    tool = ServerTool()
+    tool.main()
+
+
+if __name__ == '__main__':
+    main()
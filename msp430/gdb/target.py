@@ -23,14 +23,23 @@ class GDBTarget(object):
 
     def __init__(self):
         self.gdb = None
+        self.block_size = None      # max. bytes per memory read/write packet
 
     def memory_read(self, address, length):
         """Read from memory."""
-        return bytearray(self.gdb.read_memory(address, length))
+        if self.block_size is None:
+            return bytearray(self.gdb.read_memory(address, length))
+        data = bytearray()
+        for offset in range(0, length, self.block_size):
+            data.extend(self.gdb.read_memory(address + offset, min(self.block_size, length - offset)))
+        return data
 
     def memory_write(self, address, data):
         """Write to memory."""
-        return self.gdb.write_memory(address, data)
+        if self.block_size is None:
+            return self.gdb.write_memory(address, data)
+        for offset in range(0, len(data), self.block_size):
+            self.gdb.write_memory(address + offset, data[offset:offset + self.block_size])
 
     def mass_erase(self):
         """Clear all Flash memory."""
@@ -59,6 +68,14 @@ class GDBTarget(object):
     def open(self, host_port):
         self.close()
         self.gdb = gdb.GDBClient(host_port)
+        # split transfers when the server tells its packet size. the data is
+        # hex encoded (2 characters per byte) and some room is needed for
+        # the command, address and length
+        try:
+            packet_size = int(self.gdb.supported().get('PacketSize', '0'), 16)
+        except gdb.GDBException:
+            packet_size = 0     # server does not support qSupported
+        self.block_size = (packet_size - 32) // 2 if packet_size > 64 else None
 
     def close(self):
         if self.gdb is not None:
@@ -14,7 +14,8 @@ MSP430.dll/libmsp430.so and HIL.dll/libHIL.so
 
 import sys
 import os
-import ctypes
+# ctypes is imported by init_backend(), when the library is loaded
+ctypes = None
 
 # erase modes
 ERASE_SEGMENT = 0       # Erase a segment.
@@ -71,8 +72,9 @@ DEVICE_CONNECTION_LOST = 1  # System event device connection is lost
 FET_RESTART_NEEDED = 2      # System event FET restart needed
 DEVICE_IN_LPM5_MODE = 3     # System event device entered LPMx.5
 DEVICE_WAKEUP_LPM5_MODE = 4  # System event devices wakes up from LPMx.5
-# callbakc definition
-SYSTEM_NOTIFY_CALLBACK = ctypes.CFUNCTYPE(None, ctypes.c_int)  # param is enum SYSTEM_EVENT_MSP
+# callbakc definition, created by init_backend():
+# ctypes.CFUNCTYPE(None, ctypes.c_int), param is enum SYSTEM_EVENT_MSP
+SYSTEM_NOTIFY_CALLBACK = None
 
 # interface type 'spy-bi-wire' or 'JTAG'
 interface = 'JTAG'
@@ -95,6 +97,7 @@ class JTAGException(Exception):
 
 def locate_library(libname, paths=sys.path, loader=None, verbose=0):
     if loader is None:
+        import ctypes
         loader = ctypes.windll
     for path in paths:
         if path.lower().endswith('.zip'):
@@ -120,6 +123,11 @@ def init_backend(force=None, verbose=0):
     global backend_info
     global _parjtag
     global search_path
+    global ctypes
+    global SYSTEM_NOTIFY_CALLBACK
+
+    import ctypes
+    SYSTEM_NOTIFY_CALLBACK = ctypes.CFUNCTYPE(None, ctypes.c_int)
 
     # an absolute path to the library can be given.
     # LIBMSPGCC_PATH is used to pass its location
@@ -13,77 +13,403 @@ the problem there is, that it is not sure that we're reading a valid address
 every time. an other issue is the relatively slow sampling rate compared to
 the execution speed of the MCU, which means that several runs are need to
 get meaningful numbers.
+
+Samples are taken at a fixed rate and counted per address. With the symbols
+of an ELF file, the counts are aggregated per function. The results can be
+written as list of addresses, as function table, in the "folded" format of
+flame graph tools and as pstats file (Python profiler statistics).
+
+Instead of a JTAG connection, a recorded trace of addresses can be replayed.
 """
 
-from msp430.jtag import jtag
+import bisect
+import collections
+import marshal
+import os
 import sys
 import time
 
-if __name__ == '__main__':
-    from optparse import OptionParser
+UNKNOWN = '[unknown]'
 
-    parser = OptionParser(usage="%prog [OPTIONS]")
 
-    parser.add_option(
-        "-v", "--verbose",
-        dest="verbose",
-        help="show more messages (can be given multiple times)",
-        default=0,
-        action='count')
+class JTAGSampler(object):
+    """Read the address bus of a target connected with JTAG."""
+    realtime = True
 
-    parser.add_option(
-        "-o", "--output",
-        dest="output",
-        help="write result to given file",
-        metavar="FILENAME")
+    def __init__(self, verbose=0):
+        from msp430.jtag import jtag
+        self.jtag = jtag
+        jtag.init_backend(jtag.CTYPES_MSPGCC)   # doesn't currently work with 3'rd party libs
+        self.jtagobj = jtag.JTAG()
+        if verbose:
+            try:
+                self.jtagobj.setDebugLevel(verbose)
+            except IOError:
+                sys.stderr.write("WARNING: Failed to set debug level in backend library\n")
+            jtag.DEBUG = verbose
+        self.connected = False
 
-    (options, args) = parser.parse_args()
+    def open(self):
+        self.jtagobj.open()                     # try to open port
+        self.jtagobj.connect()                  # try to connect to target
+        self.connected = True
+        self.jtagobj.reset(1, 0)
 
-    # prepare output
-    if options.output is None:
-        output = sys.stdout
-    else:
-        output = open(options.output, 'w')
+    def read(self):
+        """Return the current address"""
+        return self.jtag.MSP430_readMAB()
 
-    jtag.init_backend(jtag.CTYPES_MSPGCC)   # doesn't currently work with 3'rd party libs
-    samples = [0] * 2**16
+    def close(self):
+        if self.connected:
+            self.jtagobj.reset(1, 1)            # reset and release target
+        self.jtagobj.close()                    # release communication port
 
-    try:
-        jtagobj = jtag.JTAG()
 
-        if options.verbose:
-            try:
-                jtagobj.setDebugLevel(options.verbose)
-            except IOError:
-                sys.stderr.write("WARNING: Failed to set debug level in backend library\n")
-            #~ memory.DEBUG = options.verbose
-            jtag.DEBUG = options.verbose
+class ReplaySampler(object):
+    """\
+    Replay addresses from an iterable (e.g. a recorded trace), a fake
+    backend for tests and benchmarks. The samples are assumed to be taken at
+    the rate given to the profiler.
+    """
+    realtime = False
+
+    def __init__(self, addresses):
+        self.addresses = addresses
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def read_trace(fileobj):
+    """\
+    Read a trace file. Each line contains an address and an optional repeat
+    count (the format of the "raw" output), lines starting with "#" are
+    comments. Returns a tuple (rate, addresses), rate being None if the file
+    does not have a "# rate: N" line.
+    """
+    rate = None
+    addresses = []
+    for line in fileobj:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#'):
+            if line[1:].strip().startswith('rate:'):
+                rate = float(line.split(':', 1)[1])
+            continue
+        fields = line.split()
+        address = int(fields[0], 16)
+        if len(fields) > 1:
+            addresses.extend([address] * int(fields[1]))
+        else:
+            addresses.append(address)
+    return rate, addresses
+
 
-        jtagobj.open()                          # try to open port
+class SymbolTable(object):
+    """Map addresses to function names."""
+
+    def __init__(self, symbols=()):
+        """symbols is a list of tuples (address, size, name), size may be 0 if unknown"""
+        self.symbols = sorted(symbols)
+        self._addresses = [symbol[0] for symbol in self.symbols]
+
+    @classmethod
+    def from_elf(cls, fileobj):
+        """\
+        Read the functions from the symbol table of an ELF file. Labels
+        without type in code sections are used if there are no function
+        symbols (e.g. assembler programs).
+        """
+        from msp430.memory import elf
+        obj = elf.ELFObject()
+        obj.fromFile(fileobj)
+        defined = [s for s in obj.getSymbols()
+                   if s.name and s.st_shndx not in (elf.ELFSymbol.SHN_UNDEF, elf.ELFSymbol.SHN_ABS) and
+                   s.st_shndx < len(obj.sections)]
+        functions = [s for s in defined if s.type == elf.ELFSymbol.STT_FUNC]
+        if not functions:
+            functions = [s for s in defined
+                         if s.type == elf.ELFSymbol.STT_NOTYPE and
+                         not s.name.startswith('.') and
+                         obj.sections[s.st_shndx].sh_flags & elf.ELFSection.SHF_EXECINSTR]
+        return cls((s.st_value, s.st_size, s.name) for s in functions)
+
+    def lookup(self, address):
+        """Return the name of the function that contains the address or UNKNOWN"""
+        index = bisect.bisect_right(self._addresses, address) - 1
+        if index < 0:
+            return UNKNOWN
+        start, size, name = self.symbols[index]
+        if size and address >= start + size:
+            return UNKNOWN
+        return name
+
+
+class Profile(object):
+    """Collect samples of addresses in a sparse histogram."""
+
+    def __init__(self, rate=1000):
+        self.rate = rate            # samples per second, 0 for "as fast as possible"
+        self.histogram = collections.Counter()
+        self.missed = 0             # samples that could not be taken in time
+        self.duration = 0
+        self.snapshot = None        # callback, gets self as argument
+        self.snapshot_interval = 10
+
+    @property
+    def samples(self):
+        return sum(self.histogram.values())
+
+    @property
+    def effective_rate(self):
+        return self.samples / self.duration if self.duration else 0
+
+    def run(self, sampler, duration=None, record=None):
+        """\
+        Sample until the given duration (seconds) has passed, the sampler has
+        no more data or KeyboardInterrupt. record is an optional file where
+        the addresses are written to, so that they can be replayed later.
+        """
+        sampler.open()
+        try:
+            if sampler.realtime:
+                self._run_realtime(sampler, duration, record)
+            else:
+                addresses = sampler.addresses
+                if duration is not None and self.rate:
+                    addresses = addresses[:int(duration * self.rate)]
+                self.histogram.update(addresses)
+                if record is not None:
+                    self._write_trace(record, addresses)
+                self.duration += len(addresses) / float(self.rate) if self.rate else 0
+        finally:
+            sampler.close()
+        if self.snapshot is not None:
+            self.snapshot(self)
+
+    def _write_trace(self, record, addresses):
+        record.write('# rate: {}\n'.format(self.rate))
+        record.write(''.join('0x{:04x}\n'.format(a) for a in addresses))
+
+    def _run_realtime(self, sampler, duration, record):
+        histogram = self.histogram
+        read = sampler.read
+        period = 1.0 / self.rate if self.rate else 0
+        start_time = next_time = next_snapshot = time.time()
+        next_snapshot += self.snapshot_interval
+        trace = [] if record is not None else None
         try:
-            jtagobj.connect()                   # try to connect to target
-            connected = True
-            jtagobj.reset(1, 0)
-            sys.stderr.write("profiling... (CTRL-C to stop)\n")
-            start_time = time.time()
             while True:
-                samples[jtag.MSP430_readMAB()] += 1
+                now = time.time()
+                if period:
+                    if now < next_time:
+                        time.sleep(next_time - now)
+                    elif now - next_time > period:
+                        # too slow, skip samples to keep the time base
+                        skipped = int((now - next_time) / period)
+                        self.missed += skipped
+                        next_time += skipped * period
+                    next_time += period
+                address = read()
+                histogram[address] += 1
+                if trace is not None:
+                    trace.append(address)
+                if now >= next_snapshot:
+                    next_snapshot = now + self.snapshot_interval
+                    self.duration = now - start_time
+                    if self.snapshot is not None:
+                        self.snapshot(self)
+                if duration is not None and now - start_time >= duration:
+                    break
+        except KeyboardInterrupt:
+            pass
         finally:
-            stop_time = time.time()
-            if sys.exc_info()[:1]:              # if there is an exception pending
-                jtagobj.verbose = 0             # do not write any more messages
-            if connected:
-                jtagobj.reset(1, 1)             # reset and release target
-            jtagobj.close()                     # release communication port
-    except KeyboardInterrupt:
-        # write out sample count per address
-        total = 0
-        for n, count in enumerate(samples):
-            if count > 0:
-                output.write("0x%04x\t%d\n" % (n, count))
-            total += count
-        # write a summary
-        sys.stderr.write('%d samples in %.2f seconds (%d samples/second)\n' % (
-                total,
-                stop_time - start_time,
-                total / (stop_time - start_time)))
+            self.duration = time.time() - start_time
+            if trace is not None:
+                self._write_trace(record, trace)
+
+    def functions(self, symbols):
+        """Return a Counter with the samples per function"""
+        result = collections.Counter()
+        for address, count in self.histogram.items():
+            result[symbols.lookup(address)] += count
+        return result
+
+    def write_raw(self, output):
+        """Write the sample count per address"""
+        for address, count in sorted(self.histogram.items()):
+            output.write("0x%04x\t%d\n" % (address, count))
+
+    def write_functions(self, output, symbols):
+        """Write a table with the samples per function, sorted by count"""
+        total = self.samples or 1
+        output.write('# {} samples, {:.2f} s, {:.0f} samples/s (requested {}), {} missed\n'.format(
+            self.samples, self.duration, self.effective_rate, self.rate or 'max', self.missed))
+        for name, count in self.functions(symbols).most_common():
+            output.write('{:>8} {:>6.2f}%  {}\n'.format(count, 100.0 * count / total, name))
+
+    def write_folded(self, output, symbols):
+        """\
+        Write the "folded stacks" format of flame graph tools. Only the PC is
+        known, so each stack has a single frame.
+        """
+        for name, count in sorted(self.functions(symbols).items()):
+            output.write('{} {}\n'.format(name.replace(' ', '_'), count))
+
+    def pstats(self, symbols, filename='msp430'):
+        """\
+        Return the data in the format of the Python profiler (as used by
+        pstats.Stats). The number of samples is used as call count, the time
+        is calculated from the sample rate.
+        """
+        rate = float(self.rate or self.effective_rate or 1)
+        addresses = dict((name, address) for address, size, name in reversed(symbols.symbols))
+        stats = {}
+        for name, count in self.functions(symbols).items():
+            stats[(filename, addresses.get(name, 0), name)] = (count, count, count / rate, count / rate, {})
+        return stats
+
+    def write_pstats(self, output, symbols, filename='msp430'):
+        """Write a file that can be loaded with pstats.Stats"""
+        marshal.dump(self.pstats(symbols, filename), output)
+
+
+def write_atomic(filename, write, binary=False):
+    """Write a file with a temporary name and rename, so readers see complete files only"""
+    temp_name = filename + '.tmp'
+    with open(temp_name, 'wb' if binary else 'w') as output:
+        write(output)
+    try:
+        os.replace(temp_name, filename)
+    except AttributeError:  # Python 2
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(temp_name, filename)
+
+
+def main():
+    import argparse
+    import msp430.commandline_helper
+
+    class ProfileTool(msp430.commandline_helper.CommandLineTool):
+        description = __doc__
+
+        def configure_parser(self):
+            self.parser.add_argument(
+                '-v', '--verbose',
+                help='show more messages (can be given multiple times)',
+                default=0,
+                action='count')
+
+            self.parser.add_argument(
+                '-o', '--output',
+                help='write result to given file, it is updated periodically while sampling',
+                metavar='FILENAME')
+
+            self.parser.add_argument(
+                '-f', '--format',
+                choices=['raw', 'functions', 'folded'],
+                default='raw',
+                help='output format: samples per address, per function or folded stacks for flame graphs '
+                     '(default: %(default)s)')
+
+            self.parser.add_argument(
+                '--pstats',
+                metavar='FILENAME',
+                help='additionally write a pstats file (python -m pstats FILENAME)')
+
+            self.parser.add_argument(
+                '--elf',
+                type=argparse.FileType('rb'),
+                metavar='FILENAME',
+                help='ELF file with the symbols of the program')
+
+            self.parser.add_argument(
+                '-r', '--rate',
+                type=float,
+                default=1000,
+                help='samples per second, 0 for as fast as possible (default: %(default)s)')
+
+            self.parser.add_argument(
+                '-t', '--duration',
+                type=float,
+                metavar='SECONDS',
+                help='stop after this time (default: run until CTRL-C)')
+
+            self.parser.add_argument(
+                '--snapshot-interval',
+                type=float,
+                default=10,
+                metavar='SECONDS',
+                help='update the output file this often (default: %(default)s)')
+
+            self.parser.add_argument(
+                '--record',
+                type=argparse.FileType('w'),
+                metavar='FILENAME',
+                help='save the sampled addresses (trace) to a file')
+
+            self.parser.add_argument(
+                '--replay',
+                type=argparse.FileType('r'),
+                metavar='FILENAME',
+                help='use a recorded trace instead of a JTAG connection')
+
+        def run(self, args):
+            if args.elf is not None:
+                symbols = SymbolTable.from_elf(args.elf)
+            else:
+                symbols = SymbolTable()
+
+            elf_name = os.path.basename(args.elf.name) if args.elf is not None else 'msp430'
+            profile = Profile(args.rate)
+            if args.replay is not None:
+                rate, addresses = read_trace(args.replay)
+                if rate is not None:
+                    profile.rate = rate
+                sampler = ReplaySampler(addresses)
+            else:
+                sampler = JTAGSampler(args.verbose)
+
+            def write_output(output):
+                if args.format == 'functions':
+                    profile.write_functions(output, symbols)
+                elif args.format == 'folded':
+                    profile.write_folded(output, symbols)
+                else:
+                    profile.write_raw(output)
+
+            def snapshot(profile):
+                if args.output is not None:
+                    write_atomic(args.output, write_output)
+                if args.pstats is not None:
+                    write_atomic(args.pstats, lambda f: profile.write_pstats(f, symbols, elf_name), binary=True)
+
+            profile.snapshot = snapshot
+            profile.snapshot_interval = args.snapshot_interval
+            if sampler.realtime:
+                sys.stderr.write("profiling... (CTRL-C to stop)\n")
+            start_time = time.time()
+            profile.run(sampler, args.duration, args.record)
+            if args.output is None:
+                write_output(sys.stdout)
+            # write a summary
+            sys.stderr.write('%d samples in %.2f seconds (%d samples/second, requested %s, %d missed)\n' % (
+                    profile.samples,
+                    profile.duration,
+                    profile.effective_rate,
+                    profile.rate or 'max',
+                    profile.missed))
+            if args.verbose:
+                sys.stderr.write('processing time: %.3f s\n' % (time.time() - start_time,))
+
+    tool = ProfileTool()
+    tool.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -168,6 +168,50 @@ class ELFProgramHeader:
                 self.p_align)
 
 
+class ELFSymbol:
+    """read and store an entry of the symbol table"""
+    Elf32_Sym = "<IIIBBH"      # symbol table entry format
+
+    # symbol types (lower 4 bits of st_info)
+    STT_NOTYPE = 0
+    STT_OBJECT = 1
+    STT_FUNC = 2
+    STT_SECTION = 3
+    STT_FILE = 4
+    # symbol binding (upper 4 bits of st_info)
+    STB_LOCAL = 0
+    STB_GLOBAL = 1
+    STB_WEAK = 2
+    # special section indexes
+    SHN_UNDEF = 0
+    SHN_ABS = 0xfff1
+
+    def __init__(self):
+        """create a new empty symbol"""
+        (self.st_name, self.st_value, self.st_size, self.st_info,
+         self.st_other, self.st_shndx) = [0] * 6
+        self.name = None
+
+    def fromString(self, s):
+        """get symbol from string"""
+        (self.st_name, self.st_value, self.st_size, self.st_info,
+         self.st_other, self.st_shndx) = struct.unpack(self.Elf32_Sym, s)
+
+    @property
+    def type(self):
+        return self.st_info & 0xf
+
+    @property
+    def binding(self):
+        return self.st_info >> 4
+
+    def __str__(self):
+        """pretty print for debug..."""
+        return "%s(%r, st_value=0x%04x, st_size=%s, type=%s, binding=%s, st_shndx=%s)" % (
+            self.__class__.__name__, self.name, self.st_value, self.st_size,
+            self.type, self.binding, self.st_shndx)
+
+
 class ELFObject:
     """Object to read and handle an LEF object file"""
     #header information
@@ -275,6 +319,21 @@ class ELFObject:
             if section.name == b'.text':
                 return section
 
+    def getSymbols(self):
+        """get a list of ELFSymbol objects from the symbol table (.symtab)"""
+        symbols = []
+        size = struct.calcsize(ELFSymbol.Elf32_Sym)
+        for section in self.sections:
+            if section.sh_type != ELFSection.SHT_SYMTAB:
+                continue
+            strings = self.sections[section.sh_link].data
+            for offset in range(size, len(section.data) - size + 1, section.sh_entsize or size):  # skip entry 0
+                symbol = ELFSymbol()
+                symbol.fromString(bytes(section.data[offset:offset + size]))
+                symbol.name = bytes(strings[symbol.st_name:].split(b'\0')[0]).decode('latin-1')
+                symbols.append(symbol)
+        return symbols
+
     def getProgrammableSections(self):
         """get all program headers that are marked as executable and
         have suitable attributes to be code"""
@@ -0,0 +1,894 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This file is part of https://github.com/zsquareplusc/python-msp430-tools
+# (C) 2026 Chris Liechti <cliechti@gmx.net>
+#
+# SPDX-License-Identifier:    BSD-3-Clause
+"""\
+Instruction set simulator for MSP430 and MSP430X CPUs.
+
+The simulator executes a msp430.memory.Memory image. Each opcode is
+translated to a small Python function on first use, the functions are cached
+per opcode (and extension word), so that the main loop only fetches a word
+and calls the handler. Cycle counts are approximate, they are taken from the
+disassembler's decode table.
+
+Peripherals are not simulated, but hooks can be registered for addresses, so
+that reads and writes call user functions. This can be used to model simple
+peripherals or to communicate with the simulated program (e.g. output of
+test results).
+"""
+
+import types
+from msp430.asm import disassemble
+
+# status register bits
+C = 0x0001
+Z = 0x0002
+N = 0x0004
+GIE = 0x0008
+CPUOFF = 0x0010
+V = 0x0100
+
+# cycles the CPU needs to accept an interrupt
+INTERRUPT_CYCLES = 6
+
+# operand sizes: mask, sign bit, reader, writer
+SIZES = {
+    'b': (0xff, 0x80, 'rb', 'wb'),
+    'w': (0xffff, 0x8000, 'rw', 'ww'),
+    'a': (0xfffff, 0x80000, 'ra', 'wa'),
+}
+
+
+class SimulatorError(Exception):
+    """Execution errors such as illegal instructions"""
+
+
+def bcd_add(s, d, carry, digits):
+    """Decimal addition for DADD, returns (result, carry)"""
+    result = 0
+    for shift in range(0, 4 * digits, 4):
+        digit = ((s >> shift) & 0xf) + ((d >> shift) & 0xf) + carry
+        carry = digit > 9
+        if carry:
+            digit -= 10
+        result |= (digit & 0xf) << shift
+    return result, int(carry)
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+# code generation
+#
+# A handler is a function h(R), R being the register list. On entry R[0]
+# points to the opcode (after the extension word, if any), the handler
+# updates the registers, memory and R[0] and returns the number of cycles.
+
+class CodeGenerator(object):
+    """Generate the Python source of the handler for one instruction."""
+
+    def __init__(self, msp430x):
+        self.msp430x = msp430x
+        self.address_mask = 0xfffff if msp430x else 0xffff
+        self.lines = []
+        self._var = 0
+
+    def emit(self, line, indent=1):
+        self.lines.append('    ' * indent + line)
+
+    def source(self, cycles):
+        self.emit('return {}'.format(cycles))
+        return 'def handler(R):\n' + '\n'.join(self.lines) + '\n'
+
+    def fetch(self, var):
+        """read the next word of the instruction stream"""
+        self.emit('{} = M[pc] | (M[pc + 1] << 8)'.format(var))
+        self.emit('pc += 2')
+
+    def index(self, var, base, x, extended):
+        """calculate an indexed address"""
+        if not self.msp430x:
+            self.emit('{} = ({} + {}) & 0xffff'.format(var, base, x))
+        elif extended:
+            # 20 bit offset, wrap around works for negative offsets too
+            self.emit('{} = ({} + {}) & 0xfffff'.format(var, base, x))
+        else:
+            self.emit('b = {}'.format(base))
+            self.emit('{var} = (b + {x}) & 0xffff if b < 0x10000 else (b + ({x} ^ 0x8000) - 0x8000) & 0xfffff'.format(
+                var=var, x=x))
+
+    def operand(self, name, mode, reg, size, extended, hi):
+        """\
+        Emit code to fetch an operand (source addressing modes). Returns
+        ('value', expression) or ('address', variable).
+        """
+        mask = SIZES[size][0]
+        x = name + 'x'
+        a = name + 'a'
+        if mode == 0:
+            if reg == 3:
+                return 'value', '0'
+            return 'value', 'R[{}]'.format(reg) if size == 'a' else '(R[{}] & 0x{:x})'.format(reg, mask)
+        elif mode == 1:
+            if reg == 3:
+                return 'value', '1'
+            self.fetch(x)
+            if extended:
+                self.emit('{x} |= 0x{hi:x}0000'.format(x=x, hi=hi))
+            if reg == 0:    # symbolic, relative to the address of the offset word
+                self.index(a, 'pc - 2', x, extended)
+            elif reg == 2:  # absolute
+                self.emit('{} = {}'.format(a, x))
+            else:
+                self.index(a, 'R[{}]'.format(reg), x, extended)
+            return 'address', a
+        elif mode == 2:
+            if reg == 2:
+                return 'value', '4'
+            elif reg == 3:
+                return 'value', '2'
+            self.emit('{} = R[{}]'.format(a, reg))
+            return 'address', a
+        else:
+            if reg == 2:
+                return 'value', '8'
+            elif reg == 3:
+                return 'value', '0x{:x}'.format(mask)
+            elif reg == 0:  # immediate
+                self.fetch(x)
+                if extended:
+                    self.emit('{x} = ({x} | 0x{hi:x}0000) & 0x{mask:x}'.format(x=x, hi=hi, mask=mask))
+                elif size == 'b':
+                    self.emit('{x} &= 0xff'.format(x=x))
+                return 'value', x
+            # indirect auto increment
+            increment = {'b': 1, 'w': 2, 'a': 4}[size]
+            if reg == 1 and increment == 1:
+                increment = 2   # SP stays aligned
+            self.emit('{} = R[{}]'.format(a, reg))
+            self.emit('R[{}] = ({} + {}) & 0x{:x}'.format(reg, a, increment, self.address_mask))
+            return 'address', a
+
+    def destination(self, mode, reg, extended, hi):
+        """Emit code to fetch a destination operand. Returns ('register', n) or ('address', variable)."""
+        if mode == 0:
+            return 'register', reg
+        self.fetch('dx')
+        if extended:
+            self.emit('dx |= 0x{:x}0000'.format(hi))
+        if reg == 0:
+            self.index('da', 'pc - 2', 'dx', extended)
+        elif reg == 2:
+            self.emit('da = dx')
+        else:
+            self.index('da', 'R[{}]'.format(reg), 'dx', extended)
+        return 'address', 'da'
+
+    def read(self, operand, size):
+        """expression to read a value of a fetched operand"""
+        kind, value = operand
+        if kind == 'value':
+            return value
+        elif kind == 'address':
+            return '{}({})'.format(SIZES[size][2], value)
+        else:   # register
+            if value == 3:
+                return '0'
+            return 'R[{}]'.format(value) if size == 'a' else '(R[{}] & 0x{:x})'.format(value, SIZES[size][0])
+
+    def write(self, operand, size, value, indent=1):
+        """emit code to write the result to an operand"""
+        kind, target = operand
+        if kind == 'address':
+            self.emit('{}({}, {})'.format(SIZES[size][3], target, value), indent)
+        elif kind == 'register':
+            if target == 0:
+                self.emit('R[0] = {} & 0x{:x}'.format(value, self.address_mask & ~1), indent)
+            elif target != 3:
+                self.emit('R[{}] = {}'.format(target, value), indent)
+        # immediate values and constants are not written
+
+    def flags(self, size, carry=None, overflow=None, indent=1):
+        """emit code to update the status bits from the result r"""
+        mask, msb = SIZES[size][:2]
+        self.emit('sr = R[2] & 0xfef8', indent)
+        self.emit('if r & 0x{:x}: sr |= 4'.format(msb), indent)
+        self.emit('elif not r: sr |= 2', indent)
+        if carry is not None:
+            self.emit('if {}: sr |= 1'.format(carry), indent)
+        if overflow is not None:
+            self.emit('if ({}) & 0x{:x}: sr |= 0x100'.format(overflow, msb), indent)
+        self.emit('R[2] = sr', indent)
+
+    def alu(self, name, size, carry_in='(R[2] & 1)', indent=1):
+        """\
+        Emit the operation of a two operand instruction with s and d as
+        inputs, setting r. Returns True if the result is written back.
+        """
+        mask = SIZES[size][0]
+        if name == 'mov':
+            self.emit('r = s', indent)
+            return True
+        elif name in ('add', 'addc'):
+            self.emit('t = d + s{}'.format(' + ' + carry_in if name == 'addc' else ''), indent)
+            self.emit('r = t & 0x{:x}'.format(mask), indent)
+            self.flags(size, 't > 0x{:x}'.format(mask), '~(s ^ d) & (s ^ r)', indent)
+            return True
+        elif name in ('sub', 'subc', 'cmp'):
+            self.emit('t = d + (~s & 0x{:x}) + {}'.format(mask, carry_in if name == 'subc' else '1'), indent)
+            self.emit('r = t & 0x{:x}'.format(mask), indent)
+            self.flags(size, 't > 0x{:x}'.format(mask), '(s ^ d) & (d ^ r)', indent)
+            return name != 'cmp'
+        elif name == 'dadd':
+            self.emit('r, t = bcd_add(s, d, {}, {})'.format(carry_in, {'b': 2, 'w': 4, 'a': 5}[size]), indent)
+            self.flags(size, 't', indent=indent)
+            return True
+        elif name in ('and', 'bit'):
+            self.emit('r = d & s', indent)
+            self.flags(size, 'r', indent=indent)
+            return name == 'and'
+        elif name == 'xor':
+            self.emit('r = d ^ s', indent)
+            self.flags(size, 'r', 's & d', indent)
+            return True
+        elif name == 'bic':
+            self.emit('r = d & ~s & 0x{:x}'.format(mask), indent)
+            return True
+        elif name == 'bis':
+            self.emit('r = d | s', indent)
+            return True
+        raise ValueError('unknown operation {}'.format(name))
+
+    def repeat(self, extension_word):
+        """Emit a loop header for repeated register instructions, return the indent."""
+        if extension_word & 0x80:
+            self.emit('for i in range((R[{}] & 0xf) + 1):'.format(extension_word & 0xf))
+        else:
+            count = (extension_word & 0xf) + 1
+            if count == 1:
+                return 1
+            self.emit('for i in range({}):'.format(count))
+        return 2
+
+    # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def double_operand(self, opcode, extension_word):
+        name = disassemble.doubleOperandInstructions[(opcode >> 12) & 0xf]
+        src = (opcode >> 8) & 0xf
+        ad = (opcode >> 7) & 1
+        bytemode = (opcode >> 6) & 1
+        asrc = (opcode >> 4) & 3
+        dst = opcode & 0xf
+        extended = extension_word is not None
+        size = self.size(bytemode, extension_word)
+        self.emit('pc = R[0] + 2')
+        if extended and asrc == 0 and ad == 0:
+            # register mode: repetition and zero carry
+            self.emit('R[0] = pc')
+            indent = self.repeat(extension_word)
+            carry_in = '0' if extension_word & 0x100 else '(R[2] & 1)'
+            self.emit('s = {}'.format(self.read(('register', src), size)), indent)
+            self.emit('d = {}'.format(self.read(('register', dst), size)), indent)
+            if self.alu(name, size, carry_in, indent):
+                self.write(('register', dst), size, 'r', indent)
+            return
+        source = self.operand('s', asrc, src, size, extended, (extension_word or 0) >> 7 & 0xf)
+        destination = self.destination(ad, dst, extended, (extension_word or 0) & 0xf)
+        self.emit('R[0] = pc')
+        self.emit('s = {}'.format(self.read(source, size)))
+        if name != 'mov':
+            self.emit('d = {}'.format(self.read(destination, size)))
+        if self.alu(name, size):
+            self.write(destination, size, 'r')
+
+    def single_operand(self, opcode, extension_word):
+        name = disassemble.singleOperandInstructions[(opcode >> 7) & 0x1f][0]
+        bytemode = (opcode >> 6) & 1
+        asrc = (opcode >> 4) & 3
+        reg = opcode & 0xf
+        extended = extension_word is not None
+        size = self.size(bytemode, extension_word)
+        mask, msb = SIZES[size][:2]
+        self.emit('pc = R[0] + 2')
+        if name == 'reti':
+            self.emit('sr = rw(R[1])')
+            self.emit('pc = rw(R[1] + 2)')
+            self.emit('R[1] = (R[1] + 4) & 0x{:x}'.format(self.address_mask))
+            if self.msp430x:
+                self.emit('R[2] = sr & 0x0fff')
+                self.emit('R[0] = pc | ((sr & 0xf000) << 4)')
+            else:
+                self.emit('R[2] = sr')
+                self.emit('R[0] = pc')
+            return
+        indent = 1
+        if asrc == 0:
+            operand = ('register', reg)
+            self.emit('R[0] = pc')
+            carry_in = '(R[2] & 1)'
+            if extended:
+                indent = self.repeat(extension_word)
+                if extension_word & 0x100:
+                    carry_in = '0'
+        else:
+            operand = self.operand('s', asrc, reg, size, extended, (extension_word or 0) & 0xf)
+            self.emit('R[0] = pc')
+            carry_in = '(R[2] & 1)'
+        if name in ('push', 'call'):
+            self.emit('s = {}'.format(self.read(operand, size)), indent)
+            if name == 'push':
+                self.emit('R[1] = (R[1] - {}) & 0x{:x}'.format(4 if size == 'a' else 2, self.address_mask), indent)
+                self.emit('{}(R[1], s)'.format(SIZES[size][3]), indent)
+            else:
+                self.emit('R[1] = (R[1] - 2) & 0x{:x}'.format(self.address_mask), indent)
+                self.emit('ww(R[1], R[0])', indent)
+                self.emit('R[0] = s & 0xfffe', indent)
+            return
+        self.emit('d = {}'.format(self.read(operand, size)), indent)
+        if name == 'rrc':
+            self.emit('r = (d >> 1) | ({} and 0x{:x})'.format(carry_in, msb), indent)
+            self.flags(size, 'd & 1', indent=indent)
+        elif name == 'rra':
+            self.emit('r = (d >> 1) | (d & 0x{:x})'.format(msb), indent)
+            self.flags(size, 'd & 1', indent=indent)
+        elif name == 'swpb':
+            self.emit('r = (d & 0xf0000) | ((d << 8) & 0xff00) | ((d >> 8) & 0xff)', indent)
+        elif name == 'sxt':
+            self.emit('r = ((d & 0x7f) - (d & 0x80)) & 0x{:x}'.format(mask), indent)
+            self.flags(size, 'r', indent=indent)
+        self.write(operand, size, 'r', indent)
+
+    def jump(self, opcode):
+        name = disassemble.jumpInstructions[(opcode >> 10) & 0x7]
+        offset = (opcode & 0x3ff) << 1
+        if offset & 0x400:
+            offset -= 0x800
+        condition = {
+            'jnz': 'not R[2] & 2',
+            'jz': 'R[2] & 2',
+            'jnc': 'not R[2] & 1',
+            'jc': 'R[2] & 1',
+            'jn': 'R[2] & 4',
+            'jge': '(not R[2] & 4) == (not R[2] & 0x100)',
+            'jl': '(not R[2] & 4) != (not R[2] & 0x100)',
+            'jmp': None,
+        }[name]
+        target = '(R[0] + {}) & 0x{:x}'.format(offset + 2, self.address_mask)
+        if condition is None:
+            self.emit('R[0] = {}'.format(target))
+        else:
+            self.emit('if {}:'.format(condition))
+            self.emit('R[0] = {}'.format(target), 2)
+            self.emit('else:')
+            self.emit('R[0] += 2', 2)
+
+    def size(self, bytemode, extension_word):
+        if extension_word is not None and not extension_word & 0x40:
+            # A/L bit cleared: address word (20 bits) or reserved
+            return 'a'
+        return 'b' if bytemode else 'w'
+
+    def address_instruction(self, opcode):
+        """MSP430X address instructions: mova, cmpa, adda, suba, rotations. Returns the cycles."""
+        src = (opcode >> 8) & 0xf
+        dst = opcode & 0xf
+        insnid = (opcode >> 4) & 0xf
+        self.emit('pc = R[0] + 2')
+        cycles = 1
+        if insnid in (0, 1, 2, 3):
+            if insnid == 0:
+                self.emit('a = R[{}]'.format(src))
+            elif insnid == 1:
+                self.emit('a = R[{}]'.format(src))
+                self.emit('R[{}] = (a + 4) & 0xfffff'.format(src))
+            elif insnid == 2:
+                self.fetch('x')
+                self.emit('a = 0x{:x}0000 | x'.format(src))
+            else:
+                self.fetch('x')
+                self.emit('a = (R[{}] + (x ^ 0x8000) - 0x8000) & 0xfffff'.format(src))
+            self.emit('R[0] = pc')
+            self.write(('register', dst), 'a', 'ra(a)')
+            cycles = 3
+        elif insnid in (4, 5):
+            size = 'a' if insnid == 4 else 'w'
+            mask, msb = SIZES[size][:2]
+            count = ((opcode >> 10) & 3) + 1
+            operation = (opcode >> 8) & 3
+            self.emit('R[0] = pc')
+            self.emit('r = R[{}] & 0x{:x}'.format(dst, mask))
+            self.emit('c = R[2] & 1')
+            self.emit('for i in range({}):'.format(count))
+            if operation == 0:      # rrcm
+                self.emit('r, c = (r >> 1) | (c and 0x{:x}), r & 1'.format(msb), 2)
+            elif operation == 1:    # rram
+                self.emit('r, c = (r >> 1) | (r & 0x{:x}), r & 1'.format(msb), 2)
+            elif operation == 2:    # rlam
+                self.emit('r, c = (r << 1) & 0x{:x}, r & 0x{:x}'.format(mask, msb), 2)
+            else:                   # rrum
+                self.emit('r, c = r >> 1, r & 1', 2)
+            self.flags(size, 'c')
+            self.write(('register', dst), size, 'r')
+            cycles = count
+        elif insnid in (6, 7):
+            self.fetch('x')
+            if insnid == 6:
+                self.emit('a = 0x{:x}0000 | x'.format(dst))
+            else:
+                self.emit('a = (R[{}] + (x ^ 0x8000) - 0x8000) & 0xfffff'.format(dst))
+            self.emit('R[0] = pc')
+            self.emit('wa(a, R[{}])'.format(src))
+            cycles = 4
+        else:
+            if insnid < 12:
+                self.fetch('x')
+                self.emit('s = 0x{:x}0000 | x'.format(src))
+                cycles = 2
+            else:
+                self.emit('s = R[{}]'.format(src))
+            self.emit('R[0] = pc')
+            name = ('mova', 'cmpa', 'adda', 'suba')[insnid & 3]
+            if name == 'mova':
+                self.write(('register', dst), 'a', 's')
+            else:
+                self.emit('d = R[{}]'.format(dst))
+                if self.alu(name[:3], 'a'):
+                    self.write(('register', dst), 'a', 'r')
+        if dst == 0 and insnid not in (6, 7, 9, 13):
+            cycles += 2
+        return cycles
+
+    def calla(self, opcode):
+        """MSP430X calla, returns the cycles"""
+        mode = (opcode >> 4) & 0xf
+        reg = opcode & 0xf
+        self.emit('pc = R[0] + 2')
+        if mode == 4:
+            self.emit('t = R[{}]'.format(reg))
+        elif mode == 5:
+            self.fetch('x')
+            self.emit('t = ra((R[{}] + (x ^ 0x8000) - 0x8000) & 0xfffff)'.format(reg))
+        elif mode == 6:
+            self.emit('t = ra(R[{}])'.format(reg))
+        elif mode == 7:
+            self.emit('t = ra(R[{}])'.format(reg))
+            self.emit('R[{0}] = (R[{0}] + 4) & 0xfffff'.format(reg))
+        elif mode == 8:
+            self.fetch('x')
+            self.emit('t = ra(0x{:x}0000 | x)'.format(reg))
+        elif mode == 9:
+            self.fetch('x')
+            self.emit('t = ra((pc - 2 + (0x{:x}0000 | x)) & 0xfffff)'.format(reg))
+        elif mode == 11:
+            self.fetch('x')
+            self.emit('t = 0x{:x}0000 | x'.format(reg))
+        else:
+            return None
+        self.emit('R[1] = (R[1] - 4) & 0xfffff')
+        self.emit('wa(R[1], pc)')
+        self.emit('R[0] = t & 0xffffe')
+        return 5
+
+    def pushm_popm(self, opcode):
+        """MSP430X pushm and popm, returns the cycles"""
+        count = ((opcode >> 4) & 0xf) + 1
+        reg = opcode & 0xf
+        wide = not opcode & 0x100
+        step = 4 if wide else 2
+        self.emit('R[0] += 2')
+        if opcode & 0x200:  # popm, reg is the lowest register
+            for r in range(reg, reg + count):
+                if r < 16:
+                    self.emit('R[{}] = {}(R[1])'.format(r, 'ra' if wide else 'rw'))
+                self.emit('R[1] = (R[1] + {}) & 0xfffff'.format(step))
+        else:               # pushm, reg is the highest register
+            for r in range(reg, reg - count, -1):
+                self.emit('R[1] = (R[1] - {}) & 0xfffff'.format(step))
+                self.emit('{}(R[1], R[{}])'.format('wa' if wide else 'ww', r % 16))
+        return 2 + count * (2 if wide else 1)
+
+
+_code_cache = {}
+
+
+def compile_instruction(opcode, extension_word=None, msp430x=False):
+    """\
+    Return the code object (to be used with types.FunctionType) for the
+    given opcode or None if it is not a valid instruction. The code objects
+    are cached.
+    """
+    key = (opcode, extension_word, msp430x)
+    try:
+        return _code_cache[key]
+    except KeyError:
+        pass
+    generator = CodeGenerator(msp430x)
+    decoded = disassemble.decode(opcode, msp430x, extension_word)
+    kind = decoded[0]
+    cycles = None
+    if msp430x and 0x1340 <= opcode < 0x1400 and extension_word is None:
+        # calla shares the encoding space of reti (single operand table)
+        cycles = generator.calla(opcode)
+    elif kind == disassemble.DECODED_INSTRUCTION:
+        if (opcode & 0xf000) == 0x1000:
+            generator.single_operand(opcode, extension_word)
+        else:
+            generator.double_operand(opcode, extension_word)
+        # cycles from the decoder plus one per word
+        words = 1 + decoded[4] + decoded[6] + decoded[10] + (extension_word is not None)
+        cycles = decoded[7] + words
+    elif kind == disassemble.DECODED_JUMP:
+        generator.jump(opcode)
+        cycles = decoded[3] + 1
+    elif kind == disassemble.DECODED_EXTENDED and extension_word is None:
+        if (opcode & 0xf000) == 0x0000:
+            cycles = generator.address_instruction(opcode)
+        elif (opcode & 0xfc00) == 0x1400:
+            cycles = generator.pushm_popm(opcode)
+    if cycles is None:
+        code = None
+    else:
+        code = compile(generator.source(cycles), '<msp430 opcode 0x{:04x}>'.format(opcode), 'exec')
+        code = [c for c in code.co_consts if isinstance(c, types.CodeType)][0]
+    _code_cache[key] = code
+    return code
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+class Simulator(object):
+    """\
+    Simulate a MSP430(X) CPU with a flat memory. The memory is initialized
+    from a msp430.memory.Memory instance, undefined locations read as 0xff.
+    """
+
+    def __init__(self, memory=None, msp430x=False):
+        self.msp430x = msp430x
+        self.address_mask = 0xfffff if msp430x else 0xffff
+        # some spare bytes at the end so that the words of an instruction at the
+        # end of the address space can be fetched without wrapping (PC itself
+        # wraps around, see run())
+        self.memory = bytearray(b'\xff' * (self.address_mask + 5))
+        self.R = [0] * 16
+        self.cycles = 0
+        self.instructions = 0
+        self.pending_interrupts = set()
+        self.breakpoints = set()
+        self.stop_reason = None
+        self._io_read = {}
+        self._io_write = {}
+        self._io_limit = 0
+        self._handlers = {}
+        self._namespace = {
+            'M': self.memory,
+            'rb': self.read_byte,
+            'rw': self.read_word,
+            'ra': self.read_address,
+            'wb': self.write_byte,
+            'ww': self.write_word,
+            'wa': self.write_address,
+            'bcd_add': bcd_add,
+            'range': range,
+        }
+        if memory is not None:
+            self.load(memory)
+
+    def load(self, memory):
+        """Copy the contents of a msp430.memory.Memory instance, reset the CPU."""
+        for segment in memory.segments:
+            start = segment.startaddress
+            self.memory[start:start + len(segment.data)] = bytearray(segment.data)
+        self.reset()
+
+    def reset(self):
+        """Reset the CPU, PC is loaded from the reset vector."""
+        self.R[:] = [0] * 16
+        self.R[0] = self.read_word(0xfffe)
+        self.pending_interrupts.clear()
+        self.cycles = 0
+        self.instructions = 0
+
+    # - - - memory access (with hooks for peripherals) - - -
+
+    def add_peripheral(self, start, end, read=None, write=None):
+        """\
+        Register hooks for the address range start (inclusive) to end
+        (exclusive). read(address, size) is called for reads and has to
+        return the value, write(address, value, size) is called for writes.
+        size is 1, 2 or 4 (20 bit values). If a hook is None, the memory is
+        accessed as usual.
+        """
+        for address in range(start, end):
+            if read is not None:
+                self._io_read[address] = read
+            if write is not None:
+                self._io_write[address] = write
+        self._io_limit = max(self._io_limit, end)
+
+    def read_byte(self, address):
+        address &= self.address_mask
+        if address < self._io_limit and address in self._io_read:
+            return self._io_read[address](address, 1) & 0xff
+        return self.memory[address]
+
+    def read_word(self, address):
+        address &= self.address_mask & ~1
+        if address < self._io_limit and address in self._io_read:
+            return self._io_read[address](address, 2) & 0xffff
+        memory = self.memory
+        return memory[address] | (memory[address + 1] << 8)
+
+    def read_address(self, address):
+        """read a 20 bit value (two words)"""
+        address &= self.address_mask & ~1
+        if address < self._io_limit and address in self._io_read:
+            return self._io_read[address](address, 4) & 0xfffff
+        memory = self.memory
+        return (memory[address] | (memory[address + 1] << 8) | (memory[address + 2] << 16)) & 0xfffff
+
+    def write_byte(self, address, value):
+        address &= self.address_mask
+        if address < self._io_limit and address in self._io_write:
+            self._io_write[address](address, value & 0xff, 1)
+        else:
+            self.memory[address] = value & 0xff
+
+    def write_word(self, address, value):
+        address &= self.address_mask & ~1
+        if address < self._io_limit and address in self._io_write:
+            self._io_write[address](address, value & 0xffff, 2)
+        else:
+            self.memory[address] = value & 0xff
+            self.memory[address + 1] = (value >> 8) & 0xff
+
+    def write_address(self, address, value):
+        """write a 20 bit value (two words)"""
+        address &= self.address_mask & ~1
+        if address < self._io_limit and address in self._io_write:
+            self._io_write[address](address, value & 0xfffff, 4)
+        else:
+            self.memory[address:address + 4] = bytearray([value & 0xff, (value >> 8) & 0xff, (value >> 16) & 0x0f, 0])
+
+    # - - - execution - - -
+
+    def handler(self, opcode, extension_word=None):
+        """Return the handler function for an opcode."""
+        key = opcode if extension_word is None else (extension_word << 16) | opcode
+        try:
+            return self._handlers[key]
+        except KeyError:
+            pass
+        if extension_word is None and self.msp430x and (opcode & 0xf800) == 0x1800:
+            handler = self._extension_word_handler(opcode)
+        else:
+            code = compile_instruction(opcode, extension_word, self.msp430x)
+            if code is None:
+                handler = self._illegal_instruction_handler(opcode)
+            else:
+                handler = types.FunctionType(code, self._namespace)
+        self._handlers[key] = handler
+        return handler
+
+    def _extension_word_handler(self, extension_word):
+        memory = self.memory
+        handlers = self._handlers
+        key = extension_word << 16
+
+        address_mask = self.address_mask
+
+        def handler(R):
+            pc = R[0] = (R[0] + 2) & address_mask
+            opcode = memory[pc] | (memory[pc + 1] << 8)
+            try:
+                function = handlers[key | opcode]
+            except KeyError:
+                function = self.handler(opcode, extension_word)
+            return function(R)
+        return handler
+
+    def _illegal_instruction_handler(self, opcode):
+        def handler(R):
+            raise SimulatorError('illegal instruction 0x{:04x} at 0x{:04x}'.format(opcode, R[0]))
+        return handler
+
+    def request_interrupt(self, vector):
+        """\
+        Request an interrupt, given the address of the vector. It is serviced
+        when GIE is set, the highest vector address has the highest priority.
+        """
+        self.pending_interrupts.add(vector)
+
+    def service_interrupt(self):
+        """Accept the pending interrupt with the highest priority (if GIE is set). Returns true if done."""
+        R = self.R
+        if not self.pending_interrupts or not R[2] & GIE:
+            return False
+        vector = max(self.pending_interrupts)
+        self.pending_interrupts.remove(vector)
+        pc = R[0]
+        sr = R[2]
+        if self.msp430x:
+            sr = (sr & 0x0fff) | ((pc >> 4) & 0xf000)
+        R[1] = (R[1] - 2) & self.address_mask
+        self.write_word(R[1], pc)
+        R[1] = (R[1] - 2) & self.address_mask
+        self.write_word(R[1], sr)
+        R[2] = 0
+        R[0] = self.read_word(vector)
+        self.cycles += INTERRUPT_CYCLES
+        return True
+
+    def stop(self, reason='stopped'):
+        """Stop run() after the current instruction (e.g. from a peripheral hook)."""
+        self.stop_reason = reason
+
+    def step(self):
+        """Execute one instruction (or accept an interrupt)."""
+        if not self.service_interrupt():
+            pc = self.R[0] = self.R[0] & self.address_mask
+            opcode = self.memory[pc] | (self.memory[pc + 1] << 8)
+            self.cycles += self.handler(opcode)(self.R)
+            self.instructions += 1
+
+    def run(self, max_cycles=None, max_instructions=None):
+        """\
+        Run until a limit is reached, a breakpoint is hit, the CPU is switched
+        off without pending interrupts or stop() is called. Returns the
+        reason as string.
+        """
+        R = self.R
+        memory = self.memory
+        handlers = self._handlers
+        get_handler = self.handler
+        breakpoints = self.breakpoints
+        pending = self.pending_interrupts
+        address_mask = self.address_mask
+        cycles = self.cycles
+        cycle_limit = float('inf') if max_cycles is None else cycles + max_cycles
+        instruction_limit = float('inf') if max_instructions is None else self.instructions + max_instructions
+        count = self.instructions
+        self.stop_reason = None
+        try:
+            while True:
+                if R[2] & CPUOFF or pending:
+                    self.cycles = cycles
+                    if self.service_interrupt():
+                        cycles = self.cycles
+                    elif R[2] & CPUOFF:
+                        self.stop_reason = 'cpu off'
+                        break
+                pc = R[0]
+                if pc > address_mask:
+                    pc = R[0] = pc & address_mask   # wrap around at the end of the address space
+                if breakpoints and pc in breakpoints and count != self.instructions:
+                    self.stop_reason = 'breakpoint'
+                    break
+                opcode = memory[pc] | (memory[pc + 1] << 8)
+                try:
+                    cycles += handlers[opcode](R)
+                except KeyError:
+                    cycles += get_handler(opcode)(R)
+                count += 1
+                if cycles >= cycle_limit:
+                    self.stop_reason = 'cycle limit'
+                    break
+                if count >= instruction_limit:
+                    self.stop_reason = 'instruction limit'
+                    break
+                if self.stop_reason is not None:
+                    break
+        finally:
+            self.cycles = cycles
+            self.instructions = count
+        return self.stop_reason
+
+    def registers(self):
+        """Return a string with the register dump."""
+        lines = []
+        for row in range(0, 16, 4):
+            lines.append('  '.join('{:>3}: 0x{:05x}'.format(disassemble.regnames[r], self.R[r])
+                                   for r in range(row, row + 4)))
+        return '\n'.join(lines)
+
+
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def main():
+    import sys
+    import time
+    import msp430.memory
+    import msp430.commandline_helper
+
+    class SimulatorTool(msp430.commandline_helper.CommandLineTool):
+        description = """\
+Execute a MSP430(X) binary in a simulator.
+
+Peripherals are not simulated. --putchar and --exit provide addresses that can
+be written by the program to output characters and to end the simulation
+(e.g. for unit tests), the exit code is the value written.
+"""
+
+        def configure_parser(self):
+            self.parser_add_input(nargs='+')
+            self.parser_add_verbose()
+
+            self.parser.add_argument(
+                '-x', '--msp430x',
+                action='store_true',
+                default=False,
+                help='Enable MSP430X instruction set')
+
+            self.parser.add_argument(
+                '--max-cycles',
+                type=int,
+                metavar='N',
+                help='stop after this number of cycles')
+
+            self.parser.add_argument(
+                '--max-instructions',
+                type=int,
+                metavar='N',
+                help='stop after this number of instructions')
+
+            self.parser.add_argument(
+                '--break',
+                dest='breakpoints',
+                action='append',
+                default=[],
+                type=lambda x: int(x, 0),
+                metavar='ADDRESS',
+                help='stop when PC reaches the address (can be given multiple times)')
+
+            self.parser.add_argument(
+                '--putchar',
+                type=lambda x: int(x, 0),
+                metavar='ADDRESS',
+                help='bytes written to this address are output on stdout')
+
+            self.parser.add_argument(
+                '--exit',
+                type=lambda x: int(x, 0),
+                metavar='ADDRESS',
+                help='a write to this address ends the simulation, the value is the exit code')
+
+        def run(self, args):
+            image = msp430.memory.Memory()
+            for fileobj in args.SRC:
+                for segment in msp430.memory.load(fileobj.name, fileobj, args.input_format).segments:
+                    image.segments.append(segment)
+            sim = Simulator(image, msp430x=args.msp430x)
+            sim.breakpoints.update(args.breakpoints)
+            exit_code = []
+
+            if args.putchar is not None:
+                output = getattr(sys.stdout, 'buffer', sys.stdout)
+
+                def putchar(address, value, size):
+                    output.write(bytearray([value & 0xff]))
+                    output.flush()
+                sim.add_peripheral(args.putchar, args.putchar + 2, write=putchar)
+
+            if args.exit is not None:
+                def do_exit(address, value, size):
+                    exit_code.append(value)
+                    sim.stop('exit')
+                sim.add_peripheral(args.exit, args.exit + 2, write=do_exit)
+
+            t_start = time.time()
+            reason = sim.run(max_cycles=args.max_cycles, max_instructions=args.max_instructions)
+            t_end = time.time()
+
+            if args.verbose:
+                sys.stderr.write('stopped: {} at 0x{:05x}\n'.format(reason, sim.R[0]))
+                sys.stderr.write('{}\n'.format(sim.registers()))
+                sys.stderr.write('{} instructions, {} cycles in {:.3f} s ({:.0f} instructions/s)\n'.format(
+                    sim.instructions, sim.cycles, t_end - t_start,
+                    sim.instructions / max(t_end - t_start, 1e-9)))
+            if exit_code:
+                sys.exit(exit_code[0])
+
+    SimulatorTool().main()
+
+
+if __name__ == '__main__':
+    main()
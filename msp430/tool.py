@@ -9,6 +9,7 @@
 # SPDX-License-Identifier:    BSD-3-Clause
 
 import sys
+from timeit import default_timer as clock
 
 COMMANDS = {
     'jtag': 'msp430.jtag.target',
@@ -27,13 +28,15 @@ COMMANDS = {
     'ld': 'msp430.asm.ld',
     'cpp': 'msp430.asm.cpp',
     'dis': 'msp430.asm.disassemble',
+    'build': 'msp430.asm.build',
 }
 
 
 def usage_error():
     sys.stderr.write(
         'Command line stub for python-msp430-tools\n'
-        'USAGE: {prog} COMMAND [args]\n'
+        'USAGE: {prog} [--timing] COMMAND [args]\n'
+        '       {prog} --benchmark [-n N] [COMMAND...]\n'
         'Supported COMMANDs are:\n'
         '{tools}'
         '\n'.format(
@@ -42,7 +45,113 @@ def usage_error():
     sys.exit(1)
 
 
+class Timing(object):
+    """\
+    Measure the phases of a command: import of the module, setting up the
+    command line parser, parsing the arguments and running.
+
+    The end of the setup and parse phases is detected by hooking the
+    parse_args() methods of optparse and argparse (the first call counts).
+    """
+
+    def __init__(self):
+        self.phases = []
+        self.t_last = clock()
+        self.parsing = None
+
+    def mark(self, phase):
+        """End the current phase, giving it a name"""
+        now = clock()
+        self.phases.append((phase, now - self.t_last))
+        self.t_last = now
+
+    def hook_parsers(self):
+        import optparse
+        import argparse
+        for cls in (optparse.OptionParser, argparse.ArgumentParser):
+            self._hook(cls)
+
+    def _hook(self, cls):
+        original = cls.parse_args
+        timing = self
+
+        def parse_args(*args, **kwargs):
+            if timing.parsing is not None:
+                return original(*args, **kwargs)
+            timing.parsing = True
+            timing.mark('setup')
+            try:
+                return original(*args, **kwargs)
+            finally:
+                timing.mark('parse')
+        cls.parse_args = parse_args
+
+    def report(self, output=sys.stderr):
+        total = sum(t for phase, t in self.phases)
+        for phase, t in self.phases:
+            output.write('{:<8} {:8.1f} ms\n'.format(phase, t * 1e3))
+        output.write('{:<8} {:8.1f} ms\n'.format('total', total * 1e3))
+
+
+def run_command(module_name, timing=None):
+    """Import the module of a command and run its main()"""
+    __import__(module_name)
+    module = sys.modules[module_name]
+    if timing is not None:
+        timing.mark('import')
+        timing.hook_parsers()
+    try:
+        #~ sys.stderr.write('running main() from %r\n' % module)
+        module.main()
+    finally:
+        if timing is not None:
+            timing.mark('run' if timing.parsing else 'main')
+            timing.report()
+
+
+def benchmark(args):
+    """\
+    Measure the cold start time of the commands (running "COMMAND --help" in a
+    new interpreter).
+    """
+    import argparse
+    import subprocess
+    import os
+
+    parser = argparse.ArgumentParser(
+        prog='{} --benchmark'.format(sys.argv[0]),
+        description=benchmark.__doc__)
+    parser.add_argument('COMMAND', nargs='*', help='commands to measure (default: all)')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='runs per command (default: %(default)s)')
+    args = parser.parse_args(args)
+    for command in args.COMMAND:
+        if command not in COMMANDS:
+            parser.error('unknown command: {}'.format(command))
+
+    def measure(cmdline):
+        times = []
+        with open(os.devnull, 'w') as null:
+            for n in range(args.repeat):
+                t_start = clock()
+                subprocess.call(cmdline, stdout=null, stderr=null)
+                times.append(clock() - t_start)
+        return min(times)
+
+    sys.stdout.write('{:<12} {:>10}\n'.format('command', 'min [ms]'))
+    sys.stdout.write('{:<12} {:10.1f}\n'.format('(python)', measure([sys.executable, '-c', 'pass']) * 1e3))
+    for command in args.COMMAND or sorted(COMMANDS):
+        t = measure([sys.executable, '-m', 'msp430.tool', command, '--help'])
+        sys.stdout.write('{:<12} {:10.1f}\n'.format(command, t * 1e3))
+
+
 def main():
+    timing = None
+    if len(sys.argv) > 1 and sys.argv[1] == '--benchmark':
+        benchmark(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == '--timing':
+        sys.argv.pop(1)
+        timing = Timing()
     if len(sys.argv) < 2:
         usage_error()
     else:
@@ -55,10 +164,7 @@ def main():
             # unsupported command
             usage_error()
         else:
-            __import__(module_name)
-            module = sys.modules[module_name]
-            #~ sys.stderr.write('running main() from %r\n' % module)
-            module.main()
+            run_command(module_name, timing)
 
 if __name__ == '__main__':
     main()